@@ -152,6 +152,17 @@ SCRAPY_FILES_PATH = './legco-data/files'
 #SCRAPY_FILES_PATH = '/legco-data/files'
 #SCRAPY_FILES_PATH = '/home/long/Desktop/legco-watch/files'
 
+# Cache of DOC/DOCX files converted to HTML, see raw.conversion
+DOC_CONVERSION_CACHE_PATH = './legco-data/conversion-cache'
+DOC_CONVERSION_CACHE_MAX_SIZE = 2 * 1024 ** 3
+# Where the results of the document parsers are cached: 'filesystem', 'django' or None to disable
+PARSE_CACHE_BACKEND = 'filesystem'
+PARSE_CACHE_PATH = './legco-data/parse-cache'
+# The Django cache used by the 'django' backend
+PARSE_CACHE_ALIAS = 'default'
+# 'production' or 'debug', where the hansard parser also dumps its trees and logs its progress
+PARSER_MODE = 'production'
+
 # Import settings local to this machine
 if os.environ["INSIDE_DOCKER"] == "TRUE":
     from .docker import *
@@ -0,0 +1,348 @@
+# -*- coding: utf-8 -*-
+"""
+Micro-benchmarks of the document processing, run on the fixture documents with
+
+$ python manage.py benchmark [name ...]
+
+Each benchmark is a function that takes the number of repeats and returns a list of lines to print.
+"""
+from collections import OrderedDict
+import glob
+import logging
+import os
+import re
+import shutil
+import tempfile
+import time
+import lxml.html
+from raw.docs.normalize import normalize_source
+from raw.names import MemberName
+from raw.models.constants import LANG_CN, LANG_EN
+
+
+FIXTURES_PATH = os.path.join(os.path.dirname(__file__), 'tests', 'fixtures')
+
+BENCHMARKS = OrderedDict()
+
+
+def benchmark(name):
+    """
+    Registers a benchmark function under name
+    """
+    def decorator(func):
+        BENCHMARKS[name] = func
+        return func
+    return decorator
+
+
+def best_time(func, repeat):
+    """
+    The shortest time taken by func over repeat runs, in seconds
+    """
+    best = None
+    for i in range(repeat):
+        start = time.time()
+        func()
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def fixtures(pattern='*.html'):
+    """
+    Returns a list of (uid, unicode source) of the fixture documents
+    """
+    res = []
+    for path in sorted(glob.glob(os.path.join(FIXTURES_PATH, pattern))):
+        with open(path, 'rb') as f:
+            res.append((os.path.splitext(os.path.basename(path))[0], f.read().decode('utf-8')))
+    return res
+
+
+def _replace_one_by_one(source):
+    # How CouncilAgenda and CouncilHansard used to normalize their source
+    source = re.sub(ur'[\u201c\u201d]', u'"', source)
+    source = re.sub(ur'[\u2019\u2018]', u"'", source)
+    for colon in (u'\uff1a', u'\ufe30', u'\ufe55'):
+        source = source.replace(colon, u':')
+    for char in (u'\n', u'\t', u'\u200d'):
+        source = source.replace(char, u'')
+    return source
+
+
+@benchmark('normalize')
+def normalize_benchmark(repeat):
+    lines = [u'{:<30} {:>8} {:>12} {:>12}'.format(u'document', u'chars', u'one by one', u'one pass')]
+    for uid, source in fixtures():
+        if normalize_source(source) != _replace_one_by_one(source):
+            raise AssertionError(u'Different results for {}'.format(uid))
+        before = best_time(lambda: _replace_one_by_one(source), repeat)
+        after = best_time(lambda: normalize_source(source), repeat)
+        lines.append(u'{:<30} {:>8} {:>10.2f}ms {:>10.2f}ms'.format(uid, len(source), before * 1000, after * 1000))
+    return lines
+
+
+def _debate(speeches, paragraphs):
+    # A hansard section with a long debate
+    html = [u'<div>']
+    for i in range(speeches):
+        html.append(u'<p><strong>MEMBER {}</strong> (in Cantonese): President, I speak on the Budget.</p>'.format(i))
+        html.extend([u'<p>A paragraph of the speech with <em>some</em> text.</p>'] * paragraphs)
+        if i % 10 == 0:
+            html.append(u'<p>(The President took the Chair)</p><hr>')
+    html.append(u'</div>')
+    return u''.join(html)
+
+
+@benchmark('dialogs')
+def dialogs_benchmark(repeat):
+    from raw.docs.hansard import CouncilHansard
+    hansard = CouncilHansard.__new__(CouncilHansard)
+    lines = [u'{:<30} {:>8} {:>12}'.format(u'speeches x paragraphs', u'elements', u'parse')]
+    for speeches, paragraphs in ((100, 5), (1000, 5), (10, 500)):
+        html = _debate(speeches, paragraphs)
+        # The elements are modified when parsed, so each run gets its own copy
+        copies = [list(lxml.html.fromstring(html)) for i in range(repeat)]
+        elements = len(copies[0])
+        elapsed = best_time(lambda: hansard.parse_dialogs(copies.pop()), repeat)
+        lines.append(u'{:<30} {:>8} {:>10.2f}ms'.format(u'{} x {}'.format(speeches, paragraphs), elements, elapsed * 1000))
+    return lines
+
+
+@benchmark('parse_modes')
+def parse_modes_benchmark(repeat):
+    from raw.docs import config
+    from raw.docs.hansard import CouncilHansard, logger
+    lines = [u'{:<30} {:>8} {:>12} {:>12} {:>12}'.format(u'document', u'chars', u'debug', u'production', u'dumped')]
+    folder = tempfile.mkdtemp()
+    debug = config.DEBUG._replace(fixtures_path=folder)
+    # Log the progress as the hansard parser used to, to a handler that discards it
+    level, propagate = logger.level, logger.propagate
+    handler = logging.NullHandler()
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    logger.addHandler(handler)
+    try:
+        documents = []
+        for uid, source in fixtures('council_hansard-*.html'):
+            documents.append((uid, source))
+            # The same with a long debate in the motions, like the filibusters
+            debate = _debate(500, 5)[len(u'<div>'):-len(u'</div>')]
+            documents.append((uid + u'+debate', source.replace(u'<p><strong>NEXT MEETING</strong>', debate + u'<p><strong>NEXT MEETING</strong>')))
+        for uid, source in documents:
+            args = (uid, LANG_EN if u'-e' in uid else LANG_CN, source, uid.split('-')[1])
+            debug_time = best_time(lambda: CouncilHansard(*args, question_index={}, config=debug), repeat)
+            production_time = best_time(lambda: CouncilHansard(*args, question_index={}, config=config.PRODUCTION), repeat)
+            # Written by each parse in debug mode
+            dumped = sum(os.path.getsize(os.path.join(folder, name)) for name in os.listdir(folder))
+            for name in os.listdir(folder):
+                os.remove(os.path.join(folder, name))
+            lines.append(u'{:<30} {:>8} {:>10.2f}ms {:>10.2f}ms {:>10}kB'.format(
+                uid, len(source), debug_time * 1000, production_time * 1000, dumped / 1024))
+    finally:
+        logger.removeHandler(handler)
+        logger.setLevel(level)
+        logger.propagate = propagate
+        shutil.rmtree(folder)
+    return lines
+
+
+class _BucketMatcher(object):
+    # How NameMatcher used to match names: scanning all the names whose last name has the same first letter
+    def __init__(self, names):
+        self._index = {}
+        for n in names:
+            if n[0].is_valid():
+                self._index.setdefault(n[0].last_name[0].lower(), []).append(n)
+
+    def match(self, name):
+        if not name.is_valid():
+            return None
+        for n in self._index.get(name.last_name[0].lower(), ()):
+            if n[0] == name:
+                return n
+        return None
+
+
+# Parts of made up names, for when there are no members in the database
+_LAST_NAMES = [u'Chan', u'Wong', u'Leung', u'Lee', u'Cheung', u'Tsang', u'Lau', u'Ho', u'Ng', u'Wu', u'Lam',
+               u'Kwok', u'Lo', u'Yip', u'Tam', u'Fung', u'Ip', u'Chow', u'Tong', u'Mok']
+_CN_LAST_NAMES = u'陳黃梁李張曾劉何吳胡林郭盧葉譚馮葉周唐莫'
+_ENGLISH_NAMES = [u'Albert', u'Emily', u'James', u'Regina', u'Jasper', u'Alan', u'Cyd', u'Helena', u'Tommy',
+                  u'Gary', u'Claudia', u'Starry', u'Kenneth', u'Dennis', u'Charles', u'Priscilla']
+_SYLLABLES = [u'Ka', u'Ki', u'Wai', u'Kwok', u'Yok', u'Sing', u'Chi', u'Man', u'Kin', u'Yee', u'Ming', u'Hing']
+_CN_CHARACTERS = u'家麒偉國玉成志文健儀明興'
+
+
+def _member_names():
+    """
+    (English name, Chinese name) of the members in the database, or of made up members
+    """
+    from django.db import DatabaseError
+    from raw.models import RawMember
+    try:
+        names = list(RawMember.objects.values_list('name_e', 'name_c'))
+    except DatabaseError:
+        names = []
+    if names:
+        return u'RawMember', names
+    names = []
+    for i in range(600):
+        last = i % len(_LAST_NAMES)
+        given = (_SYLLABLES[i % 12], _SYLLABLES[(i // 12) % 12].lower())
+        english = u'{} {} {}-{}'.format(_ENGLISH_NAMES[i % len(_ENGLISH_NAMES)], _LAST_NAMES[last].upper(), *given)
+        chinese = _CN_LAST_NAMES[last] + _CN_CHARACTERS[i % 12] + _CN_CHARACTERS[(i // 12) % 12]
+        names.append((english, chinese))
+    return u'made up', names
+
+
+def _name_queries(english, chinese):
+    # The ways the names are written in the documents
+    name = MemberName(english)
+    queries = [english, u'Hon {}'.format(english), chinese, u'{}議員'.format(chinese)]
+    if name.chinese_name is not None:
+        queries.append(u'{} {}'.format(name.last_name, name.chinese_name))
+    if name.english_name is not None:
+        queries.append(u'{} {}'.format(name.english_name, name.last_name))
+    return queries
+
+
+@benchmark('names')
+def names_benchmark(repeat):
+    from raw.names import NameMatcher
+    source, members = _member_names()
+    names = [(MemberName(english), english) for english, chinese in members]
+    names += [(MemberName(chinese), chinese) for english, chinese in members]
+    queries = [MemberName(xx) for english, chinese in members for xx in _name_queries(english, chinese)]
+    lines = [u'{} names of {} members, {} queries'.format(len(names), source, len(queries)),
+             u'{:<20} {:>8} {:>12} {:>14}'.format(u'matcher', u'matched', u'build', u'queries/s')]
+    results = []
+    for label, matcher_class in ((u'first letter scan', _BucketMatcher), (u'hash index', NameMatcher)):
+        build = best_time(lambda: matcher_class(names), repeat)
+        matcher = matcher_class(names)
+        matched = [matcher.match(xx) for xx in queries]
+        elapsed = best_time(lambda: [matcher.match(xx) for xx in queries], repeat)
+        results.append(matched)
+        lines.append(u'{:<20} {:>8} {:>10.2f}ms {:>14.0f}'.format(
+            label, len([xx for xx in matched if xx is not None]), build * 1000, len(queries) / elapsed))
+    if results[0] != results[1]:
+        raise AssertionError(u'The matchers give different results')
+    return lines
+
+
+def _parse_formatted(name):
+    # How MemberName used to parse English names: formatting and compiling the patterns on each call
+    from raw.names import CNAME_RE, ENAME_RE, LNAME_CAP_RE, LNAME_RE, TITLE_RE
+    patterns = [
+        ur'^{}? ?{} {} {}?(, )?(?P<hon>[A-Z, ]+)?'.format(TITLE_RE, ENAME_RE, LNAME_CAP_RE, CNAME_RE),
+        ur'{} {} {}'.format(ENAME_RE, LNAME_RE, CNAME_RE),
+        ur'{} {}'.format(ENAME_RE, LNAME_CAP_RE),
+        ur'{} {}'.format(LNAME_RE, CNAME_RE),
+        ur'{}, {}'.format(LNAME_RE, ENAME_RE),
+        ur'{} {}'.format(ENAME_RE, LNAME_RE),
+    ]
+    for pattern in patterns:
+        match = re.search(pattern, name)
+        if match is not None:
+            return match.groupdict()
+    return None
+
+
+@benchmark('parse_names')
+def parse_names_benchmark(repeat):
+    from raw.names import ParseCache, _parse_english_name, is_ascii
+    source, members = _member_names()
+    queries = [xx for english, chinese in members for xx in _name_queries(english, chinese) if is_ascii(xx)]
+    lines = [u'{} English names of {} members, {} distinct'.format(len(queries), source, len(set(queries))),
+             u'{:<20} {:>14}'.format(u'parser', u'names/s')]
+    formatted = best_time(lambda: [_parse_formatted(xx) for xx in queries], repeat)
+    lines.append(u'{:<20} {:>14.0f}'.format(u'formatted', len(queries) / formatted))
+    uncached = best_time(lambda: [_parse_english_name(xx) for xx in queries], repeat)
+    lines.append(u'{:<20} {:>14.0f}'.format(u'precompiled', len(queries) / uncached))
+    cache = ParseCache()
+    cached = best_time(lambda: [cache.parse(xx) for xx in queries], repeat)
+    stats = cache.stats()
+    lines.append(u'{:<20} {:>14.0f}  {} hits, {} misses'.format(u'cached', len(queries) / cached, stats['hits'], stats['misses']))
+    return lines
+
+
+def _misspell(name, i):
+    # Drops or swaps a letter of the name, and puts the last name first every other time
+    words = name.split(u' ')
+    word = words[-1]
+    pos = 1 + i % (len(word) - 2) if len(word) > 3 else 1
+    if i % 3:
+        word = word[:pos] + word[pos + 1:]
+    else:
+        word = word[:pos] + word[pos + 1:pos + 2] + word[pos:pos + 1] + word[pos + 2:]
+    words[-1] = word
+    if i % 2:
+        words = words[1:] + words[:1]
+    return u' '.join(words)
+
+
+@benchmark('fuzzy')
+def fuzzy_benchmark(repeat):
+    from raw.names import FuzzyNameIndex
+    source, members = _member_names()
+    names = [(MemberName(english), english) for english, chinese in members]
+    queries = [(english, _misspell(english, i)) for i, (english, chinese) in enumerate(members)]
+    build = best_time(lambda: FuzzyNameIndex(names), repeat)
+    index = FuzzyNameIndex(names)
+    found = [index.match(query) for english, query in queries]
+    elapsed = best_time(lambda: [index.match(query) for english, query in queries], repeat)
+    right = len([xx for xx, (english, query) in zip(found, queries) if xx is not None and xx[1] == english])
+    wrong = len([xx for xx, (english, query) in zip(found, queries) if xx is not None and xx[1] != english])
+    return [u'{} names of {} members, {} misspelled queries'.format(len(names), source, len(queries)),
+            u'build {:.2f}ms, {:.3f}ms per query, {} right, {} wrong, {} not found'.format(
+                build * 1000, elapsed * 1000 / len(queries), right, wrong, len(queries) - right - wrong)]
+
+
+@benchmark('resolve')
+def resolve_benchmark(repeat):
+    from raw.names import FuzzyNameIndex, NameMatcher, name_cache, resolve_names
+    source, members = _member_names()
+    names = [(MemberName(english), english) for english, chinese in members]
+    matcher = NameMatcher(names)
+    index = FuzzyNameIndex(names)
+    # A batch of askers, where each member asks several questions
+    strings = [xx for english, chinese in members for xx in _name_queries(english, chinese)[:2]] * 10
+    lines = [u'{} names of {} members, {} strings, {} distinct'.format(len(names), source, len(strings), len(set(strings))),
+             u'{:<20} {:>12}'.format(u'resolution', u'batch')]
+
+    def one_by_one():
+        name_cache.clear()
+        return [matcher.match(MemberName(xx)) or index.match(xx) for xx in strings]
+
+    def bulk():
+        name_cache.clear()
+        return resolve_names(strings, matcher, index)
+
+    lines.append(u'{:<20} {:>10.2f}ms'.format(u'one by one', best_time(one_by_one, repeat) * 1000))
+    lines.append(u'{:<20} {:>10.2f}ms'.format(u'bulk', best_time(bulk, repeat) * 1000))
+    return lines
+
+
+@benchmark('intervals')
+def intervals_benchmark(repeat):
+    from datetime import date, timedelta
+    from raw.intervals import IntervalIndex
+    # Four year terms of 70 seats since 1985, with a few members leaving early, and a meeting every week
+    terms = []
+    for year in range(1985, 2016, 4):
+        for seat in range(70):
+            end = date(year + 4, 9, 30) if seat % 10 else date(year + 2, 1, 1) + timedelta(days=seat)
+            terms.append((date(year, 10, 1), end, (year, seat)))
+    dates = [date(1985, 10, 9) + timedelta(days=7 * i) for i in range(1500)]
+
+    def one_by_one():
+        # As one range query per date does
+        return dict((xx, [item for start, end, item in terms if start < xx and (end is None or xx < end)])
+                    for xx in dates)
+
+    build = best_time(lambda: IntervalIndex(terms), repeat)
+    index = IntervalIndex(terms)
+    assert index.stab(dates) == one_by_one()
+    return [u'{} memberships, {} dates, build {:.2f}ms'.format(len(terms), len(dates), build * 1000),
+            u'{:<20} {:>10.2f}ms'.format(u'one by one', best_time(one_by_one, repeat) * 1000),
+            u'{:<20} {:>10.2f}ms'.format(u'stab', best_time(lambda: index.stab(dates), repeat) * 1000)]
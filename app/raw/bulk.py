@@ -0,0 +1,121 @@
+"""
+Helpers for reading and writing models in batches
+
+Django 1.6 only gives us bulk_create, so updates of many rows go through
+bulk_update below, which issues a single UPDATE ... CASE statement per batch
+"""
+from itertools import islice
+
+from django.db import connections, router
+
+
+def chunked(iterable, size):
+    """
+    Yields lists of at most size items from iterable
+    """
+    # chunked('ABCDEFG', 3) --> ABC DEF G
+    it = iter(iterable)
+    while True:
+        chunk = list(islice(it, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+# What index_by_uid does with a uid shared by several objects
+DROP_DUPLICATES = 'drop'
+NONE_FOR_DUPLICATES = 'none'
+LAST_OF_DUPLICATES = 'last'
+
+
+def index_by_uid(queryset, uids=None, duplicates=DROP_DUPLICATES, found=None, lookup='uid'):
+    """
+    Returns a dict of uid to object for all objects in queryset, in one query, or for those with
+    their lookup field (the uid by default) in uids, in batches of 500.
+    A uid shared by several objects is left out with DROP_DUPLICATES, maps to None with NONE_FOR_DUPLICATES,
+    or to the last of the objects with LAST_OF_DUPLICATES, and is added to the set found if given
+
+    queryset can also be a model class
+    """
+    if hasattr(queryset, '_default_manager'):
+        queryset = queryset._default_manager.all()
+    if uids is None:
+        batches = [queryset]
+    else:
+        batches = (queryset.filter(**{lookup + '__in': batch}) for batch in chunked(sorted(set(uids)), 500))
+    index = {}
+    shared = set()
+    for batch in batches:
+        for obj in batch.iterator():
+            if obj.uid in index:
+                shared.add(obj.uid)
+            index[obj.uid] = obj
+    if duplicates == DROP_DUPLICATES:
+        for uid in shared:
+            del index[uid]
+    elif duplicates == NONE_FOR_DUPLICATES:
+        for uid in shared:
+            index[uid] = None
+    if found is not None:
+        found.update(shared)
+    return index
+
+
+def concrete_fields(model, exclude=()):
+    """
+    Names of the concrete, non primary key fields on model
+    """
+    return [f.name for f in model._meta.local_concrete_fields
+            if not f.primary_key and f.name not in exclude]
+
+
+def snapshot(obj, fields):
+    """
+    The current values of fields on obj, used to tell if an object has been changed
+    """
+    return tuple(getattr(obj, obj._meta.get_field(f).attname) for f in fields)
+
+
+def bulk_update(objs, fields, batch_size=None):
+    """
+    Writes the values of fields on objs, which must already be saved, to the database
+
+    Returns the number of rows updated
+    """
+    objs = list(objs)
+    if not objs or not fields:
+        return 0
+    model = objs[0].__class__
+    opts = model._meta
+    connection = connections[router.db_for_write(model)]
+    qn = connection.ops.quote_name
+    pk_column = qn(opts.pk.column)
+    fields = [opts.get_field(f) for f in fields]
+    # Each object uses two parameters per field in the CASE and one in the WHERE
+    max_batch = connection.ops.bulk_batch_size(['pk'] * (2 * len(fields) + 1), objs)
+    batch_size = min(batch_size or max_batch, max_batch) or 1
+    # Postgres can't infer the type of the CASE expression from bare parameters
+    cast = connection.vendor == 'postgresql'
+
+    updated = 0
+    cursor = connection.cursor()
+    for batch in chunked(objs, batch_size):
+        assignments = []
+        params = []
+        for field in fields:
+            whens = []
+            for obj in batch:
+                whens.append('WHEN %s THEN %s')
+                params.append(obj.pk)
+                params.append(field.get_db_prep_save(field.pre_save(obj, False), connection))
+            case = 'CASE {} {} END'.format(pk_column, ' '.join(whens))
+            if cast:
+                case = 'CAST({} AS {})'.format(case, field.db_type(connection))
+            assignments.append('{} = {}'.format(qn(field.column), case))
+        params.extend(obj.pk for obj in batch)
+        sql = 'UPDATE {} SET {} WHERE {} IN ({})'.format(
+            qn(opts.db_table), ', '.join(assignments), pk_column, ', '.join(['%s'] * len(batch))
+        )
+        cursor.execute(sql, params)
+        updated += cursor.rowcount
+    return updated
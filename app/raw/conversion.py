@@ -0,0 +1,330 @@
+"""
+Content addressed cache for DOC/DOCX to HTML conversion
+
+Entries are keyed by the sha1 of the source file and by the identity of the converter that produced
+them (its name and version), so an identical file that is downloaded again is never converted twice,
+and upgrading a converter only invalidates the entries made by its previous version.
+
+Entries are stored gzipped under DOC_CONVERSION_CACHE_PATH, as <converter>-<version>/<xx>/<sha1>.html.gz
+The modification time of an entry is its last access time, and the least recently used entries are
+evicted once the cache grows over DOC_CONVERSION_CACHE_MAX_SIZE bytes, down to EVICTION_LOW_WATER of it
+so that the next writes do not walk the cache again.
+
+The .html files that doc_to_html used to write next to the documents are no longer read or written,
+and are left where they are.
+"""
+from django.conf import settings
+import gzip
+import hashlib
+import logging
+import os
+import shutil
+import signal
+import subprocess
+import tempfile
+import threading
+import pydocx
+
+
+logger = logging.getLogger('legcowatch')
+
+
+DEFAULT_MAX_SIZE = 2 * 1024 ** 3
+# The part of the maximum size that the cache is brought down to when it grows over it
+EVICTION_LOW_WATER = 0.9
+
+
+class ConversionTimeout(Exception):
+    pass
+
+
+class Converter(object):
+    """
+    Converts a document file to an html string
+    """
+    name = None
+
+    def __init__(self):
+        self._version = None
+
+    def get_version(self):
+        raise NotImplementedError()
+
+    @property
+    def version(self):
+        if self._version is None:
+            self._version = self.get_version() or 'unknown'
+        return self._version
+
+    @property
+    def identity(self):
+        return u'{}-{}'.format(self.name, self.version).replace(os.sep, '_')
+
+    def convert(self, filepath, timeout=None):
+        """
+        Returns the html as a unicode string, or None if the file could not be converted.
+        Raises ConversionTimeout if the conversion takes more than timeout seconds
+        """
+        raise NotImplementedError()
+
+
+class AbiwordConverter(Converter):
+    name = 'abiword'
+
+    def get_version(self):
+        try:
+            return subprocess.check_output(['abiword', '--version']).strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    def command(self, filepath):
+        return ['abiword', '--to=html', '--to-name=fd://1', filepath]
+
+    def convert(self, filepath, timeout=None):
+        try:
+            proc = subprocess.Popen(self.command(filepath), stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        except OSError:
+            return None
+        timer = None
+        if timeout is not None:
+            timer = threading.Timer(timeout, proc.kill)
+            timer.start()
+        try:
+            res, _ = proc.communicate()
+        finally:
+            if timer is not None:
+                timer.cancel()
+        if timer is not None and proc.returncode == -signal.SIGKILL:
+            raise ConversionTimeout(u'abiword took more than {}s on {}'.format(timeout, filepath))
+        if proc.returncode != 0:
+            return None
+        return res.decode('utf-8')
+
+
+class PyDocXConverter(Converter):
+    name = 'pydocx'
+
+    def get_version(self):
+        return getattr(pydocx, '__version__', None)
+
+    def convert(self, filepath, timeout=None):
+        # pydocx runs in this process, so it can only be interrupted with a signal
+        if timeout is None or not isinstance(threading.current_thread(), threading._MainThread):
+            return pydocx.PyDocX.to_html(filepath)
+
+        def on_alarm(signum, frame):
+            raise ConversionTimeout(u'pydocx took more than {}s on {}'.format(timeout, filepath))
+        previous = signal.signal(signal.SIGALRM, on_alarm)
+        signal.alarm(max(int(timeout), 1))
+        try:
+            return pydocx.PyDocX.to_html(filepath)
+        finally:
+            signal.alarm(0)
+            signal.signal(signal.SIGALRM, previous)
+
+
+ABIWORD = AbiwordConverter()
+PYDOCX = PyDocXConverter()
+CONVERTERS = [ABIWORD, PYDOCX]
+
+
+def file_digest(filepath, blocksize=1 << 20):
+    """
+    sha1 hex digest of the contents of a file
+    """
+    digest = hashlib.sha1()
+    with open(filepath, 'rb') as f:
+        for block in iter(lambda: f.read(blocksize), ''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class ConversionCache(object):
+    def __init__(self, path=None, max_size=None):
+        if path is None:
+            path = getattr(settings, 'DOC_CONVERSION_CACHE_PATH', None)
+        if path is None:
+            path = os.path.join(getattr(settings, 'SCRAPY_FILES_PATH', '.'), os.pardir, 'conversion-cache')
+        if max_size is None:
+            max_size = getattr(settings, 'DOC_CONVERSION_CACHE_MAX_SIZE', DEFAULT_MAX_SIZE)
+        self.path = os.path.abspath(path)
+        self.max_size = max_size
+        # Approximate size of the cache, so that we don't walk the directory on every write
+        self._size = None
+        self.hits = 0
+        self.misses = 0
+
+    def entry_path(self, converter, digest):
+        return os.path.join(self.path, converter.identity, digest[:2], u'{}.html.gz'.format(digest))
+
+    def get(self, converter, digest):
+        """
+        Returns the cached html for a digest, or None if it is not in the cache
+        """
+        path = self.entry_path(converter, digest)
+        try:
+            with gzip.open(path, 'rb') as f:
+                res = f.read().decode('utf-8')
+        except (IOError, OSError):
+            return None
+        try:
+            # Mark as recently used
+            os.utime(path, None)
+        except OSError:
+            pass
+        return res
+
+    def put(self, converter, digest, html):
+        path = self.entry_path(converter, digest)
+        folder = os.path.dirname(path)
+        if not os.path.isdir(folder):
+            try:
+                os.makedirs(folder)
+            except OSError:
+                # Created by another process in the meantime
+                if not os.path.isdir(folder):
+                    raise
+        # Write to a temporary file first so that readers never see half an entry
+        fd, tmp_path = tempfile.mkstemp(dir=folder, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as raw_file:
+                with gzip.GzipFile(fileobj=raw_file, mode='wb') as f:
+                    f.write(html.encode('utf-8'))
+            # The entry replaced, when overwriting, no longer counts in the size
+            try:
+                replaced = os.path.getsize(path)
+            except OSError:
+                replaced = 0
+            os.rename(tmp_path, path)
+        except:
+            os.remove(tmp_path)
+            raise
+        if self._size is not None:
+            self._size += os.path.getsize(path) - replaced
+        if self.max_size is not None and self.size() > self.max_size:
+            # Evicting walks the whole cache, so make room for more than this entry
+            self.evict(int(self.max_size * EVICTION_LOW_WATER))
+
+    def convert(self, converter, filepath, overwrite=False, timeout=None, digest=None):
+        """
+        Converts a file with a converter, using the cache when possible.
+        Returns a unicode string, or None if the conversion failed
+        """
+        if digest is None:
+            digest = file_digest(filepath)
+        if not overwrite:
+            res = self.get(converter, digest)
+            if res is not None:
+                self.hits += 1
+                return res
+        self.misses += 1
+        res = converter.convert(filepath, timeout=timeout)
+        if res is not None:
+            self.put(converter, digest, res)
+        return res
+
+    def contains(self, converter, digest):
+        return os.path.exists(self.entry_path(converter, digest))
+
+    def _entries(self):
+        """
+        Yields (identity, path, size, mtime) for each entry in the cache
+        """
+        if not os.path.isdir(self.path):
+            return
+        for identity in os.listdir(self.path):
+            for root, dirs, files in os.walk(os.path.join(self.path, identity)):
+                for name in files:
+                    if not name.endswith('.html.gz'):
+                        continue
+                    path = os.path.join(root, name)
+                    try:
+                        st = os.stat(path)
+                    except OSError:
+                        continue
+                    yield identity, path, st.st_size, st.st_mtime
+
+    def size(self):
+        if self._size is None:
+            self._size = sum(xx[2] for xx in self._entries())
+        return self._size
+
+    def evict(self, max_size=None):
+        """
+        Removes the least recently used entries until the cache is at most max_size bytes.
+        Returns the number of entries removed
+        """
+        max_size = self.max_size if max_size is None else max_size
+        entries = sorted(self._entries(), key=lambda xx: xx[3])
+        total = sum(xx[2] for xx in entries)
+        removed = 0
+        for identity, path, size, mtime in entries:
+            if total <= max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            removed += 1
+        self._size = total
+        if removed:
+            logger.info(u'Evicted {} entries from the conversion cache'.format(removed))
+        return removed
+
+    def prune(self):
+        """
+        Removes the entries made by converter versions that are no longer installed.
+        Returns the names of the removed converter folders
+        """
+        current = set(cc.identity for cc in CONVERTERS)
+        removed = []
+        if os.path.isdir(self.path):
+            for identity in os.listdir(self.path):
+                if identity not in current and os.path.isdir(os.path.join(self.path, identity)):
+                    shutil.rmtree(os.path.join(self.path, identity))
+                    removed.append(identity)
+        self._size = None
+        return removed
+
+    def clear(self):
+        if os.path.isdir(self.path):
+            shutil.rmtree(self.path)
+        self._size = None
+
+    def stats(self):
+        """
+        Returns a dict of the number of entries and bytes used, in total and per converter
+        """
+        current = set(cc.identity for cc in CONVERTERS)
+        res = {
+            'path': self.path,
+            'max_size': self.max_size,
+            'entries': 0,
+            'size': 0,
+            'oldest': None,
+            'newest': None,
+            'converters': {},
+        }
+        for identity, path, size, mtime in self._entries():
+            res['entries'] += 1
+            res['size'] += size
+            res['oldest'] = mtime if res['oldest'] is None else min(res['oldest'], mtime)
+            res['newest'] = mtime if res['newest'] is None else max(res['newest'], mtime)
+            conv = res['converters'].setdefault(identity, {'entries': 0, 'size': 0, 'stale': identity not in current})
+            conv['entries'] += 1
+            conv['size'] += size
+        return res
+
+
+_cache = None
+
+
+def get_cache():
+    """
+    Returns the process wide ConversionCache
+    """
+    global _cache
+    if _cache is None:
+        _cache = ConversionCache()
+    return _cache
@@ -5,7 +5,7 @@
 Document wrappers for LegCo Agendas
 """
 
-from collections import OrderedDict
+from collections import OrderedDict, namedtuple
 import logging
 import lxml
 import lxml.html
@@ -15,9 +15,17 @@ import re
 from lxml.html import HTMLParser
 import itertools
 from raw.utils import to_string, to_unicode, grouper
+from raw.docs.normalize import normalize_source
+from raw.docs.records import plain, to_html
+from raw.docs import timing
 
 
 logger = logging.getLogger('legcowatch-docs')
+
+# Bump when a change to the parser changes its results or the attributes of the parser objects,
+# to invalidate the cached results: they are pickled parser objects
+PARSER_VERSION = 3
+
 SECOND_READING_PATTERN_C = u'二讀'
 
 BILL_AMENDMENT_PATTERN_C = u'全體委員會審議階段修正案'
@@ -76,32 +84,21 @@ class CouncilAgenda(object):
         self.members_motions = None
         self.other = None
         self._headers = []
-        self._load()
-        self._clean()
-        self._parse()
+        with timing.document(self):
+            self._load()
+            self._clean()
+            self._parse()
 
     def __repr__(self):
         return u'<CouncilAgenda: {}>'.format(self.uid)
 
+    @timing.timed
     def _load(self):
         """
         Load the ElementTree from the source
         """
-        # Convert directional quotation marks to regular quotes
-        double_quotes = ur'[\u201c\u201d]'
-        self.source = re.sub(double_quotes, u'"', self.source)
-        single_quotes = ur'[\u2019\u2018]'
-        self.source = re.sub(single_quotes, u"'", self.source)
-        # Convert colons
-        self.source = self.source.replace(u'\uff1a', u':')
-        # Remove line breaks and tabs
-        self.source = self.source.replace(u'\n', u'')
-        self.source = self.source.replace(u'\t', u'')
-        # There are also some "zero width joiners" in random places in the text
-        # Should remove them here, since they make string search unreliable
-        # these are the codes: &#8205, &#160 (nbsp), \xa0 (nbsp), \u200d
-        zero_width_joiners = u'\u200d'
-        self.source = self.source.replace(zero_width_joiners, u'')
+        # Convert quotes and colons, remove line breaks, tabs and zero width joiners
+        self.source = normalize_source(self.source)
         # Also previously had some non breaking spaces in unicode \u00a0, but this
         # may have been fixed by changing the parser below
 
@@ -112,6 +109,7 @@ class CouncilAgenda(object):
         self.tree = cleaner.clean_html(lxml.html.fromstring(to_string(self.source), parser=parser))
         # self.tree = lxml.html.fromstring(to_string(self.source))
 
+    @timing.timed
     def _clean(self):
         """
         Removes some of extraneous tags to make parsing easier
@@ -120,6 +118,7 @@ class CouncilAgenda(object):
         for xx in self.tree.find_class('pydocx-tab'):
             xx.drop_tag()
 
+    @timing.timed
     def _parse(self):
         """
         Parse the source document and populate this object's properties
@@ -160,7 +159,8 @@ class CouncilAgenda(object):
         # Once all of the sections are split up, parse each of them separately
         for section in CouncilAgenda.SECTION_MAP.keys():
             if getattr(self, section) is not None:
-                getattr(self, "_parse_{}".format(section))()
+                with timing.stage(self, "_parse_{}".format(section), getattr(self, section)):
+                    getattr(self, "_parse_{}".format(section))()
         # We won't parse others, since we don't know what those are
 
     def _parse_tabled_papers(self):
@@ -522,6 +522,22 @@ class CouncilAgenda(object):
                 return prop_name
         return None
 
+    def detach(self):
+        """
+        Replaces the results by compact records of plain strings, and the unparsed sections by
+        html snippets, then drops the tree and the source.  Returns self.
+        """
+        for section in CouncilAgenda.SECTION_MAP.keys() + ['other']:
+            items = getattr(self, section)
+            if items is not None:
+                setattr(self, section, [detach(xx) for xx in items])
+        if self.questions is not None:
+            self._build_question_map()
+        self._headers = [(section, to_html(elem)) for section, elem in self._headers]
+        self.tree = None
+        self.source = None
+        return self
+
     def get_headers(self):
         """
         Gets the headers from the document
@@ -597,6 +613,20 @@ class AgendaQuestion(object):
     def __repr__(self):
         return u'<Question by {}>'.format(self.asker).encode('utf-8')
 
+    def detach(self):
+        return AgendaQuestionRecord(*plain((self.number, self.asker, self.replier, self.type, self.body)))
+
+
+class AgendaQuestionRecord(namedtuple('AgendaQuestionRecord', 'number asker replier type body')):
+    """
+    AgendaQuestion detached from its elements
+    """
+    __slots__ = ()
+    QTYPE_ORAL = AgendaQuestion.QTYPE_ORAL
+    QTYPE_WRITTEN = AgendaQuestion.QTYPE_WRITTEN
+
+    __repr__ = AgendaQuestion.__repr__.im_func
+
 
 class TabledLegislation(object):
     """
@@ -619,6 +649,14 @@ class TabledLegislation(object):
     def __repr__(self):
         return u'<TabledLegislation {}: {}>'.format(self.number, self.title).encode('utf-8')
 
+    def detach(self):
+        return TabledLegislationRecord(*plain((self.number, self.title)))
+
+
+class TabledLegislationRecord(namedtuple('TabledLegislationRecord', 'number title')):
+    __slots__ = ()
+    __repr__ = TabledLegislation.__repr__.im_func
+
 
 class OtherTabledPaper(object):
     """
@@ -662,6 +700,14 @@ class OtherTabledPaper(object):
     def __repr__(self):
         return u'<OtherTabledPaper {}>'.format(self.title).encode('utf-8')
 
+    def detach(self):
+        return OtherTabledPaperRecord(*plain((self.title, self.presenter)))
+
+
+class OtherTabledPaperRecord(namedtuple('OtherTabledPaperRecord', 'title presenter')):
+    __slots__ = ()
+    __repr__ = OtherTabledPaper.__repr__.im_func
+
 
 class BillReading(object):
     FIRST = 1
@@ -689,6 +735,16 @@ class BillReading(object):
     def pretty_reading(self):
         return self.READING_TEXT[self.reading]
 
+    def detach(self):
+        return BillReadingRecord(*plain((self.title, self.reading, self.attendees, self.amendments)))
+
+
+class BillReadingRecord(namedtuple('BillReadingRecord', 'title reading attendees amendments')):
+    __slots__ = ()
+    READING_TEXT = BillReading.READING_TEXT
+    __repr__ = BillReading.__repr__.im_func
+    pretty_reading = BillReading.pretty_reading
+
 
 class AgendaMotion(object):
     """
@@ -699,6 +755,13 @@ class AgendaMotion(object):
         self.body = None
         self.amendments = None
 
+    def detach(self):
+        return AgendaMotionRecord(*plain((self.mover, self.body, self.amendments)))
+
+
+class AgendaMotionRecord(namedtuple('AgendaMotionRecord', 'mover body amendments')):
+    __slots__ = ()
+
 
 class MotionAmendment(object):
     """
@@ -710,6 +773,15 @@ class MotionAmendment(object):
         self.body = None
 
 
+def detach(item):
+    """
+    The record of a parsed item, or the html of an element of an unparsed section
+    """
+    if hasattr(item, 'detach'):
+        return item.detach()
+    return plain(item)
+
+
 def any_in(arr, iterable):
     """
     Checks if any value in arr is in an iterable
@@ -0,0 +1,322 @@
+"""
+Cache of parsed documents
+
+Parsing a hansard or an agenda takes seconds, so the results of the parsers (the sections, questions,
+dialogs, attendance lists...) are pickled and stored, keyed by a hash of the arguments given to the
+parser, including the document source.  Each docs module has a PARSER_VERSION which is part of the key,
+so bumping it when changing a parser invalidates all of the results made by the previous version.
+
+The backend is set with PARSE_CACHE_BACKEND:
+'filesystem' stores the results under PARSE_CACHE_PATH, as <parser>-<version>/<xx>/<sha1>.pickle.z
+'django' stores the results in the Django cache named by PARSE_CACHE_ALIAS, and clearing them leaves
+the other keys of that cache
+None disables the cache
+
+Parsers restored from the cache have no tree and no source, only the parsed results.
+"""
+import cPickle
+from cStringIO import StringIO
+import hashlib
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+import zlib
+from django.conf import settings
+from lxml import etree
+import lxml.html
+
+
+logger = logging.getLogger('legcowatch-docs')
+
+
+# Attributes of the parsers that are never cached
+EXCLUDED_ATTRIBUTES = ('tree', 'source', 'src')
+
+
+def parser_version(parser_class):
+    """
+    The PARSER_VERSION of the module where parser_class is defined
+    """
+    return getattr(sys.modules[parser_class.__module__], 'PARSER_VERSION', 0)
+
+
+def parser_identity(parser_class):
+    return u'{}-{}'.format(parser_class.__name__, parser_version(parser_class))
+
+
+def cache_key(parser_class, args):
+    """
+    sha1 of the qualified name of the parser class and of its arguments
+    """
+    digest = hashlib.sha1()
+    digest.update('{}.{}'.format(parser_class.__module__, parser_class.__name__))
+    for arg in args:
+        # Prefix each argument with its type, so that u'1' and 1 have different keys
+        if isinstance(arg, unicode):
+            value = arg.encode('utf-8')
+        elif isinstance(arg, str):
+            value = arg
+        else:
+            value = repr(arg)
+        digest.update('\0{}:{}:'.format(type(arg).__name__, len(value)))
+        digest.update(value)
+    return digest.hexdigest()
+
+
+def _element_parser():
+    parser = etree.XMLParser(remove_blank_text=False)
+    parser.set_element_class_lookup(lxml.html.HtmlElementClassLookup())
+    return parser
+
+
+def _persistent_id(obj):
+    # The strings returned by lxml keep a reference to their element, and elements can't be
+    # pickled at all, so both are stored as plain strings
+    if isinstance(obj, etree._Element):
+        return ('element', etree.tostring(obj, encoding=unicode, with_tail=False), obj.tail)
+    if isinstance(obj, unicode) and type(obj) is not unicode:
+        return ('unicode', unicode(obj))
+    if isinstance(obj, str) and type(obj) is not str:
+        return ('str', str(obj))
+    return None
+
+
+def dumps(fields):
+    """
+    Serializes a dict of parser attributes
+    """
+    out = StringIO()
+    pickler = cPickle.Pickler(out, cPickle.HIGHEST_PROTOCOL)
+    pickler.persistent_id = _persistent_id
+    pickler.dump(fields)
+    return zlib.compress(out.getvalue())
+
+
+def loads(data):
+    element_parser = _element_parser()
+
+    def persistent_load(pid):
+        if pid[0] == 'element':
+            elem = etree.fromstring(pid[1], parser=element_parser)
+            elem.tail = pid[2]
+            return elem
+        return pid[1]
+
+    unpickler = cPickle.Unpickler(StringIO(zlib.decompress(data)))
+    unpickler.persistent_load = persistent_load
+    return unpickler.load()
+
+
+class FileSystemBackend(object):
+    def __init__(self, path=None):
+        if path is None:
+            path = getattr(settings, 'PARSE_CACHE_PATH', None)
+        if path is None:
+            path = os.path.join(getattr(settings, 'SCRAPY_FILES_PATH', '.'), os.pardir, 'parse-cache')
+        self.path = os.path.abspath(path)
+
+    def entry_path(self, identity, key):
+        return os.path.join(self.path, identity, key[:2], u'{}.pickle.z'.format(key))
+
+    def get(self, identity, key):
+        try:
+            with open(self.entry_path(identity, key), 'rb') as f:
+                return f.read()
+        except (IOError, OSError):
+            return None
+
+    def set(self, identity, key, data):
+        path = self.entry_path(identity, key)
+        folder = os.path.dirname(path)
+        if not os.path.isdir(folder):
+            try:
+                os.makedirs(folder)
+            except OSError:
+                # Created by another process in the meantime
+                if not os.path.isdir(folder):
+                    raise
+        # Write to a temporary file first so that readers never see half an entry
+        fd, tmp_path = tempfile.mkstemp(dir=folder, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.rename(tmp_path, path)
+        except:
+            os.remove(tmp_path)
+            raise
+
+    def delete(self, identity, key):
+        try:
+            os.remove(self.entry_path(identity, key))
+        except OSError:
+            pass
+
+    def prune(self, current):
+        """
+        Removes the results of the parser versions that are not in current.
+        Returns the names of the removed folders
+        """
+        removed = []
+        if os.path.isdir(self.path):
+            for identity in os.listdir(self.path):
+                if identity not in current and os.path.isdir(os.path.join(self.path, identity)):
+                    shutil.rmtree(os.path.join(self.path, identity))
+                    removed.append(identity)
+        return removed
+
+    def clear(self):
+        if os.path.isdir(self.path):
+            shutil.rmtree(self.path)
+
+
+class DjangoCacheBackend(object):
+    """
+    Stores the results in a Django cache.  Results of old parser versions are left to expire.
+    The cache may be shared with the rest of the site, so the keys are in a namespace, which clear()
+    moves to the next one rather than clearing the whole cache
+    """
+    NAMESPACE_KEY = u'parsed:namespace'
+
+    def __init__(self, alias=None):
+        from django.core.cache import get_cache
+        self.alias = alias or getattr(settings, 'PARSE_CACHE_ALIAS', 'default')
+        self.cache = get_cache(self.alias)
+
+    def _namespace(self):
+        namespace = self.cache.get(self.NAMESPACE_KEY)
+        if namespace is None:
+            # Starts from the time, so that a namespace key evicted from the cache never brings back
+            # the results of an earlier namespace
+            self.cache.add(self.NAMESPACE_KEY, int(time.time() * 1000), None)
+            namespace = self.cache.get(self.NAMESPACE_KEY)
+        return namespace
+
+    def _key(self, identity, key):
+        return u'parsed:{}:{}:{}'.format(self._namespace(), identity, key)
+
+    def get(self, identity, key):
+        return self.cache.get(self._key(identity, key))
+
+    def set(self, identity, key, data):
+        # None caches forever
+        self.cache.set(self._key(identity, key), data, None)
+
+    def delete(self, identity, key):
+        self.cache.delete(self._key(identity, key))
+
+    def prune(self, current):
+        return []
+
+    def clear(self):
+        self._namespace()
+        try:
+            self.cache.incr(self.NAMESPACE_KEY)
+        except ValueError:
+            # Evicted in the meantime
+            self._namespace()
+
+
+BACKENDS = {
+    'filesystem': FileSystemBackend,
+    'django': DjangoCacheBackend,
+}
+
+
+class ParseCache(object):
+    """
+    Parses documents with the parser classes in raw.docs, reusing the stored results when the
+    same document has already been parsed by the same version of the parser
+    """
+    def __init__(self, backend=None):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+
+    def parse(self, parser_class, *args, **kwargs):
+        """
+        Returns parser_class(*args, **kwargs), from the cache if possible.
+        The keyword arguments are not part of the cache key, they are for the
+        attributes in CACHE_EXCLUDE and are passed to _restore() on a hit
+        """
+        if self.backend is None:
+            return parser_class(*args, **kwargs)
+        parser = self.get(parser_class, *args, **kwargs)
+        if parser is not None:
+            return parser
+        parser = parser_class(*args, **kwargs)
+        try:
+            self.backend.set(parser_identity(parser_class), cache_key(parser_class, args), dumps(self.fields(parser)))
+        except Exception as e:
+            logger.warn(u'Could not cache {}: {}'.format(parser, e))
+        return parser
+
+    def get(self, parser_class, *args, **kwargs):
+        """
+        Returns the cached result of parser_class(*args, **kwargs), or None
+        """
+        if self.backend is None:
+            return None
+        identity = parser_identity(parser_class)
+        key = cache_key(parser_class, args)
+        data = self.backend.get(identity, key)
+        if data is not None:
+            try:
+                parser = self.restore(parser_class, loads(data), **kwargs)
+            except Exception as e:
+                # Most likely a result pickled with classes that have since changed
+                logger.warn(u'Could not restore cached {} {}: {}'.format(parser_class.__name__, key, e))
+                self.backend.delete(identity, key)
+            else:
+                self.hits += 1
+                return parser
+        self.misses += 1
+        return None
+
+    def fields(self, parser):
+        """
+        The attributes of a parser that are cached, the excluded ones are set to None
+        """
+        excluded = set(EXCLUDED_ATTRIBUTES).union(getattr(parser, 'CACHE_EXCLUDE', ()))
+        return dict((kk, None if kk in excluded else vv) for kk, vv in parser.__dict__.items())
+
+    def restore(self, parser_class, fields, **kwargs):
+        """
+        Rebuilds a parser object from its cached attributes, without parsing again
+        """
+        parser = parser_class.__new__(parser_class)
+        parser.__dict__.update(fields)
+        if hasattr(parser, '_restore'):
+            parser._restore(**kwargs)
+        return parser
+
+    def prune(self, parser_classes):
+        return self.backend.prune(set(parser_identity(cc) for cc in parser_classes))
+
+    def clear(self):
+        self.backend.clear()
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses}
+
+
+def get_backend():
+    name = getattr(settings, 'PARSE_CACHE_BACKEND', 'filesystem')
+    if name is None:
+        return None
+    return BACKENDS[name]()
+
+
+_cache = None
+
+
+def get_parse_cache():
+    """
+    Returns the process wide ParseCache
+    """
+    global _cache
+    if _cache is None:
+        _cache = ParseCache(get_backend())
+    return _cache
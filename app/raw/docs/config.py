@@ -0,0 +1,31 @@
+"""
+Configuration of the work the docs parsers do besides parsing
+
+DEBUG dumps the cleaned and parsed trees of each document as html under fixtures_path, and logs
+the progress of each stage and section.  PRODUCTION only does the parsing.
+
+The default is set with PARSER_MODE, 'production' or 'debug', and a configuration can be given to
+a parser, or to get_parser() of the raw models, with config=
+"""
+from collections import namedtuple
+from django.conf import settings
+
+
+ParserConfig = namedtuple('ParserConfig', 'name dump_fixtures fixtures_path log_progress')
+
+DEBUG = ParserConfig('debug', dump_fixtures=True, fixtures_path='raw/tests/fixtures/docs', log_progress=True)
+PRODUCTION = ParserConfig('production', dump_fixtures=False, fixtures_path=None, log_progress=False)
+
+MODES = {
+    DEBUG.name: DEBUG,
+    PRODUCTION.name: PRODUCTION,
+}
+
+
+def get_config(mode=None):
+    """
+    The configuration of the given mode, by default of PARSER_MODE
+    """
+    if mode is None:
+        mode = getattr(settings, 'PARSER_MODE', PRODUCTION.name)
+    return MODES[mode]
@@ -14,8 +14,12 @@ from lxml.html import HTMLParser
 from lxml.html.clean import clean_html, Cleaner
 import re
 import itertools
-from collections import OrderedDict
+from collections import OrderedDict, namedtuple
 from raw.utils import to_string, to_unicode, grouper
+from raw.docs.normalize import normalize_source
+from raw.docs.records import plain
+from raw.docs import timing
+from raw.docs.config import get_config
 from ..models.constants import *
 from lxml.etree import tostring
 #from ..models import *
@@ -25,7 +29,10 @@ from lxml.etree import tostring
 # 'to_string' converts unicode object to string 
 
 logger = logging.getLogger('legcowatch-docs')
-logger.setLevel(logging.INFO)
+
+# Bump when a change to the parser changes its results or the attributes of the parser objects,
+# to invalidate the cached results: they are pickled parser objects
+PARSER_VERSION = 4
 # Global header patterns. All are <strong> and upper case. Some
 
 # these sub-sections should be in the main_heading section
@@ -69,22 +76,97 @@ ADJOURNMENT_c = u'休會'
 
 LIST_OF_HEADERS_e = [TABLED_PAPERS_e,ADDRESSES_e,URGENT_QUESTIONS_e,ORAL_QUESTIONS_e,WRITTEN_QUESTIONS_e,MOTIONS_e1,MOTIONS_e2,BILLS_e,STATEMENTS_e,CE_Q_AND_A_e,SUSPENSION_e,NEXT_MEETING_e,ADJOURNMENT_e]
 LIST_OF_HEADERS_c = [TABLED_PAPERS_c,ADDRESSES_c,URGENT_QUESTIONS_c,ORAL_QUESTIONS_c,WRITTEN_QUESTIONS_c,MOTIONS_c1,MOTIONS_c2,BILLS_c,STATEMENTS_c,CE_Q_AND_A_c,SUSPENSION_c,NEXT_MEETING_c,ADJOURNMENT_c]
+
+# The elements before the first header
+BEFORE_MEETING_e = u'BEFORE MEETING'
+BEFORE_MEETING_c = u'會議前'
+
+# The headers that start a new section, by language. See register_section_parser()
+SECTION_HEADERS = {
+    LANG_EN: set(LIST_OF_HEADERS_e),
+    LANG_CN: set(LIST_OF_HEADERS_c),
+}
+
+# The parsers of the sections, by language and header. A parser is either the name of a
+# CouncilHansard method or a function, called with the elements of the section.
+# Sections without a parser, e.g. ADDRESSES, are skipped.
+SECTION_PARSERS = {
+    LANG_EN: {
+        BEFORE_MEETING_e: '_parse_before_meeting',
+        TABLED_PAPERS_e: '_parse_tabled_papers',
+        URGENT_QUESTIONS_e: '_parse_urgent_questions',
+        ORAL_QUESTIONS_e: '_parse_oral_answers_to_questions',
+        WRITTEN_QUESTIONS_e: '_parse_written_answers_to_questions',
+        BILLS_e: '_parse_bills',
+        MOTIONS_e1: '_parse_motions',
+        MOTIONS_e2: '_parse_motions',
+        CE_Q_AND_A_e: '_parse_CE_Q_AND_A',
+        SUSPENSION_e: '_parse_suspension',
+        NEXT_MEETING_e: '_parse_suspension',
+        ADJOURNMENT_e: '_parse_suspension',
+    },
+    # The part before meeting is not parsed for Chinese
+    LANG_CN: {
+        TABLED_PAPERS_c: '_parse_tabled_papers',
+        URGENT_QUESTIONS_c: '_parse_urgent_questions',
+        ORAL_QUESTIONS_c: '_parse_oral_answers_to_questions',
+        WRITTEN_QUESTIONS_c: '_parse_written_answers_to_questions',
+        BILLS_c: '_parse_bills',
+        MOTIONS_c1: '_parse_motions',
+        MOTIONS_c2: '_parse_motions',
+        CE_Q_AND_A_c: '_parse_CE_Q_AND_A',
+        SUSPENSION_c: '_parse_suspension',
+        NEXT_MEETING_c: '_parse_suspension',
+        ADJOURNMENT_c: '_parse_suspension',
+    },
+}
+
+
+def register_section_parser(lang, header, parser):
+    """
+    Registers the parser of the sections starting with header, in the hansards of language lang.
+    parser is called as parser(hansard, elem_list) with the CouncilHansard object and the elements
+    of the section, and sets its results on the hansard, e.g.
+
+    def parse_statements(hansard, elem_list):
+        hansard.statements = hansard.parse_dialogs(elem_list)
+    register_section_parser(LANG_EN, STATEMENTS_e, parse_statements)
+    """
+    SECTION_HEADERS[lang].add(header)
+    SECTION_PARSERS[lang][header] = parser
 #<hr></hr> or </hr>
 
 # some footnotes may follow
 # There may be appendix as well
 
+# Text enclosed by brackets, i.e. (xxx), marks an event between dialogs
+EVENT_RE = re.compile(ur'^\(.+\)$')
+
+# Records of the results, made by CouncilHansard.detach()
+Dialog = namedtuple('Dialog', 'speaker speech')
+HansardQuestion = namedtuple('HansardQuestion', 'number title dialogs')
+HansardBill = namedtuple('HansardBill', 'stage title dialogs')
+HansardMotion = namedtuple('HansardMotion', 'title dialogs')
+
 
 class CouncilHansard(object):
     """
     Object representing the **formal/translated** Council Hansard document.  This class
     parses the document source and makes all of the individual elements easily accessible
     """
+    # The question maps hold RawCouncilQuestion objects, so they are looked up again
+    # when restoring from the parse cache
+    CACHE_EXCLUDE = ('oral_questions_map', 'written_questions_map', 'question_index', 'config')
+
     def __init__(self, uid, lang, source, raw_date, *args, **kwargs):
         logger.debug(u'** Parsing hansard {}'.format(uid))
         self.uid = uid
         self.language = lang
         self.raw_date = raw_date
+        # Optional dict of uid to RawCouncilQuestion, used instead of querying the questions
+        self.question_index = kwargs.get('question_index')
+        # Debug or production, see raw.docs.config
+        self.config = kwargs.get('config') or get_config()
 
         # Raw html string
         self.source = source
@@ -121,37 +203,57 @@ class CouncilHansard(object):
         
         self._count_errors = 0
         
-        self._load()
-        self._clean()
-        self._parse()
+        with timing.document(self):
+            self._load()
+            self._clean()
+            self._parse()
         #self._post_process()
         
         
     def __repr__(self):
         return u'<CouncilHansard: {}>'.format(self.uid)
+
+    def _restore(self, question_index=None, config=None):
+        """
+        Called when this object is restored from the parse cache
+        """
+        self.question_index = question_index
+        self.config = config or get_config()
+        self.oral_questions_map = self._build_question_map(self.oral_questions)
+        self.written_questions_map = self._build_question_map(self.written_questions)
+
+    def detach(self):
+        """
+        Replaces the results by records of plain strings and html snippets, and drops the tree
+        and the source.  Returns self.
+        """
+        self.tree = None
+        self.source = None
+        for name, value in vars(self).items():
+            if name not in self.CACHE_EXCLUDE:
+                setattr(self, name, plain(value))
+        for name in ('before_meeting', 'ce_q_and_a', 'suspension'):
+            setattr(self, name, _dialog_records(getattr(self, name)))
+        for name in ('urgent_questions', 'oral_questions', 'written_questions'):
+            questions = getattr(self, name)
+            if questions is not None:
+                setattr(self, name, [HansardQuestion(number, title, _dialog_records(dialogs))
+                                     for number, title, dialogs in questions])
+        if self.bills is not None:
+            self.bills = [HansardBill(stage, title, _dialog_records(dialogs)) for stage, title, dialogs in self.bills]
+        if self.motions is not None:
+            self.motions = [HansardMotion(title, _dialog_records(dialogs)) for title, dialogs in self.motions]
+        return self
     
+    @timing.timed
     def _load(self):
         """
         Load the ElementTree from the source
         """
-        # Convert directional quotation marks to regular quotes
-        double_quotes = ur'[\u201c\u201d]'
-        self.source = re.sub(double_quotes, u'"', self.source)
-        single_quotes = ur'[\u2019\u2018]'
-        self.source = re.sub(single_quotes, u"'", self.source)
-        # Convert colons
-        self.source = self.source.replace(u'\uff1a', u':')
-        #self.source = self.source.replace(u'：', u':')
+        # Convert quotes and colons, remove line breaks, tabs and zero width joiners
+        self.source = normalize_source(self.source)
         # Convert commas
         #self.source = self.source.replace(u'\u2C', u',')
-        # Remove line breaks and tabs
-        self.source = self.source.replace(u'\n', u'')
-        self.source = self.source.replace(u'\t', u'')
-        # There are also some "zero width joiners" in random places in the text
-        # Should remove them here, since they make string search unreliable
-        # these are the codes: &#8205, &#160 (nbsp), \xa0 (nbsp), \u200d
-        zero_width_joiners = u'\u200d'
-        self.source = self.source.replace(zero_width_joiners, u'')
         # Also previously had some non breaking spaces in unicode \u00a0, but this
         # may have been fixed by changing the parser below
         
@@ -171,58 +273,36 @@ class CouncilHansard(object):
         parser = HTMLParser(encoding='utf-8')
         # Finally, load the cleaned string to an ElementTree
         self.tree = cleaner.clean_html(lxml.html.fromstring(to_string(self.source), parser=parser))
-        self._convert_bold_to_strong()
         
-        logger.info(u'Finished _load().')
+        self._log_progress(u'Finished _load().')
     
+    @timing.timed
     def _clean(self):
         """
         Removes/combines some of tags to make parsing easier
         """
+        # A single depth first walk over the tree converts bold text to <strong> (mainly for
+        # pre-2012 Hansards), strips the <div> tags, upper-cases the text in pydocx-caps,
+        # and finds the extra tags to drop, the <hr> tags and the <body>. Dropping them is left
+        # until after the walk. The steps after it only look at the children of the <body>.
         #etree.strip_tags(self.tree, 'strong')#we need some <strong> tags in hansard
-        etree.strip_tags(self.tree, 'div')
-        try:
-            self.tree.xpath('//div')[0].tag = 'body'
-        except IndexError:
-            pass
-        #pdb.set_trace()
-        
-        # CapsLock also happens in Chinese (in titles)
-        for xx in self.tree.find_class('pydocx-caps'):
-            # Make all text inside uppercase.
-            # Loop over all descendants and upper-case their text.
-            desc = xx.xpath('./descendant::*')
-            if desc == [] and xx.text is not None:
-                xx.text = xx.text.upper()
-            elif len(desc)==1 and desc[0].text is not None:
-                desc[0].text = desc[0].text.upper()
-            else:
-                for yy in desc:
-                    if yy.text is not None:
-                        yy.text = yy.text.upper()
-            # Drop the pydocx-caps tag
-            xx.drop_tag()
-            #xx.attrib.pop('class')
-        
-        # Drop extra tab
-        for xx in self.tree.find_class('pydocx-tab'):
+        drop_tags = []
+        drop_trees = []
+        hrs = []
+        bodies = []
+        if _is_bold(self.tree):
+            self.tree.tag = 'strong'
+        if self.tree.tag == 'div':
+            self.tree.tag = 'body'
+        if self.tree.tag == 'body':
+            bodies.append(self.tree)
+        self._clean_walk(self.tree, drop_tags, drop_trees, hrs, bodies)
+        
+        # Drop the pydocx-caps and pydocx-tab tags, then the empty <p>, <em> and <strong> blocks
+        for xx in drop_tags:
             xx.drop_tag()
-
-        # Get rid of some extra tags
-        for xx in self.tree.xpath('//p'):
-            if (xx.text_content().strip()=='' or xx.text_content() is None):
-                xx.drop_tree()
-        
-        for xx in self.tree.xpath('//em'):
-            if (xx.text_content().strip()=='' or xx.text_content() is None):
-                xx.drop_tree()
-        
-        #print len(self.tree.xpath('//strong'))
-        for xx in self.tree.xpath('//strong'):
-            if (xx.text_content().strip() == '' or xx.text_content() is None) and xx.getchildren() == []:
-                xx.drop_tree()
-                #print 'here'
-                #xx.getparent().remove(xx)
+        for xx in drop_trees:
+            xx.drop_tree()
 
         #Some testing scripts
         #tmp_content = self.tree.xpath('//body/p[138]')[0]
@@ -235,8 +315,8 @@ class CouncilHansard(object):
         
         
         # Handle More than 2 hr tags
-        #print len(self.tree.xpath('//hr'))
-        if len(self.tree.xpath('//hr'))>2:
+        #print len(hrs)
+        if len(hrs)>2:
             # If there are 2 <hr> tags, they divide the hansard
 
             # Usually this happens for Chinese, e.g. see 2015-04-22: Only Chinese version
@@ -256,16 +336,18 @@ class CouncilHansard(object):
                 #pattern_next = 'NEXT MEETING'
             
             #search for the clerk block, and strip all <hr> before it
-            for block in self.tree.xpath('//body/*'):
-                if re.match(pattern_clerk,block.text_content()) is None:
-                    if block.tag == 'hr':
-                        block.drop_tree()
-                    if block.xpath('.//hr'):
-                        hrs = block.xpath('.//hr')
-                        for hr in hrs:
-                            hr.drop_tree()
-                else:
+            before_clerk = set()
+            for block in [xx for body in bodies for xx in body if isinstance(xx.tag, basestring)]:
+                if re.match(pattern_clerk,block.text_content()) is not None:
                     break
+                before_clerk.add(block)
+            for hr in hrs:
+                # The block of the <hr> is its ancestor in the <body>
+                block = hr
+                while block is not None and block.getparent() not in bodies:
+                    block = block.getparent()
+                if block in before_clerk:
+                    hr.drop_tree()
             
             # strip all <hr> tags except the one after clerks
             #for hr in self.tree.xpath('./body//hr')[1:]:
@@ -275,7 +357,7 @@ class CouncilHansard(object):
         # Some titles may be broken. Join them.
         # Actually the main heading may also need this, but is ignored for now.
         #for p in self.tree.xpath('//body/p[count(preceding::hr)=1]'):   #i.e. the main_content
-        for p in self.tree.xpath('//body/p'):
+        for p in [xx for body in bodies for xx in body if xx.tag == 'p']:
             if p.tail is None: #no text before first element
                 children = p.getchildren()
                 if len(children)>1:
@@ -294,9 +376,11 @@ class CouncilHansard(object):
         #Notice that this html is not the same as from RawCouncilHansard._dump_as_fixture(),
         #and is stored in a different folder
 
-        self._dump_as_fixture(append_str='cleaned')
-        logger.info(u'Finished _clean().')
+        if self.config.dump_fixtures:
+            self._dump_as_fixture(append_str='cleaned')
+        self._log_progress(u'Finished _clean().')
                 
+    @timing.timed
     def _parse(self):
         """
         Parse the source document and populate this object's properties
@@ -321,23 +405,19 @@ class CouncilHansard(object):
         # In these cases, we can either look inside the content of <p> tag to decide,
         #or we can match the header strings to see.
         
-        if self.language == LANG_EN:
-            LIST_OF_HEADERS = LIST_OF_HEADERS_e
-        elif self.language == LANG_CN:
-            LIST_OF_HEADERS = LIST_OF_HEADERS_c
-        else:
+        if self.language not in SECTION_PARSERS:
             logger.error(u'The Hansard parser cannot handle Floor Recording:{}'.format(self.uid))
             self._count_errors+=1
             return None
-        logger.info(u'Language: {}'.format(self.language))
+        self._log_progress(u'Language: {}', self.language)
         
         main_content = self._parse_main_heading(self.tree.xpath('//body/*'))
         
         ### parsing main_content: ###
         # Strategy: we do not make any assumption on the order of occurrence of each section.
-        # We will loop over all Elements of main_content, checking for headers - if a <strong> tag
-        # is present, is upper case, and the text matches one of the element in LIST_OF_HEADERS, 
-        # we remember it and append all following Elements to a list, until another header is found. 
+        # We will loop over all Elements of main_content, checking for headers - if the text
+        # matches one of the headers in SECTION_HEADERS, we remember it and append all following
+        # Elements to a list, until another header is found. 
         # In this case, we update the CouncilHansard.SECTION_MAP with the corresponding key(header name) and 
         # value(list of Elements).
         # Afterwards, we will pass these sections on for further processing.
@@ -345,46 +425,29 @@ class CouncilHansard(object):
         
         # Without assuming order, loop through all elements for potential headers
         # Note that there are some info about the beginning of meeting (after first <hr>)
-        elem_key = u'BEFORE MEETING' if self.language==LANG_EN else u'會議前'
+        elem_key = BEFORE_MEETING_e if self.language==LANG_EN else BEFORE_MEETING_c
         elem_list = []
         
         #Do not make any assumption on what sections will pop up
         SECTION_MAP = OrderedDict()
         
+        headers = SECTION_HEADERS[self.language]
+        max_length = max(len(xx) for xx in headers)
         for part in main_content:
-            if self.language==LANG_EN:
-                if (part.xpath('.//strong') is not None and part.text_content().strip().isupper()) or part.tag=='strong':
-                    #Potential header
-                    #print part.text_content()
-                    potential_header = part.text_content().strip()
-                    if potential_header in LIST_OF_HEADERS:
-                        # New header found
-                        if elem_list !=[]:
-                            SECTION_MAP.update({elem_key:elem_list}) # save the previous part
-                        elem_key = potential_header #update key
-                        elem_list = [] #empty list
-                        continue
-                elem_list.append(part)
-            elif self.language==LANG_CN:
-                if (part.xpath('./strong') is not None and len(part.xpath('./strong'))==1) or part.tag=='strong':
-                    #Potential header
-                    #potential_header = part.xpath('./strong')[0].text_content()
-                    potential_header = part.text_content()
-                    #print potential_header
-                    if potential_header in LIST_OF_HEADERS:
-                        # New header found
-                        if elem_list !=[]:
-                            SECTION_MAP.update({elem_key:elem_list}) # save the previous part
-                        elem_key = potential_header #update key
-                        #print elem_key
-                        elem_list = [] #empty list
-                        continue
-                elem_list.append(part)
+            potential_header = self._get_header_text(part, max_length)
+            if potential_header in headers:
+                # New header found
+                if elem_list !=[]:
+                    SECTION_MAP.update({elem_key:elem_list}) # save the previous part
+                elem_key = potential_header #update key
+                elem_list = [] #empty list
+                continue
+            elem_list.append(part)
         SECTION_MAP.update({elem_key:elem_list})#do not forget the last section
         
-        logger.info(u'Total number of sections found = {}'.format(len(SECTION_MAP.keys())))
+        self._log_progress(u'Total number of sections found = {}', len(SECTION_MAP.keys()))
         for key in SECTION_MAP.keys():
-            logger.info(u'Found section: {}'.format(key))
+            self._log_progress(u'Found section: {}', key)
         
         
         # Useful scripts:
@@ -400,56 +463,50 @@ class CouncilHansard(object):
             self.sections.append(key)
 
         # Forward each section to its corresponding parser
-        lang_char = 'e' if self.language==LANG_EN else 'c'
+        parsers = SECTION_PARSERS[self.language]
         for section in SECTION_MAP.keys():
-            #logger.info(u'Parsing {} section for Hansard: {}'.format(section, self.uid))
-            
-            if section == 'BEFORE MEETING':
-                logger.info(u'Parsing BEFORE MEETING...')
-                self._parse_before_meeting(SECTION_MAP[section])
-                logger.info(u'Done.')
-            elif section == eval('TABLED_PAPERS_{}'.format(lang_char)):
-            #elif section == globals()['TABLED_PAPERS_{}'.format(lang_char)]: #also works
-                logger.info(u'Parsing TABLED_PAPERS...')
-                self._parse_tabled_papers(SECTION_MAP[section])
-                logger.info(u'Done.')
-            elif section == eval('URGENT_QUESTIONS_{}'.format(lang_char)):
-                logger.info(u'Parsing URGENT_QUESTIONS...')
-                self._parse_urgent_questions(SECTION_MAP[section])
-                logger.info(u'Done.')
-            elif section == eval('ORAL_QUESTIONS_{}'.format(lang_char)):
-                logger.info(u'Parsing ORAL_QUESTIONS...')
-                self._parse_oral_answers_to_questions(SECTION_MAP[section])
-                logger.info(u'Done.')
-            elif section == eval('WRITTEN_QUESTIONS_{}'.format(lang_char)):
-                logger.info(u'Parsing WRITTEN_QUESTIONS...')
-                self._parse_written_answers_to_questions(SECTION_MAP[section])
-                logger.info(u'Done.')
-            elif section == eval('BILLS_{}'.format(lang_char)):
-                logger.info(u'Parsing BILLS...')
-                self._parse_bills(SECTION_MAP[section])
-                logger.info(u'Done.')
-            elif section == eval('MOTIONS_{}'.format(lang_char+'1')) or \
-                section == eval('MOTIONS_{}'.format(lang_char+'2')):
-                logger.info(u'Parsing MOTIONS...')
-                self._parse_motions(SECTION_MAP[section])
-                logger.info(u'Done.')
-            elif section == eval("CE_Q_AND_A_{}".format(lang_char)):
-                logger.info(u'Parsing CE_Q_AND_A...')
-                self._parse_CE_Q_AND_A(SECTION_MAP[section])
-                logger.info(u'Done.')
-            elif section == eval('SUSPENSION_{}'.format(lang_char)) or\
-                 section == eval('NEXT_MEETING_{}'.format(lang_char)) or\
-                 section == eval('ADJOURNMENT_{}'.format(lang_char)):
-                logger.info(u'Parsing ENDING...')
-                self.suspension = self._parse_ending(SECTION_MAP[section])
-                logger.info(u'Done.')
+            if section in parsers:
+                parser = parsers[section]
+                self._log_progress(u'Parsing {}...', section)
+                with timing.stage(self, getattr(parser, '__name__', parser), SECTION_MAP[section]):
+                    self._get_section_parser(parser)(SECTION_MAP[section])
+                self._log_progress(u'Done.')
                 
-        logger.info(u'Done parsing all recognised sections.')
-        self._dump_as_fixture(append_str='end')
+        self._log_progress(u'Done parsing all recognised sections.')
+        if self.config.dump_fixtures:
+            self._dump_as_fixture(append_str='end')
         #self._dump_as_fixture()
+
+    def _get_header_text(self, elem, max_length):
+        """
+        Returns the text of elem to look up in SECTION_HEADERS, or None if elem cannot be a header.
+        Most elements are paragraphs much longer than any header, so the text is only collected
+        up to max_length characters.
+        """
+        if self.language==LANG_CN:
+            # Chinese headers are in a single <strong> box, and are not stripped
+            if elem.tag != 'strong' and len(elem.findall('strong')) != 1:
+                return None
+            strip = False
+        else:
+            strip = True
+        text = u''
+        for chunk in elem.itertext():
+            text += chunk
+            if len(text.strip() if strip else text) > max_length:
+                return None
+        return text.strip() if strip else text
+
+    def _get_section_parser(self, parser):
+        """
+        The callable for an entry of SECTION_PARSERS
+        """
+        if isinstance(parser, basestring):
+            return getattr(self, parser)
+        return lambda elem_list: parser(self, elem_list)
         
     ## Parsers for sections
+    @timing.timed
     def _parse_main_heading(self,heading_list):  
         """
         Parser for main heading of Hansard.
@@ -573,7 +630,7 @@ class CouncilHansard(object):
             list_members_pres = self._get_member_list(members_pres)
             self.president = list_members_pres[0]
             self.members_present = list_members_pres[1:]
-        logger.info(u'Finshed parsing members attending.')
+        self._log_progress(u'Finshed parsing members attending.')
         
         #3. Get absent members
         try:
@@ -582,7 +639,7 @@ class CouncilHansard(object):
         except:
             # Rare but full attendance happens
             self.members_absent = None
-        logger.info(u'Finished parsing members absent.')
+        self._log_progress(u'Finished parsing members absent.')
 
         #4. The list of public officers is a little different: 
         # For English, the first line is a name+title, with a second line about his/her position
@@ -663,7 +720,7 @@ class CouncilHansard(object):
                         
                 self.public_officers = tmp_list
         
-        logger.info(u'Finished parsing public officers present.')
+        self._log_progress(u'Finished parsing public officers present.')
         
         #5. Finally, the clerks in attendance
         #the format in harsard is: name, title(s)[optional],position
@@ -701,7 +758,7 @@ class CouncilHansard(object):
      
         self.clerks = clerk_list
         
-        logger.info(u'Finished parsing clerks present.')
+        self._log_progress(u'Finished parsing clerks present.')
         
         return main_content
         #Done.
@@ -757,7 +814,7 @@ class CouncilHansard(object):
         for elem in elem_list:
             if elem.tag == u'table':
                 table_list.append(elem)
-        logger.info(u'Found {} tables.'.format(len(table_list)))
+        self._log_progress(u'Found {} tables.', len(table_list))
         
         if len(table_list) == 2:
             # Best result, two tables
@@ -838,10 +895,10 @@ class CouncilHansard(object):
         # In Chinese titles are enclosed with '《》' but ones in English do not
         # Assume all legislation papers are in table
         
-        logger.info(u'Parsing legislation table...')
+        self._log_progress(u'Parsing legislation table...')
         if elem_list is None:
             return None
-        print elem_list.tag
+        self._log_progress(u'Legislation table in <{}>', elem_list.tag)
         table = None
         # If there is a table, we work on it only
         try:
@@ -893,7 +950,7 @@ class CouncilHansard(object):
         Parser for Other Papers portion of Tabling of Papers section.
         """
         
-        logger.info(u'Parsing Other Papers...')
+        self._log_progress(u'Parsing Other Papers...')
         
         if elem_list is None:
             return None
@@ -1147,7 +1204,7 @@ class CouncilHansard(object):
         """
         Parse English xxx_answers to questions.
         """
-        logger.info(u'Parsing (English) answers to questions.')
+        self._log_progress(u'Parsing (English) answers to questions.')
         
         # Drop <span> tags for pre-2012 hansard question number
         for elem in elem_list:
@@ -1306,7 +1363,7 @@ class CouncilHansard(object):
         """
         Parser for Chinese xxx_answers_to_questions section.
         """
-        logger.info(u'Parsing (Chinese) answers to questions.')
+        self._log_progress(u'Parsing (Chinese) answers to questions.')
         # Firstly, split up questions by looking at titles
         # A title has following characteristic:
         # 1. A <p> block with one single <strong> child.
@@ -1786,37 +1843,50 @@ class CouncilHansard(object):
         return self.parse_dialogs(dialog_list)
     
     
+    def _parse_suspension(self,elem_list):
+        self.suspension = self._parse_ending(elem_list)
+    
+    
     # Common Functions
     
     def parse_dialogs(self,elem_list,disable_event = False):
         """
         Given dialogs as a list of Element objects,
         returns a list of 2-tuple [(speaker_0,speech), (speaker_1,speech), ...]
+        See iter_dialogs().
+        """
+        return list(self.iter_dialogs(elem_list,disable_event))
+    
+    def iter_dialogs(self,elem_list,disable_event = False):
+        """
+        Given dialogs as a list of Element objects,
+        yields 2-tuples (speaker,speech) as the speeches are found.
         The speech is in form of raw HTML string. Sometimes speaker will be NONE,
         which indicates some events happens between dialogs.
         The DISABLE_EVENT flag indicates whether to look for events.
         Usually set to FALSE except for written questions.
+        The elements are modified as they are processed.
         """
         # we do not have to care about titles here - they are supposed to be filtered out
         # already before coming in.
         # Sometimes there are text enclosed by brackets i.e. (xxx) when events happens.
         
+        # The speech is kept as a list of HTML fragments, and joined when it is complete
+        speaker = None
+        speech = []
         for elem in elem_list:
-            spans = elem.xpath('.//span')
-            if spans != []:
-                for xx in spans:
-                    xx.drop_tag()
-        
-        
-        # Before start, sometimes a speaker's name is split into 2 <strong> blocks.
-        # Merge them for easier processing
-        for elem in elem_list:
+            for xx in elem.xpath('.//span'):
+                xx.drop_tag()
+            
+            # Sometimes a speaker's name is split into 2 <strong> blocks.
+            # Merge them for easier processing
             strong_boxes = elem.xpath('.//strong')
             if len(strong_boxes)>=2:
                 # at the moment, check only the first 2 strong boxes
                 # may extent this check if exceptional case is found in future
-                if strong_boxes[1].xpath('preceding-sibling::*[1]') !=[]:
-                    if strong_boxes[1].xpath('preceding-sibling::*[1]')[0] == strong_boxes[0]\
+                preceding = strong_boxes[1].xpath('preceding-sibling::*[1]')
+                if preceding !=[]:
+                    if preceding[0] == strong_boxes[0]\
                     and strong_boxes[0].tail is None and\
                     strong_boxes[0].tag == 'strong' and strong_boxes[1].tag == 'strong':
                         if strong_boxes[0].text is not None and strong_boxes[1].text is not None:
@@ -1824,66 +1894,50 @@ class CouncilHansard(object):
                         else:
                             strong_boxes[0].text = strong_boxes[1].text
                         strong_boxes[1].drop_tree()
-                
-        # Process the speeches
-        speaker = None
-        speech = u''
-        list_of_speeches = []
-        event_pattern = ur'^\(.+\)$'
-        for elem in elem_list:
-            #print elem.text_content()
             
             # Check for events. Can be disable via 'disable_event' flag
             if disable_event is False:
-                event_match = re.match(event_pattern, elem.text_content().strip())
-                if event_match is not None:
+                text = elem.text_content()
+                if EVENT_RE.match(text.strip()) is not None:
                     #An event happens.
                     #store previous speech
-                    if speech != u'' and speech is not None:
-                        list_of_speeches.append((speaker,speech.lstrip(u':')))
-                        #speaker = None
-                        speech = u''
+                    if speech:
+                        yield (speaker,u''.join(speech).lstrip(u':'))
+                        speech = []
                     #store event
-                    list_of_speeches.append((None,elem.text_content().lstrip(u':')))
+                    yield (None,text.lstrip(u':'))
                     continue
                 
             # sometimes <hr> tags corrupts the format, such that the text is not in <p> box.
             if elem.tag == 'strong' and elem.tail is not None:
                 # A new speaker
                 # save previous speech
-                if speech != u'':
-                    list_of_speeches.append((speaker,speech))
-                    speaker = u''
-                    speech = u''
+                if speech:
+                    yield (speaker,u''.join(speech))
+                    speech = []
                 speaker = elem.text.strip()
-                speech = elem.tail.lstrip(u':')
+                _append_fragment(speech,elem.tail.lstrip(u':'))
             
             # normal element
             else:
                 # Check if there is a new speaker
-                if len(elem.xpath('./strong')) >0 and elem.xpath('./strong')[0].tail is not None:
+                strong_boxes = elem.xpath('./strong')
+                if strong_boxes and strong_boxes[0].tail is not None:
                     # save last speech
-                    if speech != u'':
-                        list_of_speeches.append((speaker,speech))
-                        speaker = u''
-                        speech = u''
-                    speaker = elem.xpath('./strong')[0].text_content()
-                    elem.xpath('./strong')[0].drop_tree() #remove speaker so we have only text
+                    if speech:
+                        yield (speaker,u''.join(speech))
+                        speech = []
+                    speaker = strong_boxes[0].text_content()
+                    strong_boxes[0].drop_tree() #remove speaker so we have only text
                 # remove heading ':'
                 if elem.text:
                     elem.text = elem.text.lstrip(u':')
 
-                speech = u''.join([speech,remove_hr_tags(tostring(elem))])
+                _append_fragment(speech,_tostring_without_hr(elem))
         # Save last one
-        if speech.strip() != u'' and speech is not None:
-            list_of_speeches.append((speaker,speech))
-            
-        #print len(list_of_speeches)
-        #for speech in list_of_speeches:
-        #    print speech[0]
-        #print list_of_speeches[0][1]
-        
-        return list_of_speeches
+        speech = u''.join(speech)
+        if speech.strip() != u'':
+            yield (speaker,speech)
         
     
     
@@ -1932,56 +1986,117 @@ class CouncilHansard(object):
         
         raw_date = self.raw_date
         lang_char = u'e' if self.language==LANG_EN else u'c'
-        question_map = []
         
+        # The uid of each question, and of the urgent question with the same number
+        #example: question-20150603-u3-e
+        uids = []
         for question in question_list:
             question_number = question[0]
-            # Generate an uid
-            #example: question-20150603-u3-e
-            q_obj = None
-            try:
-                question_uid = u'{}-{}-{}-{}'.format(UID_PREFIX,raw_date,question_number,lang_char)
-                q_obj = RawCouncilQuestion.objects.get_by_uid(question_uid)
-            except:
-                try:
-                # Perhaps it is an urgent question
-                    question_uid = u'{}-{}-u{}-{}'.format(UID_PREFIX,raw_date,question_number,lang_char)
-                    q_obj = RawCouncilQuestion.objects.get_by_uid(question_uid)    
-                except:
-                    # Cannot find a matching
-                    logger.warn(u"Cannot find a matching question for Oral question: {}-{}".format(question_number,question[1]))
+            uids.append((u'{}-{}-{}-{}'.format(UID_PREFIX,raw_date,question_number,lang_char),
+                         u'{}-{}-u{}-{}'.format(UID_PREFIX,raw_date,question_number,lang_char)))
+        
+        # Fetch all of the candidates at once, unless they have been loaded already
+        question_index = self.question_index
+        if question_index is None:
+            question_index = RawCouncilQuestion.objects.index_by_uid(itertools.chain(*uids))
+        
+        question_map = []
+        for question, (question_uid, urgent_uid) in zip(question_list, uids):
+            # Perhaps it is an urgent question
+            q_obj = question_index.get(question_uid) or question_index.get(urgent_uid)
+            if q_obj is None:
+                # Cannot find a matching
+                logger.warn(u"Cannot find a matching question for Oral question: {}-{}".format(question[0],question[1]))
             
             # Append anyway
             question_map.append(q_obj)
-            #print q_obj
             
         return question_map            
                     
                     
+    def _log_progress(self, message, *args):
+        # Only formatted when it is logged, the parsers call this a lot
+        if self.config.log_progress and logger.isEnabledFor(logging.INFO):
+            logger.info(message.format(*args))
+
     def _dump_as_fixture(self,append_str='cleaned'):
         """
-        Saves the raw html to a fixture for testing
+        Saves the raw html to a fixture for testing, under the fixtures_path of the configuration
         """
+        path = u'{}/{}_{}.html'.format(self.config.fixtures_path,self.uid,append_str)
         try:
-            print 'raw/tests/fixtures/docs/{}_{}.html'.format(self.uid,append_str)
-            with open('raw/tests/fixtures/docs/{}_{}.html'.format(self.uid,append_str), 'wb') as f:
+            with open(path, 'wb') as f:
                 f.write(etree.tostring(self.tree))
-        except:
-            print "Cannot open the file"
+        except (IOError, OSError):
+            logger.warn(u'Cannot open the file {}'.format(path))
     
-    def _convert_bold_to_strong(self):
+    def _clean_walk(self, elem, drop_tags, drop_trees, hrs, bodies):
         """
-        Given a tree with styles, convert the tags of elements to 'strong' if the font style is bold.
-        This is mainly for pre-2012 Hansards.
+        Cleans the descendants of elem, see _clean().
+        The tags to drop are appended to drop_tags and drop_trees, children before their parents,
+        the <hr> tags that are kept to hrs and the <body> tags to bodies, in document order.
+        Returns a tuple of
+        - whether there is any text other than whitespace in elem, i.e. elem.text_content().strip() != ''
+        - the number of descendants of elem
+        - the number of children elem will have once the tags are dropped
         """
-        for elem in self.tree.xpath('//*'):
-            try:
-                style =  elem.attrib['style']
-            except KeyError: # some Elements do not have style
+        descendants = 0
+        children = 0
+        has_text = False
+        i = 0
+        while i < len(elem):
+            child = elem[i]
+            if not isinstance(child.tag, basestring):
+                # Comments and processing instructions
+                i += 1
+                children += 1
+                continue
+            if _is_bold(child):
+                child.tag = 'strong'
+            if child.tag == 'div':
+                # The children of the div take its place, and are visited next
+                child.drop_tag()
                 continue
-            if 'font-weight:bold' in style:
-                elem.tag = 'strong'
-                #print elem.tag
+            i += 1
+            kept_hrs = len(hrs)
+            if child.tag == 'hr':
+                hrs.append(child)
+            elif child.tag == 'body':
+                bodies.append(child)
+            child_text, child_descendants, child_children = self._clean_walk(child, drop_tags, drop_trees, hrs, bodies)
+            has_text = has_text or child_text
+            descendants += 1 + child_descendants
+            classes = child.get('class', '').split()
+            if 'pydocx-caps' in classes:
+                # CapsLock also happens in Chinese (in titles)
+                # Make all text inside uppercase.
+                if child_descendants == 0:
+                    if child.text is not None:
+                        child.text = child.text.upper()
+                else:
+                    for yy in child.iterdescendants(tag=etree.Element):
+                        if yy.text is not None:
+                            yy.text = yy.text.upper()
+                drop_tags.append(child)
+                children += child_children
+            elif 'pydocx-tab' in classes:
+                # Drop extra tab
+                drop_tags.append(child)
+                children += child_children
+            elif child.tag in ('p', 'em') and not child_text:
+                drop_trees.append(child)
+                del hrs[kept_hrs:]
+            elif child.tag == 'strong' and not child_text and child_children == 0:
+                # Only counts as a child if the parent is a <strong>, which is checked first
+                drop_trees.append(child)
+                del hrs[kept_hrs:]
+                children += 1
+            else:
+                children += 1
+        # The text and tails are final once the divs are stripped
+        if not has_text:
+            has_text = _has_text(elem.text) or any(_has_text(xx.tail) for xx in elem)
+        return has_text, descendants, children
     
 
 # Common utils
@@ -1997,6 +2112,45 @@ def get_all_hansards(language=-1):
     return objs.all()
 
 
+def _dialog_records(dialogs):
+    # The dialogs of a question that could not be parsed are an error message instead of a list
+    if not isinstance(dialogs, list):
+        return dialogs
+    return [Dialog(speaker, speech) for speaker, speech in dialogs]
+
+
+def _is_bold(elem):
+    """
+    Whether the font style of an element is bold
+    """
+    style = elem.get('style')
+    return style is not None and 'font-weight:bold' in style
+
+
+def _has_text(text):
+    return bool(text) and not text.isspace()
+
+
+def _append_fragment(fragments, html):
+    if html:
+        fragments.append(html)
+
+
+def _tostring_without_hr(elem):
+    """
+    The HTML string of an element and its tail, without the <hr> tags
+    """
+    if elem.tag == 'hr':
+        return tostring(elem)[len(tostring(elem, with_tail=False)):]
+    for hr in list(elem.iterdescendants('hr')):
+        parent = hr.getparent()
+        hr.drop_tree()
+        # Keep <p></p> from being written as <p/>
+        if parent.text is None and len(parent) == 0:
+            parent.text = ''
+    return tostring(elem)
+
+
 def remove_hr_tags(str_obj):
         """
         Remove all <hr> tags in strings
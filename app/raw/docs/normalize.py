@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+"""
+Normalization of the document sources before they are parsed
+
+The sources use several characters for the same thing (directional quotes, half and full width
+colons...), which makes string search in the parsers unreliable.  The replacements are
+kept in tables, and a Normalizer applies a table to a string in a single pass.
+"""
+import re
+
+
+# Directional quotation marks to regular quotes
+QUOTES = {
+    u'\u201c': u'"',
+    u'\u201d': u'"',
+    u'\u2018': u"'",
+    u'\u2019': u"'",
+}
+
+# The colons ：, ︰ and ﹕ to ':'
+COLONS = {
+    u'\uff1a': u':',
+    u'\ufe30': u':',
+    u'\ufe55': u':',
+}
+
+# Line breaks and tabs, which carry no meaning in the html
+LAYOUT = {
+    u'\n': u'',
+    u'\t': u'',
+}
+
+# "Zero width joiners" appear in random places in the text
+INVISIBLE = {
+    u'\u200d': u'',
+}
+
+
+def merge(*tables):
+    res = {}
+    for table in tables:
+        res.update(table)
+    return res
+
+
+class Normalizer(object):
+    """
+    Replaces all of the keys of a table found in a string with their values, in one pass.
+
+    The keys can be unicode or byte strings, and of any length.  Where keys overlap
+    the longest one is replaced.
+    """
+    def __init__(self, table):
+        self.table = dict(table)
+        keys = sorted(self.table, key=len, reverse=True)
+        # Byte string keys need a byte string pattern
+        empty = '' if all(isinstance(kk, str) for kk in keys) else u''
+        escaped = [re.escape(kk) for kk in keys]
+        if all(len(kk) == 1 for kk in keys):
+            pattern = empty.join(['['] + escaped + [']'])
+        else:
+            pattern = (empty + '|').join(escaped)
+        self.pattern = re.compile(pattern)
+
+    def _replace(self, match):
+        return self.table[match.group(0)]
+
+    def __call__(self, text):
+        # unicode.translate would do for single characters, but it is several times
+        # slower than a regex on Python 2
+        return self.pattern.sub(self._replace, text)
+
+
+# Applied to the html of the agendas and hansards
+normalize_source = Normalizer(merge(QUOTES, COLONS, LAYOUT, INVISIBLE))
+
+# Applied to the html of the questions, where line breaks matter
+normalize_colons = Normalizer(COLONS)
@@ -16,9 +16,34 @@ from lxml.html import HTMLParser
 import urllib2
 from urllib2 import HTTPError
 from ..scraper.settings import USER_AGENT
+from .normalize import Normalizer, normalize_colons
+from . import timing
 
 logger = logging.getLogger('legcowatch-docs')
 
+# Bump when a change to the parser changes its results or the attributes of the parser objects,
+# to invalidate the cached results: they are pickled parser objects
+PARSER_VERSION = 3
+
+# Occasionally a character '财','绊' etc. is placed between newlines.
+# These are the bytes in the source, before decoding
+remove_undesired = Normalizer({'\x83\xdc': '', '\x84P': '', '\x84h': ''})
+
+# Typos in the headers of the questions, which break the matching of askers and repliers
+fix_header_typos = Normalizer({
+    u'urder': u'under',
+    u'rely': u'reply', #ask Legco to fix this, since 'rely' is a legal word
+    u'council': u'Council',
+    u'Legilsative': u'Legislative',
+    u'Legisative': u'Legislative',
+    u'Counil': u'Council',
+    u'立法會會會': u'立法會會議',
+    u'立會會議': u'立法會會議',
+    u'立法會議': u'立法會會議',
+    #Very weird string in some cases:\xa0\xa0
+    u'\xa0\xa0': u' ',
+})
+
 class CouncilQuestion(object):
     """
     Object representing the Council Question document (actually the reply as well).  
@@ -57,12 +82,14 @@ class CouncilQuestion(object):
         self.asker = None
         self.reply_content = None
         self.repliers = None
-        self._load()
-        self._parse()
+        with timing.document(self):
+            self._load()
+            self._parse()
         
     def __repr__(self):
         return u'<CouncilQuestion: {}>'.format(self.uid)
     
+    @timing.timed
     def _load(self):
         """
         Load the ElementTree from the source
@@ -96,18 +123,12 @@ class CouncilQuestion(object):
         # Use the lxml cleaner
         if htm:
             #Get rid of undesired characters here
-            #use a list of dict to replace them differently (optional)
-            list_undesired = [{'\x83\xdc':''},{'\x84P':''},{'\x84h':''},] #occasionally a character '财','绊' etc. is placed between newlines
-            #replace different types of colons
-            #list_undesired.append({'\xef\xbc\x9a':':'})
-            #list_undesired.append({'\xef\xb8\xb0':':'})
-            #list_undesired.append({'\xef\xb9\x95':':'})
-            #list_undesired.append({'\xa0':' '})
-            for item in list_undesired:
-                htm=htm.replace(item.keys()[0],item.values()[0])
+            htm = remove_undesired(htm)
             
             # Assume 香港增補字符集(big5hkscs) is used
             htm = htm.decode('hkscs',errors='ignore')
+            # Convert the different types of colons to ':', see raw.docs.normalize
+            htm = normalize_colons(htm)
             
             cleaner = Cleaner()
             parser = HTMLParser(encoding='utf-8')
@@ -118,6 +139,7 @@ class CouncilQuestion(object):
         else:
             self.tree = None
         
+    @timing.timed
     def _parse(self):
         #only the 'pressrelease' part is needed
         try:
@@ -140,15 +162,9 @@ class CouncilQuestion(object):
         main_body_str = main_body.text_content() # do not strip, keep the format
         #print('Main Body String:{}'.format(main_body_str.encode('utf-8')))
         
-        #=========================================================================#
-        #TODO: there are a lot of different encodings of colons, e.g.
-        #(:,：,︰,﹕) - with unicodes \u3A, \uFF1A, \uFE30, \ufe55 respectively (may be more)
-        #and can have with whitespace ahead of them (no need to care for behind)
-        #sometimes the colon is missing...
-        #Find a way to handle them concisely! 
-        #e.g. convert all alias to one kind, ':'
-        #Currently, ur'\s?:' is used to deal with them - but be cautious! 
-        #=========================================================================#
+        # The different encodings of colons (:,：,︰,﹕) have all been converted to ':' in _load.
+        # They can have whitespace ahead of them (no need to care for behind), and
+        # sometimes the colon is missing, so ur'\s?:?' is used to deal with them - but be cautious! 
         
         # Parse the title
         #title_re_e = ur'LC(.*)?Q(?P<number>\d*)?:\s*(?P<subject>.+)' #e.g. 'LCQ17: Babies born in Hong Kong to mainland women'
@@ -156,9 +172,8 @@ class CouncilQuestion(object):
         
         # Simpler, no question number
         #note that the complete title is available in html header
-        title_re_e = ur'(?s).+\s*(:|：|︰|﹕)\s*(?P<subject>.+)' 
-        title_re_c = ur'(?s).+\s*(:|：|︰|﹕)\s*(?P<subject>.+)'
-        #notice the difference of colon (half- and full-width) in the above regex
+        title_re_e = ur'(?s).+\s*:\s*(?P<subject>.+)' 
+        title_re_c = ur'(?s).+\s*:\s*(?P<subject>.+)'
         #print(u'Title str: {}'.format(title_str))
         match_pattern = title_re_e if self.english else title_re_c
         match_title = re.match(match_pattern, title_str)
@@ -175,11 +190,11 @@ class CouncilQuestion(object):
             
         # Parse the main body - 3 parts
         #1. header of question, including date, asker and replier(s)
-        header_re_e = ur'(?P<header>.+)Question(s?)\s?(:|：|︰|﹕)'
-        header_re_c = ur'(?P<header>.+)問題\s?(:|：|︰|﹕)'
+        header_re_e = ur'(?P<header>.+)Question(s?)\s?:'
+        header_re_c = ur'(?P<header>.+)問題\s?:'
         # sometimes the phrase "問題:" is absent. Match up to the 1st colon instead.
         # Below should be the most general case. Too general that I prefer not to use.
-        header_re_colon = ur'((?P<header>[^(:|：|︰|﹕)]*))' 
+        header_re_colon = ur'((?P<header>[^(:|)]*))' 
         match_pattern = header_re_e if self.english else header_re_c
         match_header = re.match(match_pattern, main_body_str.strip()) #strip here make it easier - get rid of newline
         if match_header is None:
@@ -227,17 +242,7 @@ class CouncilQuestion(object):
                 asker_re_c.append(ur'(?s)(.*)立法會會議上(?P<asker>.+)(就.*?)?的提問(（.*）)?(和|及)(?P<repliers>.+)的(.*?)(答|回)覆')
                 asker_re_c.append(ur'(?s)(.*)立法會(會議)?上?(?P<asker>.+)(就.*?)?的提問(和|及)(?P<repliers>.+)書面(答|回)覆')
             
-            header_str = header_str.replace('urder','under')
-            header_str = header_str.replace('rely','reply') #ask Legco to fix this, since 'rely' is a legal word
-            header_str = header_str.replace('council','Council')
-            header_str = header_str.replace('Legilsative','Legislative')
-            header_str = header_str.replace('Legisative','Legislative')
-            header_str = header_str.replace('Counil','Council')
-            header_str = header_str.replace(u'立法會會會',u'立法會會議')
-            header_str = header_str.replace(u'立會會議',u'立法會會議')
-            header_str = header_str.replace(u'立法會議',u'立法會會議')
-            #Very weird string in some cases:\xa0\xa0
-            header_str = header_str.replace(u'\xa0\xa0',' ')
+            header_str = fix_header_typos(header_str)
             
             match_patterns = asker_re_e if self.english else asker_re_c
             for pattern in match_patterns:
@@ -265,14 +270,14 @@ class CouncilQuestion(object):
         #body = main_body_str #main_body_str messes up with format structure. Match the src/htm instead.
         q_content_re_e =[]
         q_content_re_c =[]
-        q_content_re_e.append(ur'(?s).*Question(s?)\s?(:|：|︰|﹕)?(?P<q_content>(?s).*)(Reply|Answer)\s?(:|：|︰|﹕)?')
-        q_content_re_e.append(ur'(?s).*(:|：|︰|﹕)(?P<q_content>(?s).*)(Reply|Answer)\s?(:|：|︰|﹕)?')
-        q_content_re_e.append(ur'(?s).*Question(s?)\s?(:|：|︰|﹕)?(?P<q_content>(?s).*)(Madam)?(President|president)\s?(:|：|︰|﹕|,)?')
-        q_content_re_c.append(ur'(?s).*問題\s?(:|：|︰|﹕)(?P<q_content>(?s).*)(答|回)覆\s?(:|：|︰|﹕)')
-        q_content_re_c.append(ur'(?s).*(答|回)覆\s?(:|：|︰|﹕)?(?P<q_content>(?s).*)(答|回)覆\s?(:|：|︰|﹕)')
-        q_content_re_c.append(ur'(?s).*問題\s?(:|：|︰|﹕)(?P<q_content>(?s).*)(主席|主席女士)\s?(:|：|︰|﹕)')
+        q_content_re_e.append(ur'(?s).*Question(s?)\s?:?(?P<q_content>(?s).*)(Reply|Answer)\s?:?')
+        q_content_re_e.append(ur'(?s).*:(?P<q_content>(?s).*)(Reply|Answer)\s?:?')
+        q_content_re_e.append(ur'(?s).*Question(s?)\s?:?(?P<q_content>(?s).*)(Madam)?(President|president)\s?(:|,)?')
+        q_content_re_c.append(ur'(?s).*問題\s?:(?P<q_content>(?s).*)(答|回)覆\s?:')
+        q_content_re_c.append(ur'(?s).*(答|回)覆\s?:?(?P<q_content>(?s).*)(答|回)覆\s?:')
+        q_content_re_c.append(ur'(?s).*問題\s?:(?P<q_content>(?s).*)(主席|主席女士)\s?:')
         q_content_re_c.append(ur'(?s).*問題(?P<q_content>(?s).*)(答|回)覆')#1 case only
-        q_content_re_c.append(ur'(?s).*(答|回)覆：(?P<q_content>(?s).*)主席女士')#1 case only
+        q_content_re_c.append(ur'(?s).*(答|回)覆:(?P<q_content>(?s).*)主席女士')#1 case only
         
         match_patterns = q_content_re_e if self.english else q_content_re_c
         for pattern in match_patterns:
@@ -292,10 +297,10 @@ class CouncilQuestion(object):
         #3. reply to question
         reply_content_re_e = []
         reply_content_re_c = []
-        reply_content_re_e.append(ur'(?s).*(President|Madam president)\s?(:|：|︰|﹕|,)(?P<reply_content>(?s).*)Ends')
-        reply_content_re_e.append(ur'(?s).*(Reply|Answer)\s?(:|：|︰|﹕|,)(?P<reply_content>(?s).*)Ends')
-        reply_content_re_c.append(ur'(?s).*(主席|主席女士)\s?(:|：|︰|﹕|,)(?P<reply_content>(?s).*)完')
-        reply_content_re_c.append(ur'(?s).*(答|回)覆\s?(:|：|︰|﹕|,)(?P<reply_content>(?s).*)完')#sometimes '主席|主席女士' was omitted
+        reply_content_re_e.append(ur'(?s).*(President|Madam president)\s?(:|,)(?P<reply_content>(?s).*)Ends')
+        reply_content_re_e.append(ur'(?s).*(Reply|Answer)\s?(:|,)(?P<reply_content>(?s).*)Ends')
+        reply_content_re_c.append(ur'(?s).*(主席|主席女士)\s?(:|,)(?P<reply_content>(?s).*)完')
+        reply_content_re_c.append(ur'(?s).*(答|回)覆\s?(:|,)(?P<reply_content>(?s).*)完')#sometimes '主席|主席女士' was omitted
 
         match_patterns = reply_content_re_e if self.english else reply_content_re_c
         
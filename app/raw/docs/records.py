@@ -0,0 +1,38 @@
+"""
+Helpers to detach parse results from the lxml trees they were parsed from
+
+The strings returned by lxml (text_content(), xpath text...) keep a reference to their element,
+and through it to the whole tree, so a parse result holding a single one of them keeps the
+document in memory.  The docs parsers have a detach() method which replaces their results with
+records of plain strings and html snippets, made with these helpers, and drops the tree.
+"""
+from lxml import etree
+
+
+def plain(value):
+    """
+    Copy of value where the lxml strings are plain strings and the elements are html snippets.
+    Lists, tuples (including namedtuples) and dicts are copied recursively.
+    """
+    if isinstance(value, unicode):
+        # unicode() of a subclass instance is a plain copy
+        return unicode(value) if type(value) is not unicode else value
+    if isinstance(value, str):
+        return str(value) if type(value) is not str else value
+    if isinstance(value, etree._Element):
+        return to_html(value)
+    if isinstance(value, list):
+        return [plain(xx) for xx in value]
+    if isinstance(value, tuple):
+        items = [plain(xx) for xx in value]
+        return type(value)(*items) if hasattr(value, '_fields') else tuple(items)
+    if isinstance(value, dict):
+        return type(value)((plain(kk), plain(vv)) for kk, vv in value.items())
+    return value
+
+
+def to_html(elem):
+    """
+    The html of an element, without its tail
+    """
+    return etree.tounicode(elem, method='html', with_tail=False)
@@ -0,0 +1,305 @@
+"""
+Timing of the stages of the docs parsers
+
+The parsers time their stages (_load, _clean, _parse and the parser of each section) with the
+timed decorator and the stage context manager.  For each document, a record of the stages, their
+wall time, number of elements and number of errors is given to the sinks added with add_sink:
+
+Aggregator keeps the totals of each stage over all of the documents, in memory
+RecordList keeps the records themselves, in memory
+JSONLinesSink writes one JSON line per document to a file
+LoggingSink logs a summary of each document
+SlowestProfiles runs the parsers under cProfile, and keeps the profiles of the slowest documents
+
+Without sinks, which is the default, nothing is measured.
+
+>>> aggregator = Aggregator()
+>>> with sinks(aggregator):
+...     CouncilHansard(...)
+>>> print u'\n'.join(aggregator.report())
+"""
+from collections import OrderedDict
+from contextlib import contextmanager
+import cProfile
+import errno
+from functools import wraps
+import heapq
+import json
+import logging
+import os
+import pstats
+import threading
+import time
+
+
+logger = logging.getLogger('legcowatch-docs')
+
+
+_sinks = []
+_local = threading.local()
+
+
+def add_sink(sink):
+    _sinks.append(sink)
+
+
+def remove_sink(sink):
+    _sinks.remove(sink)
+
+
+@contextmanager
+def sinks(*args):
+    """
+    Sends the records of the documents parsed in the block to the given sinks
+    """
+    for sink in args:
+        add_sink(sink)
+    try:
+        yield
+    finally:
+        for sink in args:
+            remove_sink(sink)
+
+
+def _documents():
+    # The records of the documents being parsed in this thread, by id of their parser
+    if not hasattr(_local, 'documents'):
+        _local.documents = {}
+    return _local.documents
+
+
+def _count_errors(parser):
+    return getattr(parser, '_count_errors', 0)
+
+
+def _count_elements(parser, elements):
+    if elements is not None:
+        return len(elements)
+    tree = getattr(parser, 'tree', None)
+    if tree is None:
+        return 0
+    return sum(1 for xx in tree.iter())
+
+
+def _describe(e):
+    try:
+        message = unicode(e)
+    except UnicodeError:
+        message = str(e).decode('utf-8', 'replace')
+    return u'{}: {}'.format(type(e).__name__, message)
+
+
+@contextmanager
+def document(parser):
+    """
+    Records the parsing of a document by parser, and gives the record to the sinks at the end
+    """
+    documents = _documents()
+    if not _sinks or id(parser) in documents:
+        yield
+        return
+    record = {
+        'parser': type(parser).__name__,
+        'uid': getattr(parser, 'uid', None),
+        'seconds': None,
+        'errors': 0,
+        'exception': None,
+        'stages': [],
+    }
+    documents[id(parser)] = record
+    # Only one profiler can run at a time, so nested documents are not profiled
+    profile = None
+    if any(getattr(sink, 'profile', False) for sink in _sinks) and not getattr(_local, 'profiling', False):
+        profile = cProfile.Profile()
+        _local.profiling = True
+    errors = _count_errors(parser)
+    start = time.time()
+    try:
+        if profile is not None:
+            profile.enable()
+        yield
+    except Exception as e:
+        record['exception'] = _describe(e)
+        raise
+    finally:
+        if profile is not None:
+            profile.disable()
+            _local.profiling = False
+        record['seconds'] = time.time() - start
+        record['errors'] = _count_errors(parser) - errors
+        del documents[id(parser)]
+        for sink in list(_sinks):
+            try:
+                sink.record(record, profile)
+            except Exception as e:
+                logger.warn(u'Could not record the timing of {}: {}'.format(record['uid'], e))
+
+
+@contextmanager
+def stage(parser, name, elements=None):
+    """
+    Records a stage of the parsing of a document by parser.  elements is the list of the
+    elements the stage works on, by default the number of elements in the tree is counted.
+    A stage outside of a document is a document of its own.
+    """
+    if not _sinks:
+        yield
+        return
+    with document(parser):
+        record = {'stage': name, 'seconds': None, 'elements': None, 'errors': 0, 'exception': None}
+        _documents()[id(parser)]['stages'].append(record)
+        errors = _count_errors(parser)
+        start = time.time()
+        try:
+            yield
+        except Exception as e:
+            record['exception'] = _describe(e)
+            raise
+        finally:
+            record['seconds'] = time.time() - start
+            record['errors'] = _count_errors(parser) - errors
+            record['elements'] = _count_elements(parser, elements)
+
+
+def timed(method):
+    """
+    Decorator of the methods of a parser that are stages
+    """
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if not _sinks:
+            return method(self, *args, **kwargs)
+        with stage(self, method.__name__, args[0] if args and isinstance(args[0], list) else None):
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
+class Aggregator(object):
+    """
+    Totals of each stage over the documents
+    """
+    def __init__(self):
+        self.documents = 0
+        self.seconds = 0.0
+        self.exceptions = 0
+        self.stages = OrderedDict()
+
+    def record(self, record, profile=None):
+        self.documents += 1
+        self.seconds += record['seconds']
+        if record['exception'] is not None:
+            self.exceptions += 1
+        for stage_record in record['stages']:
+            totals = self.stages.setdefault(stage_record['stage'], {
+                'count': 0, 'seconds': 0.0, 'elements': 0, 'errors': 0, 'exceptions': 0,
+                'slowest': 0.0, 'slowest_uid': None,
+            })
+            totals['count'] += 1
+            totals['seconds'] += stage_record['seconds']
+            totals['elements'] += stage_record['elements'] or 0
+            totals['errors'] += stage_record['errors']
+            if stage_record['exception'] is not None:
+                totals['exceptions'] += 1
+            if stage_record['seconds'] > totals['slowest']:
+                totals['slowest'] = stage_record['seconds']
+                totals['slowest_uid'] = record['uid']
+
+    def report(self):
+        """
+        Lines of a table of the stages, slowest first
+        """
+        lines = [u'{} documents in {:.2f}s, {} exceptions'.format(self.documents, self.seconds, self.exceptions),
+                 u'{:<40} {:>6} {:>10} {:>10} {:>8} {:>6}  {}'.format(
+                     u'stage', u'count', u'total', u'slowest', u'elements', u'errors', u'slowest document')]
+        for name, totals in sorted(self.stages.items(), key=lambda xx: -xx[1]['seconds']):
+            lines.append(u'{:<40} {:>6} {:>9.3f}s {:>9.3f}s {:>8} {:>6}  {}'.format(
+                name, totals['count'], totals['seconds'], totals['slowest'], totals['elements'],
+                totals['errors'], totals['slowest_uid']))
+        return lines
+
+
+class RecordList(object):
+    """
+    Keeps the records of the documents
+    """
+    def __init__(self):
+        self.records = []
+
+    def record(self, record, profile=None):
+        self.records.append(record)
+
+
+class JSONLinesSink(object):
+    """
+    Appends the record of each document to a file, as a line of JSON
+    """
+    def __init__(self, path):
+        self.path = path
+
+    def record(self, record, profile=None):
+        with open(self.path, 'ab') as f:
+            f.write(json.dumps(record) + '\n')
+
+
+class LoggingSink(object):
+    """
+    Logs the time taken by each document and its slowest stages
+    """
+    def __init__(self, logger=logger, level=logging.INFO, stages=3):
+        self.logger = logger
+        self.level = level
+        self.stages = stages
+
+    def record(self, record, profile=None):
+        if not self.logger.isEnabledFor(self.level):
+            return
+        slowest = sorted(record['stages'], key=lambda xx: -xx['seconds'])[:self.stages]
+        self.logger.log(self.level, u'{} {} parsed in {:.3f}s with {} errors, slowest: {}'.format(
+            record['parser'], record['uid'], record['seconds'], record['errors'],
+            u', '.join(u'{} {:.3f}s'.format(xx['stage'], xx['seconds']) for xx in slowest)))
+
+
+class SlowestProfiles(object):
+    """
+    Keeps the cProfile statistics of the slowest documents.  Profiling slows the parsers down,
+    so only add this sink when looking for the cause of slow documents.
+    """
+    profile = True
+
+    def __init__(self, count=10):
+        self.count = count
+        # (seconds, uid, pstats.Stats) as a heap, fastest first
+        self._heap = []
+
+    def record(self, record, profile=None):
+        if profile is None:
+            return
+        item = (record['seconds'], record['uid'], profile)
+        if len(self._heap) < self.count:
+            heapq.heappush(self._heap, item)
+        elif item[0] > self._heap[0][0]:
+            heapq.heapreplace(self._heap, item)
+
+    def slowest(self):
+        """
+        The (seconds, uid, pstats.Stats) of the slowest documents, slowest first
+        """
+        return [(seconds, uid, pstats.Stats(profile)) for seconds, uid, profile in sorted(self._heap, reverse=True)]
+
+    def dump(self, folder):
+        """
+        Writes the statistics as <seconds>-<uid>.prof files, to read with pstats
+        Returns the paths of the files
+        """
+        try:
+            os.makedirs(folder)
+        except OSError as e:
+            # Another worker may have made it first
+            if e.errno != errno.EEXIST:
+                raise
+        paths = []
+        for seconds, uid, stats in self.slowest():
+            path = os.path.join(folder, u'{:09.3f}-{}.prof'.format(seconds, uid))
+            stats.dump_stats(path)
+            paths.append(path)
+        return paths
@@ -0,0 +1,89 @@
+"""
+Date intervals, like the terms of the memberships, indexed for the stabbing queries asked of many dates at once
+
+IntervalIndex keeps the intervals sorted by their start, so that the intervals active on a sorted list of
+dates are found in one pass, instead of one range query per date
+"""
+from bisect import bisect_left
+import heapq
+import threading
+
+
+class IntervalIndex(object):
+    """
+    Index of (start, end, item) intervals.  An interval is active on the points strictly between its start
+    and its end, and an end of None is open: the interval is active on every point after its start
+    """
+    def __init__(self, intervals):
+        intervals = sorted(intervals, key=lambda xx: xx[0])
+        self._starts = [xx[0] for xx in intervals]
+        self._ends = [xx[1] for xx in intervals]
+        self._items = [xx[2] for xx in intervals]
+
+    def __len__(self):
+        return len(self._items)
+
+    def stab(self, points):
+        """
+        Returns a dict of each of points to the list of the items active on it, in order of their start.
+        The points are swept in order, keeping the active intervals in a heap by their end
+        """
+        res = {}
+        active = []
+        i = 0
+        for point in sorted(set(points)):
+            while i < len(self._starts) and self._starts[i] < point:
+                end = self._ends[i]
+                # The open intervals sort after all of the others and are never dropped
+                heapq.heappush(active, ((0, end) if end is not None else (1, None), i))
+                i += 1
+            while active and active[0][0][0] == 0 and active[0][0][1] <= point:
+                heapq.heappop(active)
+            res[point] = [self._items[xx] for xx in sorted(xx for key, xx in active)]
+        return res
+
+    def active_on(self, point):
+        return self.stab([point])[point]
+
+    def overlapping(self, start, end):
+        """
+        The items active on any point between start and end, in order of their start
+        """
+        stop = bisect_left(self._starts, end)
+        return [self._items[i] for i in range(stop) if self._ends[i] is None or self._ends[i] > start]
+
+
+class IntervalRegistry(object):
+    """
+    Keeps the IntervalIndex of each model, built once per process with model.objects.build_interval_index().
+    Like the name matchers in raw.names, the indexes are dropped by invalidate(), which the models call when
+    one of their objects is saved or deleted, and after populating them in bulk
+    """
+    def __init__(self):
+        self.generation = 0
+        self._indexes = {}
+        self._lock = threading.Lock()
+
+    def get(self, model):
+        with self._lock:
+            if model in self._indexes:
+                return self._indexes[model]
+            generation = self.generation
+        # Built outside of the lock since it queries the database, so it may be built twice
+        index = model.objects.build_interval_index()
+        with self._lock:
+            # Do not keep an index built from objects changed in the meantime
+            if generation == self.generation:
+                self._indexes[model] = index
+        return index
+
+    def invalidate(self, *args, **kwargs):
+        """
+        Drops all of the indexes, also a receiver of the post_save and post_delete signals
+        """
+        with self._lock:
+            self.generation += 1
+            self._indexes.clear()
+
+
+intervals = IntervalRegistry()
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+"""
+Runs the micro-benchmarks in raw.benchmarks on the fixture documents
+
+$ python manage.py benchmark
+$ python manage.py benchmark normalize --repeat 50
+"""
+from optparse import make_option
+from django.core.management import BaseCommand, CommandError
+from raw.benchmarks import BENCHMARKS
+
+
+class Command(BaseCommand):
+    args = '[benchmark ...]'
+    help = 'Runs micro-benchmarks of the document processing: {}'.format(', '.join(BENCHMARKS))
+    option_list = BaseCommand.option_list + (
+        make_option('--repeat', action='store', type='int', dest='repeat', default=20,
+                    help='Number of runs of each case, the best time is shown'),
+    )
+
+    def handle(self, *args, **options):
+        names = args or BENCHMARKS.keys()
+        for name in names:
+            if name not in BENCHMARKS:
+                raise CommandError(u'Unknown benchmark {}, choose from {}'.format(name, u', '.join(BENCHMARKS)))
+        for name in names:
+            self.stdout.write(u'== {}'.format(name))
+            for line in BENCHMARKS[name](options['repeat']):
+                self.stdout.write(line)
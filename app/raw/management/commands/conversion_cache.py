@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+"""
+Shows statistics of the DOC/DOCX to HTML conversion cache, and maintains it
+
+$ python manage.py conversion_cache
+$ python manage.py conversion_cache --prune --evict
+"""
+from datetime import datetime
+from optparse import make_option
+from django.core.management import BaseCommand
+from raw import conversion
+
+
+def human_size(size):
+    for unit in ['B', 'KB', 'MB', 'GB']:
+        if size < 1024 or unit == 'GB':
+            return u'{:.1f}{}'.format(size, unit)
+        size /= 1024.0
+
+
+class Command(BaseCommand):
+    help = 'Shows the statistics of the DOC/DOCX conversion cache'
+    option_list = BaseCommand.option_list + (
+        make_option('--evict', action='store_true', dest='evict', default=False,
+                    help='Remove least recently used entries until the cache is under its maximum size'),
+        make_option('--prune', action='store_true', dest='prune', default=False,
+                    help='Remove the entries of converter versions that are no longer installed'),
+        make_option('--clear', action='store_true', dest='clear', default=False,
+                    help='Remove all entries'),
+    )
+
+    def handle(self, *args, **options):
+        cache = conversion.get_cache()
+        if options['clear']:
+            cache.clear()
+            self.stdout.write(u'Cleared {}'.format(cache.path))
+        if options['prune']:
+            for identity in cache.prune():
+                self.stdout.write(u'Removed entries of {}'.format(identity))
+        if options['evict']:
+            self.stdout.write(u'Evicted {} entries'.format(cache.evict()))
+
+        stats = cache.stats()
+        self.stdout.write(u'Cache at {}'.format(stats['path']))
+        self.stdout.write(u'{} entries, {} of {}'.format(
+            stats['entries'], human_size(stats['size']), human_size(stats['max_size'])))
+        if stats['entries']:
+            self.stdout.write(u'Least recently used {}, most recently used {}'.format(
+                datetime.fromtimestamp(stats['oldest']), datetime.fromtimestamp(stats['newest'])))
+        for identity, conv in sorted(stats['converters'].items()):
+            self.stdout.write(u'  {:<30} {:>7} entries {:>10}{}'.format(
+                identity, conv['entries'], human_size(conv['size']), u'  (stale)' if conv['stale'] else u''))
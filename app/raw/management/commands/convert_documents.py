@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+"""
+Converts the DOC/DOCX files of all RawCouncilAgenda and RawCouncilHansard objects to HTML ahead of time,
+so that the first view or parse of a document does not have to wait for abiword or pydocx.
+Run it after processing library_hansard and library_agenda scrapes.
+
+$ python manage.py convert_documents --workers 4 --timeout 120
+
+Files that fail to convert are recorded by content hash in a quarantine list in the conversion cache folder.
+They are tried again on the next runs until they have failed --max-failures times, after which they are
+skipped unless --retry-quarantined is given.
+
+The files are given to the pool a few per worker at a time.  A file that kills its worker process
+(abiword can crash on a broken DOC) is quarantined the same way, and the conversions go on in a new pool.
+When several files were in the pool, they are tried again one at a time to find which of them it was.
+"""
+from datetime import datetime
+import json
+from optparse import make_option
+import os
+import tempfile
+import time
+import traceback
+from django.core.management import BaseCommand
+from django.db import connections
+from raw import conversion, utils
+from raw.models import RawCouncilAgenda, RawCouncilHansard
+from raw.pool import run_in_pool
+
+
+CONVERTED = 'converted'
+CACHED = 'cached'
+FAILED = 'failed'
+TIMEOUT = 'timeout'
+CRASHED = 'crashed'
+QUARANTINED = 'quarantined'
+UNSUPPORTED = 'unsupported'
+STATUSES = [CONVERTED, CACHED, FAILED, TIMEOUT, CRASHED, QUARANTINED, UNSUPPORTED]
+
+# Number of files given to the pool at a time, per worker
+WINDOW_PER_WORKER = 2
+
+
+def _convert(uid, path, timeout, quarantined):
+    """
+    Converts one file in a worker process.
+    Returns a tuple of (uid, path, digest, status, seconds, bytes, error)
+    """
+    start = time.time()
+    digest = None
+    size = 0
+    try:
+        size = os.path.getsize(path)
+        filetype = utils.check_file_type(path)
+        if filetype == utils.DOC:
+            converter = conversion.ABIWORD
+        elif filetype == utils.DOCX:
+            converter = conversion.PYDOCX
+        else:
+            return uid, path, None, UNSUPPORTED, 0.0, size, None
+        digest = conversion.file_digest(path)
+        cache = conversion.get_cache()
+        if cache.contains(converter, digest):
+            return uid, path, digest, CACHED, time.time() - start, size, None
+        if digest in quarantined:
+            return uid, path, digest, QUARANTINED, 0.0, size, None
+        res = cache.convert(converter, path, overwrite=True, timeout=timeout, digest=digest)
+    except conversion.ConversionTimeout as e:
+        return uid, path, digest, TIMEOUT, time.time() - start, size, unicode(e)
+    except Exception:
+        return uid, path, digest, FAILED, time.time() - start, size, traceback.format_exc()
+    if res is None:
+        return uid, path, digest, FAILED, time.time() - start, size, u'{} could not convert the file'.format(converter.name)
+    return uid, path, digest, CONVERTED, time.time() - start, size, None
+
+
+class Quarantine(object):
+    """
+    The files that failed to convert, keyed by content hash and stored as JSON
+    """
+    def __init__(self, path, max_failures):
+        self.path = path
+        self.max_failures = max_failures
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                self.entries = json.load(f)
+
+    def quarantined(self):
+        return set(digest for digest, entry in self.entries.items() if entry['failures'] >= self.max_failures)
+
+    def add(self, digest, uid, path, status, error):
+        entry = self.entries.setdefault(digest, {'failures': 0})
+        entry.update({
+            'uid': uid,
+            'path': path,
+            'status': status,
+            'error': error,
+            'last_failure': datetime.now().isoformat(),
+        })
+        entry['failures'] += 1
+
+    def remove(self, digest):
+        """
+        Returns whether the file was in the list
+        """
+        return self.entries.pop(digest, None) is not None
+
+    def save(self):
+        folder = os.path.dirname(os.path.abspath(self.path))
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+        # Write to a temporary file first, so that an interrupted run leaves the previous list
+        fd, tmp_path = tempfile.mkstemp(dir=folder, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            json.dump(self.entries, f, indent=2, sort_keys=True)
+        os.rename(tmp_path, self.path)
+
+
+class Command(BaseCommand):
+    help = 'Converts the DOC/DOCX files of agendas and hansards to HTML in the conversion cache'
+    option_list = BaseCommand.option_list + (
+        make_option('--workers', action='store', type='int', dest='workers', default=4,
+                    help='Number of files to convert at the same time'),
+        make_option('--timeout', action='store', type='int', dest='timeout', default=120,
+                    help='Seconds after which the conversion of a file is abandoned'),
+        make_option('--max-failures', action='store', type='int', dest='max_failures', default=3,
+                    help='Number of failed conversions after which a file is quarantined'),
+        make_option('--retry-quarantined', action='store_true', dest='retry_quarantined', default=False,
+                    help='Also try to convert quarantined files'),
+    )
+
+    def _get_files(self):
+        """
+        Returns a list of (uid, full path) of the documents that may need converting
+        """
+        files = []
+        missing = 0
+        for model in [RawCouncilAgenda, RawCouncilHansard]:
+            rows = model.objects.exclude(local_filename='').values_list('uid', 'local_filename')
+            for uid, local_filename in rows:
+                try:
+                    files.append((uid, utils.get_file_path(local_filename)))
+                except RuntimeError:
+                    missing += 1
+        if missing:
+            self.stdout.write(u'{} documents have no local file'.format(missing))
+        return files
+
+    def _record(self, result):
+        """
+        Counts the outcome of a file and updates the quarantine list
+        """
+        uid, path, digest, status, seconds, size, error = result
+        self.done += 1
+        self.counts[status] += 1
+        if status == CONVERTED:
+            self.converted_bytes += size
+            self.converted_seconds += seconds
+            # Saved as it changes, so that an interrupted run keeps what it learnt
+            if self.quarantine.remove(digest):
+                self.quarantine.save()
+        elif status in (FAILED, TIMEOUT, CRASHED):
+            self.stderr.write(u'{} {} ({}): {}'.format(status.upper(), uid, path, error.strip().splitlines()[-1]))
+            if digest is not None:
+                self.quarantine.add(digest, uid, path, status, error)
+                self.quarantine.save()
+        now = time.time()
+        if now - self.last_report > 10 or self.done == self.total:
+            self.last_report = now
+            rate = self.done / (now - self.start)
+            remaining = (self.total - self.done) / rate if rate else 0
+            self.stdout.write(u'{}/{} documents, {:.1f} per second, about {:.0f}s left'.format(
+                self.done, self.total, rate, remaining))
+
+    def _crashed(self, uid, path):
+        try:
+            digest = conversion.file_digest(path)
+        except (IOError, OSError):
+            digest = None
+        self._record((uid, path, digest, CRASHED, 0.0, 0, u'The worker process died converting the file'))
+
+    def handle(self, *args, **options):
+        cache = conversion.get_cache()
+        self.quarantine = Quarantine(os.path.join(cache.path, 'quarantine.json'), options['max_failures'])
+        self.quarantined = set() if options['retry_quarantined'] else self.quarantine.quarantined()
+
+        files = self._get_files()
+        self.total = len(files)
+        self.stdout.write(u'Checking {} documents with {} workers'.format(self.total, options['workers']))
+        self.counts = dict((status, 0) for status in STATUSES)
+        self.converted_bytes = 0
+        self.converted_seconds = 0.0
+        self.done = 0
+        self.start = time.time()
+        self.last_report = self.start
+
+        # The workers open their own connections
+        for conn in connections.all():
+            conn.close()
+        tasks = [(uid, path, options['timeout'], self.quarantined) for uid, path in files]
+        for task, future in run_in_pool(_convert, tasks, options['workers'], options['workers'] * WINDOW_PER_WORKER):
+            if future is None:
+                self._crashed(*task[:2])
+            else:
+                self._record(future.result())
+
+        elapsed = time.time() - self.start
+        counts = self.counts
+        self.stdout.write(u'Done in {:.1f}s: {}'.format(
+            elapsed, u', '.join(u'{} {}'.format(counts[ss], ss) for ss in STATUSES)))
+        if counts[CONVERTED]:
+            self.stdout.write(u'Converted {:.1f}MB at {:.2f} files/s, {:.2f}MB/s ({:.2f}s per file in the workers)'.format(
+                self.converted_bytes / 1024.0 ** 2,
+                counts[CONVERTED] / elapsed,
+                self.converted_bytes / 1024.0 ** 2 / elapsed,
+                self.converted_seconds / counts[CONVERTED]))
+        if cache.max_size is not None and cache.size() > cache.max_size:
+            self.stdout.write(u'The conversion cache is over its maximum size, consider raising DOC_CONVERSION_CACHE_MAX_SIZE')
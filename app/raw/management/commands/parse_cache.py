@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+"""
+Maintains the cache of parsed documents
+
+$ python manage.py parse_cache --prune
+"""
+from optparse import make_option
+from django.core.management import BaseCommand
+from raw.docs.agenda import CouncilAgenda
+from raw.docs.cache import get_parse_cache, parser_identity
+from raw.docs.hansard import CouncilHansard
+from raw.docs.question import CouncilQuestion
+
+
+PARSERS = [CouncilAgenda, CouncilHansard, CouncilQuestion]
+
+
+class Command(BaseCommand):
+    help = 'Removes results of old parser versions from the cache of parsed documents'
+    option_list = BaseCommand.option_list + (
+        make_option('--prune', action='store_true', dest='prune', default=False,
+                    help='Remove the results of parser versions other than the current ones'),
+        make_option('--clear', action='store_true', dest='clear', default=False,
+                    help='Remove all results'),
+    )
+
+    def handle(self, *args, **options):
+        cache = get_parse_cache()
+        if cache.backend is None:
+            self.stdout.write(u'The parse cache is disabled, see PARSE_CACHE_BACKEND')
+            return
+        self.stdout.write(u'Current parsers: {}'.format(u', '.join(parser_identity(cc) for cc in PARSERS)))
+        if options['clear']:
+            cache.clear()
+            self.stdout.write(u'Cleared the parse cache')
+        if options['prune']:
+            for identity in cache.prune(PARSERS):
+                self.stdout.write(u'Removed results of {}'.format(identity))
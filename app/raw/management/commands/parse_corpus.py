@@ -0,0 +1,368 @@
+# -*- coding: utf-8 -*-
+"""
+Parses every raw document with its parser, across several processes, and writes the outcome for each
+document to a JSON report.  Run it after changing a parser to find the documents it can no longer parse.
+
+$ python manage.py parse_corpus RawCouncilHansard --workers 8 --report hansards.json
+$ python manage.py parse_corpus --uid-prefix council_agenda-2014 --since 2015-01-01
+$ python manage.py parse_corpus RawCouncilHansard --report hansards.json --resume
+
+Each worker loads its own documents, by ranges of primary keys.  The report lists, for each document,
+its status, the time taken, the number of warnings logged while parsing it, and the last one of them
+or the exception, and the time taken by each stage of the parser (see raw.docs.timing).
+It is saved as the work progresses, and --resume skips the documents already in it.
+
+The documents are parsed again rather than taken from the parse cache, which would only replay the
+outcomes of the parser that filled it if its PARSER_VERSION was not bumped.  With --use-cache, the
+cached results are used and the report marks them as cached.
+
+With --profile N, the documents are parsed under cProfile and the statistics of the N slowest
+are written to --profile-dir, to read with pstats.
+
+A range whose worker raises or dies (a segfault in lxml) is reported as an exception for each of its documents,
+and the other ranges go on, see raw.pool.
+"""
+from datetime import datetime
+import json
+import logging
+from optparse import make_option
+import os
+import tempfile
+import time
+import traceback
+from django.core.management import BaseCommand, CommandError
+from django.db import connections
+from raw.docs import timing
+from raw.docs.cache import get_parse_cache
+from raw.models import RawCouncilAgenda, RawCouncilHansard, RawCouncilQuestion
+from raw.pool import run_in_pool
+
+
+OK = 'ok'
+FAILED = 'failed'
+EXCEPTION = 'exception'
+STATUSES = [OK, FAILED, EXCEPTION]
+
+MODELS = dict((model.__name__, model) for model in [RawCouncilAgenda, RawCouncilHansard, RawCouncilQuestion])
+
+# The loggers of the models and of the parsers
+LOGGERS = ['legcowatch', 'legcowatch-docs']
+
+
+class WarningCounter(logging.Handler):
+    """
+    Keeps the warnings and errors logged since the last reset, and the tracebacks of the exceptions
+    logged with them: the get_parser() of the models log the exceptions of the parsers rather than
+    raising them
+    """
+    def __init__(self):
+        logging.Handler.__init__(self, logging.WARNING)
+        self.messages = []
+        self.exceptions = []
+
+    def emit(self, record):
+        try:
+            self.messages.append(_to_unicode(record.getMessage()))
+        except Exception:
+            self.messages.append(_to_unicode(repr(record.msg)))
+        if record.exc_info:
+            self.exceptions.append(_to_unicode(logging.Formatter().formatException(record.exc_info)))
+
+    def reset(self):
+        self.messages = []
+        self.exceptions = []
+
+
+def _to_unicode(text):
+    # Messages about documents in big5 or hkscs can be undecodable byte strings
+    return text.decode('utf-8', 'replace') if isinstance(text, str) else text
+
+
+_counter = None
+_question_index = None
+_profiles = None
+
+
+def _setup_worker():
+    global _counter
+    if _counter is None:
+        # Only the warnings are of interest, and they are counted in the report
+        logging.disable(logging.INFO)
+        _counter = WarningCounter()
+        for name in LOGGERS:
+            logging.getLogger(name).addHandler(_counter)
+    return _counter
+
+
+def _parser_kwargs(model):
+    global _question_index
+    if model is RawCouncilHansard:
+        # Load the questions once per worker, rather than for each hansard
+        if _question_index is None:
+            _question_index = RawCouncilQuestion.objects.index_by_uid()
+        return {'question_index': _question_index}
+    return {}
+
+
+def _stages(records):
+    return [{'stage': xx['stage'], 'seconds': round(xx['seconds'], 3), 'elements': xx['elements'], 'errors': xx['errors']}
+            for record in records for xx in record['stages']]
+
+
+def _parse_range(model_name, first_pk, last_pk, filters, skip, use_cache, profile_count, profile_dir):
+    """
+    Parses the documents of a model with primary keys from first_pk to last_pk in a worker process.
+    Returns a list of outcomes, as dicts
+    """
+    global _profiles
+    counter = _setup_worker()
+    records = timing.RecordList()
+    sinks = [records]
+    if profile_count:
+        if _profiles is None:
+            _profiles = timing.SlowestProfiles(profile_count)
+        sinks.append(_profiles)
+    cache = get_parse_cache()
+    if not use_cache:
+        cache.backend = None
+    model = MODELS[model_name]
+    kwargs = _parser_kwargs(model)
+    res = []
+    rows = model.objects.filter(pk__gte=first_pk, pk__lte=last_pk, **filters).exclude(pk__in=skip).order_by('pk')
+    for obj in rows.iterator():
+        counter.reset()
+        records.records = []
+        hits = cache.hits
+        start = time.time()
+        message = None
+        try:
+            with timing.sinks(*sinks):
+                parser = obj.get_parser(**kwargs)
+        except Exception:
+            status = EXCEPTION
+            message = _to_unicode(traceback.format_exc())
+        else:
+            if parser is not None:
+                status = OK
+            elif counter.exceptions:
+                status = EXCEPTION
+                message = counter.exceptions[-1]
+            else:
+                status = FAILED
+        seconds = time.time() - start
+        if message is None and counter.messages:
+            message = counter.messages[-1]
+        res.append({
+            'model': model_name,
+            'pk': obj.pk,
+            'uid': obj.uid,
+            'status': status,
+            'seconds': round(seconds, 3),
+            'warnings': len(counter.messages),
+            'message': message,
+            'cached': cache.hits > hits,
+            'stages': _stages(records.records),
+        })
+    if _profiles is not None:
+        _profiles.dump(profile_dir)
+    return res
+
+
+class Report(object):
+    """
+    The outcomes of the documents, stored as JSON
+    """
+    def __init__(self, path):
+        self.path = path
+        self.started = datetime.now().isoformat()
+        self.documents = []
+
+    def load(self):
+        if os.path.exists(self.path):
+            with open(self.path, 'rb') as f:
+                data = json.load(f)
+            self.started = data['started']
+            self.documents = data['documents']
+
+    def done(self, model_name):
+        return set(dd['pk'] for dd in self.documents if dd['model'] == model_name)
+
+    def counts(self):
+        res = dict((status, 0) for status in STATUSES)
+        for dd in self.documents:
+            res[dd['status']] += 1
+        return res
+
+    def save(self, finished=False):
+        data = {
+            'started': self.started,
+            'finished': datetime.now().isoformat() if finished else None,
+            'counts': self.counts(),
+            'documents': self.documents,
+        }
+        # Write to a temporary file first, so that an interrupted run leaves the previous report
+        folder = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(dir=folder, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            json.dump(data, f, indent=1, sort_keys=True)
+        os.rename(tmp_path, self.path)
+
+
+def range_outcomes(task, message):
+    """
+    The outcomes of the documents of a range that could not be parsed, with the same message for each
+    """
+    model_name, first_pk, last_pk, filters, skip = task[:5]
+    rows = MODELS[model_name].objects.filter(pk__gte=first_pk, pk__lte=last_pk, **filters).exclude(pk__in=skip)
+    return [{
+        'model': model_name,
+        'pk': pk,
+        'uid': uid,
+        'status': EXCEPTION,
+        'seconds': 0.0,
+        'warnings': 0,
+        'message': message,
+        'cached': False,
+        'stages': [],
+    } for pk, uid in rows.order_by('pk').values_list('pk', 'uid')]
+
+
+def pk_ranges(pks, size):
+    """
+    Splits a sorted list of primary keys into (first, last) ranges of up to size keys
+    """
+    return [(pks[ii], pks[min(ii + size, len(pks)) - 1]) for ii in range(0, len(pks), size)]
+
+
+def plan_ranges(report, model_names, filters, chunk_size):
+    """
+    The ranges of primary keys left to parse, leaving out the documents already in the report.
+    Returns a list of (model name, first pk, last pk, pks to skip in the range) and the number of documents
+    """
+    ranges = []
+    total = 0
+    for name in model_names:
+        done = report.done(name)
+        pks = sorted(MODELS[name].objects.filter(**filters).values_list('pk', flat=True))
+        pks = [pk for pk in pks if pk not in done]
+        total += len(pks)
+        for first_pk, last_pk in pk_ranges(pks, chunk_size):
+            skip = sorted(pk for pk in done if first_pk <= pk <= last_pk)
+            ranges.append((name, first_pk, last_pk, skip))
+    return ranges, total
+
+
+class Command(BaseCommand):
+    args = '[model ...]'
+    help = 'Parses the raw documents with several processes and reports the outcomes: {}'.format(', '.join(sorted(MODELS)))
+    option_list = BaseCommand.option_list + (
+        make_option('--workers', action='store', type='int', dest='workers', default=4,
+                    help='Number of processes parsing documents'),
+        make_option('--chunk-size', action='store', type='int', dest='chunk_size', default=20,
+                    help='Number of documents given to a process at a time'),
+        make_option('--report', action='store', type='string', dest='report', default='parse_corpus.json',
+                    help='Path of the JSON report'),
+        make_option('--since', action='store', type='string', dest='since', default=None,
+                    help='Only parse the documents crawled on or after this date, as YYYY-MM-DD'),
+        make_option('--uid-prefix', action='store', type='string', dest='uid_prefix', default=None,
+                    help='Only parse the documents with uids starting with this'),
+        make_option('--resume', action='store_true', dest='resume', default=False,
+                    help='Add to an existing report, skipping the documents already in it'),
+        make_option('--use-cache', action='store_true', dest='use_cache', default=False,
+                    help='Take the results in the parse cache rather than parsing the documents again'),
+        make_option('--profile', action='store', type='int', dest='profile', default=0,
+                    help='Keep the cProfile statistics of this number of the slowest documents'),
+        make_option('--profile-dir', action='store', type='string', dest='profile_dir', default='parse_corpus_profiles',
+                    help='Folder of the cProfile statistics'),
+    )
+
+    def _filters(self, options):
+        filters = {}
+        if options['since']:
+            try:
+                filters['last_crawled__gte'] = datetime.strptime(options['since'], '%Y-%m-%d')
+            except ValueError:
+                raise CommandError(u'Invalid --since {}, use YYYY-MM-DD'.format(options['since']))
+        if options['uid_prefix']:
+            filters['uid__startswith'] = options['uid_prefix']
+        return filters
+
+    def _prune_profiles(self, folder, count):
+        """
+        Each worker writes the statistics of its slowest documents, only keep the slowest overall
+        """
+        if not os.path.isdir(folder):
+            return
+        # The file names start with the zero padded number of seconds
+        names = sorted([xx for xx in os.listdir(folder) if xx.endswith('.prof')], reverse=True)
+        for name in names[count:]:
+            os.remove(os.path.join(folder, name))
+        self.stdout.write(u'cProfile statistics of the slowest documents in {}'.format(folder))
+
+    def handle(self, *args, **options):
+        for name in args:
+            if name not in MODELS:
+                raise CommandError(u'Unknown model {}, choose from {}'.format(name, u', '.join(sorted(MODELS))))
+        model_names = args or sorted(MODELS)
+        filters = self._filters(options)
+        report = Report(options['report'])
+        if options['resume']:
+            report.load()
+            self.stdout.write(u'Resuming with {} documents already in {}'.format(len(report.documents), report.path))
+
+        # Each task is a range of primary keys of a model, with the documents to skip in that range
+        ranges, total = plan_ranges(report, model_names, filters, options['chunk_size'])
+        tasks = [(name, first_pk, last_pk, filters, skip, options['use_cache'], options['profile'], options['profile_dir'])
+                 for name, first_pk, last_pk, skip in ranges]
+        self.stdout.write(u'Parsing {} documents with {} workers'.format(total, options['workers']))
+        if options['use_cache']:
+            self.stdout.write(u'Taking the results in the parse cache, they are out of date if a parser changed '
+                              u'without a bump of its PARSER_VERSION')
+
+        if options['profile'] and not os.path.isdir(options['profile_dir']):
+            os.makedirs(options['profile_dir'])
+
+        done = 0
+        start = time.time()
+        last_report = start
+        # The workers open their own connections
+        for conn in connections.all():
+            conn.close()
+        try:
+            for task, future in run_in_pool(_parse_range, tasks, options['workers']):
+                if future is not None and future.exception() is None:
+                    outcomes = future.result()
+                else:
+                    if future is None:
+                        message = u'The worker process died parsing the documents of this range'
+                    else:
+                        error = future.exception()
+                        message = _to_unicode(''.join(traceback.format_exception_only(type(error), error)))
+                    outcomes = range_outcomes(task, message)
+                    # The workers of a new pool must not share the connection of this process
+                    for conn in connections.all():
+                        conn.close()
+                done += len(outcomes)
+                report.documents.extend(outcomes)
+                for outcome in outcomes:
+                    if outcome['status'] != OK:
+                        message = (outcome['message'] or u'').strip().splitlines()
+                        self.stderr.write(u'{} {}: {}'.format(
+                            outcome['status'].upper(), outcome['uid'], message[-1] if message else u''))
+                now = time.time()
+                if now - last_report > 10 or done == total:
+                    last_report = now
+                    report.save()
+                    rate = done / (now - start)
+                    remaining = (total - done) / rate if rate else 0
+                    self.stdout.write(u'{}/{} documents, {:.1f} per second, about {:.0f}s left'.format(
+                        done, total, rate, remaining))
+        finally:
+            report.save(finished=done == total)
+
+        if options['profile']:
+            self._prune_profiles(options['profile_dir'], options['profile'])
+
+        counts = report.counts()
+        self.stdout.write(u'Done in {:.1f}s: {}. Report in {}'.format(
+            time.time() - start, u', '.join(u'{} {}'.format(counts[ss], ss) for ss in STATUSES), report.path))
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+"""
+Loads the latest scrapes of all spiders, or of the spiders given as arguments, into the Raw models
+
+$ python manage.py process_scrapes --workers 4
+$ python manage.py process_scrapes schedule_member schedule_committee schedule_membership
+"""
+from optparse import make_option
+from django.core.management import BaseCommand, CommandError
+from raw.processors.runner import ProcessRunner
+
+
+class Command(BaseCommand):
+    args = '[spider_name ...]'
+    help = 'Runs the processors for the latest scrapes, in parallel where their dependencies allow'
+    option_list = BaseCommand.option_list + (
+        make_option('--workers', action='store', type='int', dest='workers', default=4,
+                    help='Number of processes to run processors in'),
+    )
+
+    def handle(self, *args, **options):
+        try:
+            runner = ProcessRunner(spiders=args or None, workers=options['workers'])
+        except RuntimeError as e:
+            raise CommandError(str(e))
+        report = runner.run()
+        self.stdout.write(report.summary())
+        if report.errors or report.skipped:
+            raise CommandError('{} processors failed, {} skipped'.format(len(report.errors), len(report.skipped)))
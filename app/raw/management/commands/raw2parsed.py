@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 
+from optparse import make_option
 from django.core.management import BaseCommand
 import raw.models
 from raw.models import ParsedCommittee, ParsedCommitteeMembership, ParsedCouncilMeeting, ParsedMembership, ParsedPerson, ParsedPerson, ParsedQuestion
@@ -9,11 +10,30 @@ logging.disable(logging.CRITICAL)
 
 class Command(BaseCommand):
     help = 'Create parsed models from their raw correspondences'
-    
+    option_list = BaseCommand.option_list + (
+        make_option('--chunk-size', action='store', type='int', dest='chunk_size', default=None,
+                    help='Number of raw objects read and written in one transaction'),
+        make_option('--questions', action='store_true', dest='questions', default=False,
+                    help='Also create the parsed questions, parsing the question of each of them'),
+        make_option('--workers', action='store', type='int', dest='workers', default=1,
+                    help='Number of processes parsing the questions'),
+        make_option('--full', action='store_true', dest='full', default=False,
+                    help='Populate from all of the raw objects, not only those changed since the last run'),
+    )
+
+    def _report(self, model, counts):
+        report = u'{}: {created} created, {updated} updated, {skipped} skipped, {failed} failed'.format(
+            model.__name__, **counts)
+        if 'deactivated' in counts:
+            report += u', {} deactivated'.format(counts['deactivated'])
+        self.stdout.write(report)
+
     def handle(self, *args, **options):
-        raw.models.ParsedCommittee.objects.populate()
-        raw.models.ParsedPerson.objects.populate()
-        raw.models.ParsedMembership.objects.populate()
-        raw.models.ParsedCommitteeMembership.objects.populate()
-        raw.models.ParsedCouncilMeeting.objects.populate()
-        #raw.models.ParsedQuestion.objects.populate()
\ No newline at end of file
+        chunk_size = options['chunk_size']
+        full = options['full']
+        for model in [raw.models.ParsedCommittee, raw.models.ParsedPerson, raw.models.ParsedMembership,
+                      raw.models.ParsedCommitteeMembership, raw.models.ParsedCouncilMeeting]:
+            self._report(model, model.objects.sync(full, chunk_size=chunk_size))
+        if options['questions']:
+            self._report(raw.models.ParsedQuestion, raw.models.ParsedQuestion.objects.sync(
+                full, workers=options['workers'], chunk_size=chunk_size))
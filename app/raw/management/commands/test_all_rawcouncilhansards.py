@@ -9,7 +9,7 @@ to write result to to testhansard.txt
 """
     
 from django.core.management import BaseCommand
-from raw.models.raw import RawCouncilHansard
+from raw.models.raw import RawCouncilHansard, RawCouncilQuestion
 import logging
 from raw.models.constants import LANG_EN
 
@@ -32,8 +32,11 @@ class Command(BaseCommand):
         list_mismatch_oral = []
         list_mismatch_written = []
         han_list = RawCouncilHansard.objects.filter(language__exact=LANG_EN)
-        print(u"Total number of hansards: {}\n".format(len(han_list)))
-        for han_en in han_list:
+        # Load the questions once, rather than for each hansard
+        question_index = RawCouncilQuestion.objects.index_by_uid()
+        print(u"Total number of hansards: {}\n".format(han_list.count()))
+        # Only keep one hansard at a time in memory
+        for han_en in han_list.iterator():
             han_cn = han_en.get_lang_counterpart()
             if han_cn is None:
                 # nothing to compare with
@@ -48,12 +51,12 @@ class Command(BaseCommand):
             else:
                 # Sometimes source cannot be loaded (usually images)
                 try:
-                    parser_en = han_en.get_parser()
+                    parser_en = han_en.get_parser(question_index)
                 except:
                     list_exception.append(han_en.title)
                     continue 
                 try:
-                    parser_cn = han_cn.get_parser()
+                    parser_cn = han_cn.get_parser(question_index)
                 except:
                     list_exception.append(han_cn.title)
                     continue
@@ -67,6 +70,9 @@ class Command(BaseCommand):
                         list_no_parser.append(han_cn.uid)
                     continue
                 else:
+                    # Only the results are needed, not the trees
+                    parser_en.detach()
+                    parser_cn.detach()
                     ### 2. Test if parsers return same number of tabled papers in both languages ###
                     if parser_en.tabled_legislation is not None:
                         # sometimes the section is not available
@@ -1,22 +1,30 @@
-from collections import OrderedDict
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
 from copy import copy
 from datetime import datetime, date, time
+from itertools import izip
 import json
 import logging
 from django.conf import settings
-from django.db import models, IntegrityError
+from django.core.exceptions import ObjectDoesNotExist
+from django.db import connections, models, transaction, IntegrityError
 from django.db.backends import BaseDatabaseWrapper
 from django.db.backends.util import CursorWrapper
 from django.db.models import get_model, Q
+from django.db.models.signals import post_save, post_delete
 from django.utils.encoding import force_unicode
 from django.utils.text import slugify
+from django.utils import timezone
 import re
 from constants import GENDER_CHOICES, LANG_EN
+from ..bulk import NONE_FOR_DUPLICATES, bulk_update, chunked, concrete_fields, index_by_uid, snapshot
+from ..intervals import IntervalIndex, intervals
 from .raw import RawMember, RawCommittee, RawCommitteeMembership, RawCouncilAgenda, RawCouncilQuestion
-from ..names import MemberName, NameMatcher
+from ..names import MemberName, NameMatcher, matchers
 from ..docs.agenda import logger as agenda_logger
 from ..docs.question import logger as question_logger
 from ..docs.question import CouncilQuestion
+from ..docs.records import plain
 
 logger = logging.getLogger('legcowatch')
 
@@ -27,17 +35,34 @@ class TimestampMixin(object):
 
 
 class BaseParsedManager(models.Manager):
-    def create_from_raw(self, raw_obj):
+    # Number of raw objects read, looked up and written in one transaction by populate()
+    chunk_size = 500
+
+    def get_parsed_uid(self, raw_obj):
+        # The uid of the parsed object made from a raw one
+        return raw_obj.uid
+
+    def get_or_new(self, uid, existing=None):
+        """
+        The parsed object with uid, or a new unsaved one.  existing is a dict of the objects already
+        loaded by uid, in which case the database is not queried
+        """
+        if existing is not None:
+            obj = existing.get(uid)
+            return obj if obj is not None else self.model()
+        try:
+            return self.get(uid=uid)
+        except self.model.DoesNotExist:
+            return self.model()
+
+    def create_from_raw(self, raw_obj, existing=None):
         # Create a parsed model from its corresponding raw one, but not saving
         if getattr(self, 'excluded', None) is not None:
             excluded = copy(self.excluded)
         else:
             excluded = []
         # copy fields directly without any processing
-        try:
-            obj = self.get(uid=raw_obj.uid)
-        except self.model.DoesNotExist:
-            obj = self.model()
+        obj = self.get_or_new(self.get_parsed_uid(raw_obj), existing)
         for field in [xx.name for xx in obj._meta.fields]:
             if field not in excluded:
                 setattr(obj, field, getattr(raw_obj, field, None))
@@ -53,22 +78,229 @@ class BaseParsedManager(models.Manager):
         if settings.DEBUG and getattr(self, 'original') is not None:
             BaseDatabaseWrapper.make_debug_cursor = self.original
 
-    def populate(self):
+    def raw_queryset(self):
+        """
+        The raw objects to populate from, subclasses can add the related objects that create_from_raw uses
+        """
+        return self.model.RAW_MODEL.objects.all()
+
+    def changed_since(self, since):
+        # The filter of the raw objects crawled or parsed after since
+        return Q(last_parsed__gt=since) | Q(last_crawled__gt=since)
+
+    def iter_raw(self, chunk_size, since=None, retry=()):
+        """
+        Yields lists of up to chunk_size raw objects, each fetched with its own query by range of primary keys,
+        so that the raw table is never loaded whole.  With since, only the raw objects changed after it,
+        and those with their uid in retry
+        """
+        queryset = self.raw_queryset().order_by('pk')
+        if since is not None:
+            queryset = queryset.filter(self.changed_since(since))
+        last_pk = None
+        while True:
+            chunk = queryset if last_pk is None else queryset.filter(pk__gt=last_pk)
+            chunk = list(chunk[:chunk_size])
+            if not chunk:
+                break
+            yield chunk
+            last_pk = chunk[-1].pk
+        if since is None:
+            return
+        # The unchanged objects to retry, the changed ones have been read above
+        unchanged = self.raw_queryset().order_by('pk').exclude(self.changed_since(since))
+        for batch in chunked(sorted(retry), min(chunk_size, 500)):
+            chunk = list(unchanged.filter(uid__in=batch))
+            if chunk:
+                yield chunk
+
+    def populate(self, chunk_size=None, since=None, retry=(), pending=None):
+        """
+        Creates or updates the parsed objects from all of the raw objects, or those changed after since
+        and those with their uid in retry, a chunk at a time: the existing parsed objects of a chunk are
+        loaded in one query, then the new ones are created and the changed ones updated in bulk, in one
+        transaction.  The uids of the raw objects that failed because an object they refer to does not
+        exist yet are added to the set pending.
+        Returns a dict of the numbers of objects created, updated, skipped because they have not changed or
+        their uid is not unique, and failed
+        """
         self._deactivate_db_debug()
-        raw_items = self.model.RAW_MODEL.objects.all()
-        count = 0
+        counts = {'created': 0, 'updated': 0, 'skipped': 0, 'failed': 0}
+        if pending is None:
+            pending = set()
+        # create_from_raw activates the objects, but the ones deactivated by an override stay so
+        deactivated = self.deactivated_uids()
+        try:
+            for raw_items in self.iter_raw(chunk_size or self.chunk_size, since, retry):
+                self._populate_chunk(raw_items, counts, deactivated, pending)
+        finally:
+            self._reactivate_db_debug()
+        logger.info(u'Populated {}: {created} created, {updated} updated, {skipped} skipped, {failed} failed'.format(
+            self.model.__name__, **counts))
+        return counts
+
+    def _populate_chunk(self, raw_items, counts, deactivated, pending):
+        # A uid that matches more than one object maps to None
+        existing = index_by_uid(self.all(), [self.get_parsed_uid(xx) for xx in raw_items], NONE_FOR_DUPLICATES)
+        fields = concrete_fields(self.model)
+        # Several raw objects can make the same parsed object, like the agendas of a meeting in both languages,
+        # so the objects made in the chunk are looked up with the existing ones
+        known = dict((uid, obj) for uid, obj in existing.items() if obj is not None)
+        objs = OrderedDict()
+        snapshots = {}
         for item in raw_items:
-            # Get or create, but without commit
-            obj = self.create_from_raw(item)
+            uid = self.get_parsed_uid(item)
+            if uid in existing and existing[uid] is None:
+                logger.warn(u'Found more than one {} with uid {}'.format(self.model.__name__, uid))
+                counts['skipped'] += 1
+                continue
+            if uid in existing and uid not in snapshots:
+                snapshots[uid] = (known[uid].pk, snapshot(known[uid], fields))
             try:
-                obj.save()
-                count += 1
+                obj = self.create_from_raw(item, known)
+            except ObjectDoesNotExist as e:
+                logger.warn(u'Could not create from {}: {}'.format(item, e))
+                counts['failed'] += 1
+                pending.add(item.uid)
+                continue
+            known[uid] = objs[uid] = obj
+        self._save_objects(objs, snapshots, counts, deactivated)
+
+    def _save_objects(self, objs, snapshots, counts, deactivated=frozenset()):
+        """
+        Writes the objects of a chunk, a dict of uid to object, in one transaction: the objects without
+        a snapshot (pk, values) are created, the others are updated if their values have changed.
+        The objects with their uid in deactivated are written deactivated
+        """
+        fields = concrete_fields(self.model)
+        with transaction.atomic():
+            new_objs = []
+            changed = []
+            for uid, obj in objs.items():
+                obj.deactivate = uid in deactivated
+                if uid not in snapshots:
+                    new_objs.append(obj)
+                    continue
+                pk, values = snapshots[uid]
+                # create_from_raw copies the id of the raw object, but the loaded row is the one to update
+                obj.pk = pk
+                if snapshot(obj, fields) != values:
+                    changed.append(obj)
+                else:
+                    counts['skipped'] += 1
+            self._create_objects(new_objs, counts)
+            if changed:
+                bulk_update(changed, fields)
+                counts['updated'] += len(changed)
+
+    def _create_objects(self, objs, counts):
+        if not objs:
+            return
+        try:
+            with transaction.atomic():
+                self.bulk_create(objs)
+            counts['created'] += len(objs)
+            return
+        except IntegrityError:
+            pass
+        # Find the objects that cannot be created by saving them one by one
+        for obj in objs:
+            try:
+                with transaction.atomic():
+                    obj.save()
+                counts['created'] += 1
             except IntegrityError as e:
-                logger.warning(u'Could not create from {}'.format(item))
+                logger.warning(u'Could not create {} {}'.format(self.model.__name__, obj.uid))
                 logger.warning(e)
-        logger.info('Populated {} objects'.format(count))
-        self._reactivate_db_debug()
-        
+                counts['failed'] += 1
+
+    def deactivated_uids(self):
+        # The uids of the objects that their override deactivates
+        overrides = Override.objects.get_for_class(self.model._meta.model_name)
+        return set(xx.ref_uid for xx in overrides if xx.is_deactivated())
+
+    def raw_uids(self):
+        """
+        The uids of the parsed objects that the raw objects make, to tell the ones whose raw object has been
+        deleted, or None if they cannot be known without making the objects
+        """
+        return set(self.get_parsed_uid(xx) for xx in self.model.RAW_MODEL.objects.only('uid').iterator())
+
+    def override_removed(self):
+        """
+        Deactivates with an override the objects whose raw object has been deleted, and lifts that override
+        from the objects whose raw object is back.  Returns the number of overrides written
+        """
+        current = self.raw_uids()
+        if current is None:
+            return 0
+        written = 0
+        gone = set(self.filter(deactivate=False).values_list('uid', flat=True)) - current
+        for uid in gone:
+            override = Override.objects.get_or_create_from_reference(self.model(uid=uid))
+            override.merge_payload({'deactivate': True, 'removed': True})
+            written += self._save_override(override)
+        for override in Override.objects.get_for_class(self.model._meta.model_name).filter(data__contains='removed'):
+            if override.ref_uid in current and override.get_payload().get('removed', False):
+                override.merge_payload({'deactivate': False, 'removed': False})
+                written += self._save_override(override)
+        return written
+
+    def _save_override(self, override):
+        try:
+            with transaction.atomic():
+                override.save()
+            return 1
+        except IntegrityError:
+            # ref_uid is unique across the models
+            logger.warn(u'Could not override {} {}, its uid is overridden on another model'.format(
+                self.model.__name__, override.ref_uid))
+            return 0
+
+    def apply_overrides(self, since=None):
+        """
+        Sets the deactivate flag of the objects to that of their override, for the overrides changed after
+        since or all of them.  Returns the number of objects deactivated
+        """
+        overrides = Override.objects.get_for_class(self.model._meta.model_name)
+        if since is not None:
+            overrides = overrides.filter(modified__gt=since)
+        deactivated = []
+        reactivated = []
+        for override in overrides:
+            if override.is_deactivated():
+                deactivated.append(override.ref_uid)
+            else:
+                reactivated.append(override.ref_uid)
+        count = 0
+        for batch in chunked(deactivated, 500):
+            count += self.filter(uid__in=batch, deactivate=False).update(deactivate=True)
+        for batch in chunked(reactivated, 500):
+            self.filter(uid__in=batch, deactivate=True).update(deactivate=False)
+        return count
+
+    def sync(self, full=False, **kwargs):
+        """
+        Populates from the raw objects crawled or parsed since the last sync, or from all of them if full
+        or on the first sync, then deactivates the objects whose raw object has been deleted and applies
+        the overrides changed since.  The raw objects that failed for want of an object they refer to are
+        read again by the next syncs, until they succeed.  The other keyword arguments are passed to populate().
+        Returns the counts of populate(), with the number of objects deactivated
+        """
+        mark, created = SyncMark.objects.get_or_create(model=self.model._meta.model_name)
+        # Taken before reading, so that the raw objects changed during the sync are read again by the next one
+        started = timezone.now()
+        since = None if full else mark.mark
+        pending = set()
+        counts = self.populate(since=since, retry=mark.get_pending(), pending=pending, **kwargs)
+        self.override_removed()
+        counts['deactivated'] = self.apply_overrides(since)
+        mark.mark = started
+        mark.set_pending(pending)
+        mark.save()
+        logger.info(u'Synced {} since {}'.format(self.model.__name__, since))
+        return counts
+
 
 class BaseParsedModel(models.Model):
     # We don't constrain UIDs to be unique, because we may have duplicates in the raw data that we want
@@ -178,15 +410,39 @@ class Override(models.Model):
         payload = self.get_payload()
         return payload.get('deactivate', False)
 
+
+class SyncMark(models.Model):
+    """
+    The high-water mark of the syncs of a parsed model: the raw objects changed after it have not been
+    populated yet
+    """
+    # model._meta.model_name of the parsed model
+    model = models.CharField(max_length=100, unique=True)
+    mark = models.DateTimeField(null=True, blank=True)
+    # The uids of the raw objects to read again by the next sync, as a json list
+    pending = models.TextField(blank=True, default='')
+    modified = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        app_label = 'raw'
+
+    def __unicode__(self):
+        return u'{} {}'.format(self.model, self.mark)
+
+    def get_pending(self):
+        if self.pending == u'':
+            return []
+        return json.loads(self.pending)
+
+    def set_pending(self, uids):
+        self.pending = json.dumps(sorted(uids)) if uids else u''
+
 """
 Person
 """
-class PersonManager(models.Manager):
-    def create_from_raw(self, raw_obj):
-        try:
-            obj = self.get(uid=raw_obj.uid)
-        except self.model.DoesNotExist:
-            obj = self.model()
+class PersonManager(BaseParsedManager):
+    def create_from_raw(self, raw_obj, existing=None):
+        obj = self.get_or_new(raw_obj.uid, existing)
         # Copy items over, but a few fields require special handling
         excluded = ['education_e', 'education_c', 'occupation_e', 'occupation_c']
         for field in [xx.name for xx in obj._meta.fields]:
@@ -202,6 +458,12 @@ class PersonManager(models.Manager):
         obj.deactivate = False
         return obj
 
+    def populate(self, *args, **kwargs):
+        counts = super(PersonManager, self).populate(*args, **kwargs)
+        # The bulk writes send no signals, so drop the name matchers of the persons here
+        matchers.invalidate()
+        return counts
+
 
 class ParsedPerson(TimestampMixin, BaseParsedModel):
     name_e = models.CharField(max_length=100)
@@ -240,13 +502,61 @@ class ParsedPerson(TimestampMixin, BaseParsedModel):
 
     @classmethod
     def get_matcher(cls, english=True):
+        """
+        The NameMatcher of all of the persons, shared by the whole process, see raw.names.MatcherRegistry
+        """
+        return matchers.get(cls, english)
+
+    @classmethod
+    def build_matcher(cls, english=True):
         all_members = cls.objects.all()
         names = [(xx.get_name_object(english), xx) for xx in all_members]
         matcher = NameMatcher(names)
         return matcher
 
 
-class MembershipManager(models.Manager):
+class DateRangeManager(BaseParsedManager):
+    """
+    Manager of the parsed models with a start_date and an end_date, which answers the queries of many
+    dates from an IntervalIndex of all of the objects, kept by raw.intervals.intervals
+    """
+    def to_field_date(self, value):
+        # The date or datetime value as it is compared with start_date in the database
+        value = self.model._meta.get_field('start_date').to_python(value)
+        if isinstance(value, datetime) and settings.USE_TZ and timezone.is_naive(value):
+            value = timezone.make_aware(value, timezone.get_default_timezone())
+        return value
+
+    def build_interval_index(self):
+        return IntervalIndex((xx.start_date, xx.end_date, xx) for xx in self.select_related())
+
+    def get_interval_index(self):
+        return intervals.get(self.model)
+
+    def active_on_dates(self, dates):
+        """
+        Returns a dict of each of dates to the list of the objects active on it: those started before the date
+        and ending after it, or without an end date like get_current(), unlike get_active_on_date()
+        """
+        points = dict((xx, self.to_field_date(xx)) for xx in dates)
+        active = self.get_interval_index().stab(points.values())
+        return dict((xx, active[point]) for xx, point in points.items())
+
+    def active_in_range(self, start_date, end_date):
+        # The objects active on any date between start_date and end_date
+        return self.get_interval_index().overlapping(self.to_field_date(start_date), self.to_field_date(end_date))
+
+    def populate(self, *args, **kwargs):
+        counts = super(DateRangeManager, self).populate(*args, **kwargs)
+        # The bulk writes send no signals, so drop the interval indexes here
+        intervals.invalidate()
+        return counts
+
+
+class MembershipManager(DateRangeManager):
+    # The fields of ParsedMembership copied from the MembershipParser of each service
+    parsed_fields = ['start_date', 'end_date', 'method_obtained', 'position', 'note']
+
     def get_active_on_date(self, query_date):
         # Return True if a membership is active on a given query_date.
         return self.filter(start_date__lt=query_date, end_date__gt=query_date)
@@ -256,37 +566,99 @@ class MembershipManager(models.Manager):
         today = date.today()
         return self.filter(Q(start_date__lt=today), Q(end_date__gt=today) | Q(end_date=None))
 
-    def create_from_raw(self, person):
-        # Create all the memberships from a RawMember.  So could result in multiple new objects
-        service_objects = json.loads(person.service_e)
-        for service in service_objects:
+    def raw_queryset(self):
+        # Only the services are parsed, the rest of the member is left to ParsedPerson
+        return super(MembershipManager, self).raw_queryset().only('uid', 'service_e')
+
+    def parse_services(self, person):
+        """
+        Returns a list of (uid, MembershipParser) for the services of a RawMember, leaving out those without
+        a start date, which the uid is made from
+        """
+        if not person.service_e:
+            return []
+        services = []
+        for service in json.loads(person.service_e):
             parsed = MembershipParser(service)
-            uid = ParsedMembership.make_uid(person, parsed)
-            # Get or create
-            try:
-                obj = self.get(uid=uid)
-            except self.model.DoesNotExist:
-                obj = self.model()
-
-            # Copy data over
-            fields_to_copy = ['start_date', 'end_date', 'method_obtained', 'position', 'note']
-            for field in fields_to_copy:
-                # don't fill in nulls so defaults work
-                val = getattr(parsed, field, None)
-                if val is not None:
-                    setattr(obj, field, val)
+            if parsed.start_date is None:
+                logger.warn(u'Cannot parse the dates of the service {} of {}'.format(service, person.uid))
+                continue
+            services.append((ParsedMembership.make_uid(person, parsed), parsed))
+        return services
+
+    def create_from_raw(self, person, person_id=None, existing=None):
+        """
+        Create all the memberships from a RawMember.  So could result in multiple new objects.
+        person_id is the id of its ParsedPerson and existing a dict of the loaded memberships by uid,
+        otherwise each of them is queried
+        """
+        if person_id is None:
+            person_id = ParsedPerson.objects.get(uid=person.uid).pk
+        for uid, parsed in self.parse_services(person):
+            obj = self.get_or_new(uid, existing)
+            self._copy_service(obj, parsed)
             obj.deactivate = False
-            # Need a ParsedPerson
-            parsed_person = ParsedPerson.objects.get(uid=person.uid)
-            obj.person = parsed_person
+            obj.person_id = person_id
             obj.uid = uid
             yield obj
 
-    def populate(self):
-        raw_items = RawMember.objects.all()
+    def _copy_service(self, obj, parsed):
+        for field in self.parsed_fields:
+            # don't fill in nulls so defaults work
+            val = getattr(parsed, field, None)
+            if val is not None:
+                setattr(obj, field, val)
+
+    def _populate_chunk(self, raw_items, counts, deactivated, pending):
+        """
+        Expands the services of a chunk of RawMembers: their ParsedPersons and the existing memberships
+        are each loaded in one query, then the memberships are written in bulk
+        """
+        person_ids = {}
+        for batch in chunked([xx.uid for xx in raw_items], 500):
+            person_ids.update(ParsedPerson.objects.filter(uid__in=batch).values_list('uid', 'pk'))
+        services = []
         for item in raw_items:
-            for membership in self.create_from_raw(item):
-                membership.save()
+            try:
+                item_services = self.parse_services(item)
+            except ValueError as e:
+                logger.warn(u'Could not parse the services of {}: {}'.format(item.uid, e))
+                counts['failed'] += 1
+                continue
+            if item_services and item.uid not in person_ids:
+                logger.warn(u'Could not create the memberships of {}: no ParsedPerson'.format(item.uid))
+                counts['failed'] += 1
+                pending.add(item.uid)
+                continue
+            services.extend((uid, parsed, person_ids.get(item.uid)) for uid, parsed in item_services)
+        existing = index_by_uid(self.all(), [uid for uid, parsed, person_id in services], NONE_FOR_DUPLICATES)
+        fields = concrete_fields(self.model)
+        objs = OrderedDict()
+        snapshots = {}
+        for uid, parsed, person_id in services:
+            if uid in existing and existing[uid] is None:
+                logger.warn(u'Found more than one membership with uid {}'.format(uid))
+                counts['skipped'] += 1
+                continue
+            obj = existing.get(uid)
+            if obj is None:
+                obj = objs.get(uid) or self.model(uid=uid)
+            elif uid not in snapshots:
+                snapshots[uid] = (obj.pk, snapshot(obj, fields))
+            self._copy_service(obj, parsed)
+            obj.person_id = person_id
+            objs[uid] = obj
+        self._save_objects(objs, snapshots, counts, deactivated)
+
+    def raw_uids(self):
+        uids = set()
+        for person in RawMember.objects.only('uid', 'service_e').iterator():
+            try:
+                uids.update(uid for uid, parsed in self.parse_services(person))
+            except ValueError:
+                # Unknown services cannot be told from deleted ones
+                return None
+        return uids
 
 
 class ParsedMembership(TimestampMixin, BaseParsedModel):
@@ -333,6 +705,14 @@ class MembershipParser(object):
     DATE_RE = r'(?P<start>\d+ \w+ \d+) - (?P<end>\d+ \w+ \d+)?'
     DETAIL_RE = r'^(?P<method>\w+) \((?P<position>.+)\)$$'
     DATE_FORMAT = '%d %B %Y'
+    DATE_PATTERN = re.compile(DATE_RE)
+    DETAIL_PATTERN = re.compile(DETAIL_RE)
+    # The month names of DATE_FORMAT, so that the dates are parsed without strptime
+    MONTHS = dict((name, i + 1) for i, name in enumerate([
+        'january', 'february', 'march', 'april', 'may', 'june', 'july', 'august', 'september', 'october',
+        'november', 'december']))
+    # The dates parsed so far, the services of the members share a few term dates
+    _dates = {}
 
     def __init__(self, membership_obj, lang='E'):
         self._raw = membership_obj
@@ -351,14 +731,24 @@ class MembershipParser(object):
     def parse_date(self, date_str):
         if date_str is None:
             return None
+        if date_str not in self._dates:
+            self._dates[date_str] = self._parse_date(date_str)
+        return self._dates[date_str]
+
+    def _parse_date(self, date_str):
+        # Same as datetime.strptime(date_str, DATE_FORMAT), for the dates matched by DATE_RE
+        day, month, year = date_str.split(' ')
+        month = self.MONTHS.get(month.lower())
+        if month is None:
+            return None
         try:
-            return datetime.strptime(date_str, self.DATE_FORMAT).date()
+            return date(int(year), month, int(day))
         except ValueError:
             return None
 
     def parse_dates(self, date_string):
         # First element of the json object is the string
-        matched_dates = re.match(self.DATE_RE, date_string)
+        matched_dates = self.DATE_PATTERN.match(date_string)
         if matched_dates is None:
             return None, None
 
@@ -366,7 +756,7 @@ class MembershipParser(object):
         return self.parse_date(matches[0]), self.parse_date(matches[1])
 
     def parse_position_method(self, position_string):
-        matched = re.match(self.DETAIL_RE, position_string)
+        matched = self.DETAIL_PATTERN.match(position_string)
         if matched is None:
             return None, None
 
@@ -396,7 +786,7 @@ class ParsedCommittee(TimestampMixin, BaseParsedModel):
         return u'{}: {} {}'.format(self.code, self.name_e, self.name_c)
 
 
-class CommitteeMembershipManager(BaseParsedManager):
+class CommitteeMembershipManager(DateRangeManager):
     excluded = ['person', 'committee']
 
     def get_active_on_date(self, query_date):
@@ -407,8 +797,11 @@ class CommitteeMembershipManager(BaseParsedManager):
         today = date.today()
         return self.filter(Q(start_date__lt=today), Q(end_date__gt=today) | Q(end_date=None))
 
-    def create_from_raw(self, raw_obj):
-        obj = super(CommitteeMembershipManager, self).create_from_raw(raw_obj)
+    def raw_queryset(self):
+        return super(CommitteeMembershipManager, self).raw_queryset().select_related('committee', 'member')
+
+    def create_from_raw(self, raw_obj, existing=None):
+        obj = super(CommitteeMembershipManager, self).create_from_raw(raw_obj, existing)
         # String up the person and the committee
         raw_committee = raw_obj.committee
         if raw_committee is not None:
@@ -447,23 +840,26 @@ class ParsedCommitteeMembership(TimestampMixin, BaseParsedModel):
 class CouncilMeetingManager(BaseParsedManager):
     excluded = ['start_date', 'end_date']
 
-    def create_from_raw(self, raw_obj):
+    def get_parsed_uid(self, raw_obj):
         # Need to snip off the language on the agenda UID
-        new_uid = u'cmeeting-{:%Y%m%d}'.format(raw_obj.start_date)
-        try:
-            obj = self.get(uid=new_uid)
-        except self.model.DoesNotExist:
-            obj = self.model()
+        return u'cmeeting-{:%Y%m%d}'.format(raw_obj.start_date)
+
+    def create_from_raw(self, raw_obj, existing=None):
+        new_uid = self.get_parsed_uid(raw_obj)
+        obj = self.get_or_new(new_uid, existing)
 
         obj.uid = new_uid
         start_date = raw_obj.start_date
         obj.start_date = datetime.combine(start_date, time(11, 0))
+        if settings.USE_TZ:
+            # Aware like the dates loaded from the database, so that populate() can compare them
+            obj.start_date = timezone.make_aware(obj.start_date, timezone.get_default_timezone())
         obj.deactivate = False
         return obj
 
     def get_from_raw(self, raw_obj):
         # Get a ParsedCouncilMeeting from a RawCouncilAgenda
-        new_uid = u'cmeeting-{:%Y%m%d}'.format(raw_obj.start_date)
+        new_uid = self.get_parsed_uid(raw_obj)
         try:
             return self.get(uid=new_uid)
         except self.model.DoesNotExist:
@@ -491,34 +887,149 @@ class ParsedCouncilMeeting(TimestampMixin, BaseParsedModel):
             return u'Meeting on {} to {}'.format(self.start_date.date(), self.end_date.date())
 
 
+# The fields of ParsedQuestion filled from the CouncilQuestion parsers, in each language, and the attributes
+# of the parser they come from
+QUESTION_PARSER_FIELDS = [
+    # Replier(s)
+    ('repliers', 'repliers'),
+    # Question subject
+    ('ask_subject', 'subject'),
+    # Reply subject
+    ('reply_subject', 'question_title'),
+    # Question body
+    ('body', 'question_content'),
+    # Reply body
+    ('reply', 'reply_content'),
+]
+
+
+def parse_question(raw_question):
+    """
+    The values of QUESTION_PARSER_FIELDS from the parser of a RawCouncilQuestion, as a dict of plain strings,
+    or None if it cannot be parsed.  Run in the worker processes of QuestionManager.populate()
+    """
+    if raw_question is None:
+        return None
+    parser = raw_question.get_parser()
+    if parser is None:
+        return None
+    return dict((field, plain(getattr(parser, attr))) for field, attr in QUESTION_PARSER_FIELDS)
+
+
+def _parse_question_pair(pair):
+    return parse_question(pair[0]), parse_question(pair[1])
+
+
+def _parse_question_pairs(executor, pairs, window):
+    """
+    Parses the pairs of raw questions in a pool of workers, yielding the results in order.  Up to window pairs
+    are submitted ahead, so that they are parsed while the results are written, without pickling all of
+    them up front
+    """
+    futures = deque()
+    for pair in pairs:
+        if len(futures) >= window:
+            yield futures.popleft().result()
+        futures.append(executor.submit(_parse_question_pair, pair))
+    while futures:
+        yield futures.popleft().result()
+
+
+def question_meeting_uid(raw_uid):
+    """
+    The uid of the ParsedCouncilMeeting of a RawCouncilQuestion, from the date in its uid
+    """
+    return u'cmeeting-{}'.format(raw_uid.split('-')[1])
+
+
+class QuestionLookups(object):
+    """
+    The objects that QuestionManager.create_from_raw looks up by uid.  load() reads all of them in a few
+    queries, otherwise each one is queried when needed
+    """
+    def __init__(self):
+        self.meetings = None
+        self.persons = None
+        self.questions = None
+        self.duplicate_questions = set()
+        self.raw_questions = None
+
+    def load(self, raw_uids=None):
+        """
+        Loads the lookups, with all of the raw questions or those with the uids in raw_uids.
+        With raw_uids, only the meetings of those questions are loaded, with their questions, and the
+        persons asking them, so that an incremental sync does not read the whole archive
+        """
+        self.duplicate_questions = set()
+        raw_questions = RawCouncilQuestion.objects.select_related('asker')
+        if raw_uids is None:
+            self.raw_questions = index_by_uid(raw_questions)
+            self.meetings = index_by_uid(ParsedCouncilMeeting.objects.all())
+            self.persons = index_by_uid(ParsedPerson.objects.all())
+            self.questions = index_by_uid(ParsedQuestion.objects.all(), found=self.duplicate_questions)
+            return self
+        self.raw_questions = index_by_uid(raw_questions, raw_uids)
+        meeting_uids = set(question_meeting_uid(uid) for uid in self.raw_questions)
+        self.meetings = index_by_uid(ParsedCouncilMeeting, meeting_uids)
+        asker_uids = set(xx.asker.uid for xx in self.raw_questions.values() if xx.asker is not None)
+        self.persons = index_by_uid(ParsedPerson, asker_uids)
+        self.questions = index_by_uid(ParsedQuestion, meeting_uids, found=self.duplicate_questions,
+                                      lookup='meeting__uid')
+        return self
+
+    def _get(self, index, model, uid):
+        if index is not None:
+            return index.get(uid)
+        try:
+            return model.objects.get(uid=uid)
+        except model.DoesNotExist:
+            return None
+
+    def meeting(self, uid):
+        return self._get(self.meetings, ParsedCouncilMeeting, uid)
+
+    def person(self, uid):
+        return self._get(self.persons, ParsedPerson, uid)
+
+    def question(self, uid):
+        return self._get(self.questions, ParsedQuestion, uid)
+
+    def raw_question(self, uid):
+        return self._get(self.raw_questions, RawCouncilQuestion, uid)
+
+
 class QuestionManager(BaseParsedManager):
-    
-    def create_from_raw(self, raw_obj):
+    # Number of questions written in one transaction by populate()
+    chunk_size = 200
+
+    def create_from_raw(self, raw_obj, lookups=None, parsed=None):
+        """
+        The ParsedQuestion of an English RawCouncilQuestion, not saved, or None if it has no meeting.
+        lookups is a QuestionLookups, and parsed the results of parse_question() for the question in
+        both languages, which are parsed here if not given
+        """
         # We assume raw_obj is in English
+        if lookups is None:
+            lookups = QuestionLookups()
         
-        #obj = ParsedQuestion()
         # we can get a lot of info from raw uid
         raw_uid = raw_obj.uid
-        date_str = raw_uid.split('-')[1]
         
         # locate the council meeting/agenda in which this question appears
-        meeting_uid = u'cmeeting-{}'.format(date_str)
-        try:
-            meeting = ParsedCouncilMeeting.objects.get(uid=meeting_uid)
-        except ParsedCouncilMeeting.DoesNotExist:
+        meeting_uid = question_meeting_uid(raw_uid)
+        meeting = lookups.meeting(meeting_uid)
+        if meeting is None:
             # Sometimes a meeting is cancelled or delayed - in this case we can ignore this question
             # e.g. 2013.05.15
-            logger.warn(u'Cannot find a meeting for question:{} - required meeting uid: {}'.format(raw_uid,date_str))
+            logger.warn(u'Cannot find a meeting for question:{} - required meeting uid: {}'.format(raw_uid,meeting_uid))
             return None #because we cannot generate a uid
-        if meeting is not None:
-            # Make a uid
-            new_uid = ParsedQuestion.generate_uid(meeting, raw_obj.number, raw_obj.is_urgent)
-            # Get or create
-            try:
-                obj = ParsedQuestion.objects.get(uid=new_uid)
-            except ParsedQuestion.DoesNotExist:
-                obj = ParsedQuestion()
-                obj.uid = new_uid
+        # Make a uid
+        new_uid = ParsedQuestion.generate_uid(meeting, raw_obj.number, raw_obj.is_urgent)
+        # Get or create
+        obj = lookups.question(new_uid)
+        if obj is None:
+            obj = ParsedQuestion()
+            obj.uid = new_uid
         
         obj.meeting = meeting
             
@@ -529,67 +1040,117 @@ class QuestionManager(BaseParsedManager):
         # Oral or written
         obj.question_type = ParsedQuestion.ORAL if raw_obj.is_oral else ParsedQuestion.WRITTEN
         # Asker
-        if raw_obj.asker is not None: 
-            #raw_obj.asker is already a foreign key, and member uid does not change from raw to parsed
-            person = ParsedPerson.objects.get(uid=raw_obj.asker.uid)
-        else:
-            # Sometimes the NameMatcher does not work, so no asker FK was stored in model
-            # we can try our luck in other language
-            q_otherlang = raw_obj.get_lang_counterpart()
-            if q_otherlang.asker is not None:
-                person = ParsedPerson.objects.get(uid=q_otherlang.asker.uid)    
-        if 'person' in locals():
-            if person is not None:
-                obj.asker = person
+        # raw_obj.asker is already a foreign key, and member uid does not change from raw to parsed
+        # Sometimes the NameMatcher does not work, so no asker FK was stored in model
+        # we can try our luck in other language
+        uid_cn = raw_obj.uid[:-1] + u'c'
+        q_otherlang = lookups.raw_question(uid_cn)
+        person = None
+        if raw_obj.asker is not None:
+            person = lookups.person(raw_obj.asker.uid)
+        elif q_otherlang is not None and q_otherlang.asker is not None:
+            person = lookups.person(q_otherlang.asker.uid)
+        if person is not None:
+            obj.asker = person
         else:
-            logger.warn('Cannot find asker for question {} with name "{}"'.format(raw_obj.uid,raw_obj.asker))
+            logger.warn('Cannot find asker for question {} with name "{}"'.format(raw_obj.uid,raw_obj.raw_asker))
         
         # Need to use question parser from here on
         # Need both languages
-        uid_cn = raw_obj.uid[:-1] + u'c'
-        q_parser_en = raw_obj.get_parser()
-        q_parser_cn = RawCouncilQuestion.objects.get_by_uid(uid_cn).get_parser()
+        if parsed is None:
+            parsed = parse_question(raw_obj), parse_question(q_otherlang)
+        parsed_en, parsed_cn = parsed
         # sometimes (rarely) parser returns a NoneType
-        if q_parser_en and q_parser_cn:
-            # Replier(s)
-            obj.repliers_e = q_parser_en.repliers
-            obj.repliers_c = q_parser_cn.repliers
-            # Question subject
-            obj.ask_subject_e = q_parser_en.subject
-            obj.ask_subject_c = q_parser_cn.subject
-            # Reply subject
-            obj.reply_subject_e = q_parser_en.question_title
-            obj.reply_subject_c = q_parser_cn.question_title
-            # Question body
-            obj.body_e = q_parser_en.question_content
-            obj.body_c = q_parser_cn.question_content
-            # Reply body
-            obj.reply_e = q_parser_en.reply_content
-            obj.reply_c = q_parser_cn.reply_content
+        if parsed_en and parsed_cn:
+            for field, attr in QUESTION_PARSER_FIELDS:
+                setattr(obj, field + '_e', parsed_en[field])
+                setattr(obj, field + '_c', parsed_cn[field])
         
         return obj
-        
-    def populate(self, dry_run=False):
+
+    def _populate_questions(self, chunk, lookups, snapshots, counts, deactivated, pending, dry_run):
+        objs = OrderedDict()
+        for (raw_question, raw_question_cn), parsed in chunk:
+            obj = self.create_from_raw(raw_question, lookups, parsed)
+            if obj is None:
+                # Its meeting may not have been populated yet
+                counts['skipped'] += 1
+                pending.add(raw_question.uid)
+                continue
+            asker_ids = [xx.asker_id for xx in (raw_question, raw_question_cn) if xx is not None]
+            if obj.asker_id is None and any(asker_ids):
+                # Nor its asker
+                pending.add(raw_question.uid)
+            if obj.uid in lookups.duplicate_questions:
+                logger.warn(u'Found more than one question with uid {}'.format(obj.uid))
+                counts['skipped'] += 1
+                continue
+            objs[obj.uid] = obj
+        if dry_run:
+            return
+        self._save_objects(objs, snapshots, counts, deactivated)
+        # bulk_create does not set the ids, so load the new questions for the next chunks to update them
+        new_uids = [uid for uid in objs if uid not in snapshots]
+        if new_uids:
+            fields = concrete_fields(self.model)
+            for obj in self.filter(uid__in=new_uids):
+                lookups.questions[obj.uid] = obj
+                snapshots[obj.uid] = (obj.pk, snapshot(obj, fields))
+
+    def raw_uids(self):
+        # The uid of a question comes from its meeting and number, which takes parsing the raw questions
+        return None
+
+    def populate(self, dry_run=False, workers=1, chunk_size=None, since=None, retry=(), pending=None):
+        """
+        Creates or updates the ParsedQuestions of the English RawCouncilQuestions, or of those changed after
+        since in either language and those with their uid in retry.  The meetings, persons, existing questions
+        and raw questions are loaded up front, the questions are parsed by a pool of workers processes when
+        workers is more than 1, and the ParsedQuestions are written in bulk, chunk_size at a time.
+        The uids of the questions without a meeting or an asker yet are added to the set pending.
+        Returns a dict of the numbers of questions created, updated, skipped and failed
+        """
         self._deactivate_db_debug()
         question_logger.deactivate = False
+        counts = {'created': 0, 'updated': 0, 'skipped': 0, 'failed': 0}
+        if pending is None:
+            pending = set()
+        raw_uids = None
+        if since is not None:
+            # The questions changed in one language are parsed again in both
+            raw_uids = set()
+            changed = RawCouncilQuestion.objects.filter(self.changed_since(since)).values_list('uid', flat=True)
+            for uid in list(changed) + list(retry):
+                raw_uids.update([uid[:-1] + u'e', uid[:-1] + u'c'])
+        lookups = QuestionLookups().load(raw_uids)
         # use English version as base, fill in Chinese info later
-        en_questions = RawCouncilQuestion.objects.filter(uid__endswith=u'e').order_by('raw_date')
-        count = 0
-        for raw_question in en_questions:
-            # Get or create, but without commit
-            obj = self.create_from_raw(raw_question)
-            if obj is not None:
-                try:
-                    obj.save()
-                    count += 1
-                except IntegrityError as e:
-                    logger.warning(u'Could not create from {}'.format(raw_question))
-                    logger.warning(e)
-        logger.info('Populated {} questions'.format(count))
-        question_logger.deactivate = True
-        self._reactivate_db_debug()
-        
-        
+        en_questions = sorted([xx for uid, xx in lookups.raw_questions.items() if uid.endswith(u'e')], key=lambda xx: xx.pk)
+        pairs = [(xx, lookups.raw_questions.get(xx.uid[:-1] + u'c')) for xx in en_questions]
+        chunk_size = chunk_size or self.chunk_size
+        executor = None
+        if workers > 1:
+            # The workers open their own connections
+            for conn in connections.all():
+                conn.close()
+            executor = ProcessPoolExecutor(max_workers=workers)
+            results = _parse_question_pairs(executor, pairs, chunk_size)
+        else:
+            results = (_parse_question_pair(pair) for pair in pairs)
+        # The values of the existing questions, to tell the changed ones
+        fields = concrete_fields(self.model)
+        snapshots = dict((uid, (obj.pk, snapshot(obj, fields))) for uid, obj in lookups.questions.items())
+        deactivated = self.deactivated_uids()
+        try:
+            for chunk in chunked(izip(pairs, results), chunk_size):
+                self._populate_questions(chunk, lookups, snapshots, counts, deactivated, pending, dry_run)
+        finally:
+            if executor is not None:
+                executor.shutdown()
+            question_logger.deactivate = True
+            self._reactivate_db_debug()
+        logger.info(u'Populated questions: {created} created, {updated} updated, {skipped} skipped, {failed} failed'.format(**counts))
+        return counts
+
         ################ Depreciated - we parsed the Q&A from web page ##################
         """
         Create ParsedQuestions.  Strategy is to start with all RawCouncilQuestions, get the basic information from there,
@@ -754,3 +1315,13 @@ class ParsedQuestion(TimestampMixin, BaseParsedModel):
     @classmethod
     def generate_uid(cls, meeting, number, is_urgent):
         return u'{}-{}q{}'.format(meeting.uid, u'u' if is_urgent else u'', number)
+
+
+# The name matchers of the persons are rebuilt when they change
+post_save.connect(matchers.invalidate, sender=ParsedPerson)
+post_delete.connect(matchers.invalidate, sender=ParsedPerson)
+# And so are the interval indexes of the memberships
+post_save.connect(intervals.invalidate, sender=ParsedMembership)
+post_delete.connect(intervals.invalidate, sender=ParsedMembership)
+post_save.connect(intervals.invalidate, sender=ParsedCommitteeMembership)
+post_delete.connect(intervals.invalidate, sender=ParsedCommitteeMembership)
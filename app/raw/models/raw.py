@@ -2,14 +2,18 @@
 import logging
 from datetime import date
 from django.db import models
+from django.db.models.signals import post_save, post_delete
 from django.db.models import Count
 from django.utils.encoding import force_unicode
 import re
 from .. import utils
+from ..bulk import index_by_uid
 from ..docs.agenda import CouncilAgenda, AgendaQuestion
 from ..docs.question import CouncilQuestion
 from ..docs.hansard import CouncilHansard
-from ..names import NameMatcher, MemberName
+from ..docs.cache import get_parse_cache
+from ..names import (CHINESE_FUZZY_THRESHOLD, FUZZY_THRESHOLD, FuzzyNameIndex, NameMatcher, MemberName, matchers,
+                     resolve_names)
 from constants import *
 
 
@@ -32,6 +36,13 @@ class RawModelManager(models.Manager):
             raise RuntimeError('Invalid UID format'.format(uid))
         return obj
 
+    def index_by_uid(self, uids=None):
+        """
+        Returns a dict of uid to object, for the given uids or all of the objects, in one query.
+        Like get_by_uid, uids shared by several objects are left out
+        """
+        return index_by_uid(self.all(), uids)
+
 
 class RawModel(models.Model):
     """
@@ -99,14 +110,15 @@ class RawCouncilAgenda(RawModel):
 
     def get_parser(self):
         """
-        Returns the parser for this RawCouncilAgenda object
+        Returns the parser for this RawCouncilAgenda object.
+        The results are cached, see raw.docs.cache
         """
         src = self.get_source()
         try:
-            return CouncilAgenda(self.uid, src)
+            return get_parse_cache().parse(CouncilAgenda, self.uid, src)
         except BaseException as e:
             logger.warn(u'Could not parse agenda for {}'.format(self.uid))
-            logger.warn(e)
+            logger.warn(e, exc_info=True)
             return None
 
     @classmethod
@@ -189,9 +201,13 @@ class RawCouncilHansard(RawModel):
             return None
         
         
-    def get_parser(self):
+    def get_parser(self, question_index=None, config=None):
         """
-        Returns the parser for this RawCouncilansard object
+        Returns the parser for this RawCouncilansard object.
+        The results are cached, see raw.docs.cache
+        question_index is an optional dict of uid to RawCouncilQuestion, see
+        RawModelManager.index_by_uid, to save looking up the questions of each hansard
+        config is the debug or production configuration of the parser, see raw.docs.config
         """
         src = self.get_source()
         lang = self.language
@@ -199,10 +215,10 @@ class RawCouncilHansard(RawModel):
         if src is None:
             return None
         try:
-            return CouncilHansard(self.uid, lang, src, date)
+            return get_parse_cache().parse(CouncilHansard, self.uid, lang, src, date, question_index=question_index, config=config)
         except BaseException as e:
             logger.warn(u'Could not parse hansard for {}'.format(self.uid))
-            logger.warn(e)
+            logger.warn(e, exc_info=True)
             return None
     
     @classmethod
@@ -300,13 +316,39 @@ class RawMember(RawModel):
     def get_matcher(cls, english=True):
         """
         Returns an instance of NameMatcher that is populated with all of the names in the database
-        for use when trying to match plain text names against Member entities
+        for use when trying to match plain text names against Member entities.
+        It is shared by the whole process, and rebuilt when members change, see raw.names.MatcherRegistry
         """
+        return matchers.get(cls, english)
+
+    @classmethod
+    def build_matcher(cls, english=True):
         all_members = cls.objects.all()
         names = [(xx.get_name_object(english), xx) for xx in all_members]
         matcher = NameMatcher(names)
         return matcher
 
+    @classmethod
+    def get_fuzzy_index(cls, english=True):
+        """
+        Returns the FuzzyNameIndex of all of the names in the database, for the names that the NameMatcher
+        cannot match.  It is shared like the matcher
+        """
+        return matchers.get(cls, english, 'build_fuzzy_index')
+
+    @classmethod
+    def resolve_names(cls, strings, english=True, fuzzy=True):
+        """
+        Resolves the names of members as written in the documents in one pass, with the shared matcher and
+        fuzzy index.  Returns a dict of each distinct string to its NameResolution, see raw.names.resolve_names
+        """
+        return resolve_names(strings, cls.get_matcher(english), cls.get_fuzzy_index(english) if fuzzy else None)
+
+    @classmethod
+    def build_fuzzy_index(cls, english=True):
+        names = [(xx.get_name_object(english), xx) for xx in cls.objects.all()]
+        return FuzzyNameIndex(names, FUZZY_THRESHOLD if english else CHINESE_FUZZY_THRESHOLD)
+
     @classmethod
     def get_members_with_questions(cls):
         return cls.objects.annotate(num_q=Count('raw_questions')).filter(num_q__gt=0)
@@ -439,7 +481,8 @@ class RawCouncilQuestion(RawModel):
     
     def get_parser(self):
         """
-        Returns the parser for this RawCouncilQuestion object
+        Returns the parser for this RawCouncilQuestion object.
+        The results are cached, see raw.docs.cache
         """
         src = self.get_source() #source should be an htm file
         urgent = self.is_urgent
@@ -449,10 +492,10 @@ class RawCouncilQuestion(RawModel):
         subject = self.subject
         
         try:
-            return CouncilQuestion(self.uid,date,urgent,oral,src,subject,link)
+            return get_parse_cache().parse(CouncilQuestion, self.uid, date, urgent, oral, src, subject, link)
         except BaseException as e:
             logger.warn(u'Could not parse question for {}'.format(self.uid))
-            logger.warn(e)
+            logger.warn(e, exc_info=True)
             return None
     
     def get_lang_counterpart(self):
@@ -468,41 +511,54 @@ class RawCouncilQuestion(RawModel):
     @classmethod
     def fix_asker_by_parser(cls):
         """
-        Loop over all questions without an asker Foreign Key, and attempt to use parser to fix it.
+        Loop over all questions without an asker Foreign Key, and attempt to match the raw asker, or else
+        to use parser to fix it, or else to find the raw asker with the FuzzyNameIndex of the members,
+        which can take a member sharing the surname for a misspelled name, so it comes last.
         Returns a list of UIDs of questions still without an asker.
         Advise to run this after saving questions to database with processor.
         """
         matcher_en = RawMember.get_matcher()
         matcher_cn = RawMember.get_matcher(False)
-        raw_questions_without_asker = cls.objects.filter(asker=None)
-        no_asker_list = []
+        raw_questions_without_asker = list(cls.objects.filter(asker=None))
+        # The raw askers are matched all at once, without parsing the questions
+        resolved_en = RawMember.resolve_names((q.raw_asker for q in raw_questions_without_asker if q.uid[-1] == u'e'),
+                                              fuzzy=False)
+        resolved_cn = RawMember.resolve_names((q.raw_asker for q in raw_questions_without_asker if q.uid[-1] != u'e'),
+                                              False, fuzzy=False)
+        unmatched = []
         for q in raw_questions_without_asker:
-            parser = q.get_parser()
-            if parser is not None:
+            resolution = (resolved_en if q.uid[-1] == u'e' else resolved_cn)[q.raw_asker]
+            if resolution.member is not None:
+                q.asker = resolution.member
+                q.save()
+                continue
+            # Try the parser, then the different language counterpart
+            asker_str = None
+            for question in (q, q.get_lang_counterpart()):
+                parser = question.get_parser() if question is not None else None
+                if parser is None:
+                    continue
                 asker_str = parser.asker
-                matcher = matcher_en if q.uid[-1] == u'e' else matcher_cn
-                name = MemberName(asker_str)
-                match = matcher.match(name)
+                matcher = matcher_en if question.uid[-1] == u'e' else matcher_cn
+                match = matcher.match(MemberName(asker_str))
                 if match is not None:
-                    member = match[1]
-                    q.asker = member
+                    q.asker = match[1]
                     q.save()
-                else:
-                    # Try different language counterpart
-                    q_otherlang = q.get_lang_counterpart()
-                    parser = q_otherlang.get_parser()
-                    if parser is not None:
-                        asker_str = parser.asker
-                        matcher = matcher_en if q_otherlang.uid[-1] == u'e' else matcher_cn
-                        name = MemberName(asker_str)
-                        match = matcher.match(name)
-                        if match is not None:
-                            member = match[1]
-                            q.asker = member
-                            q.save()
-                        else:
-                            no_asker_list.append(q.uid)
-                            logger.warn(u'Cannot match asker {} for question {} with effort of parser.'.format(asker_str,q.uid))
+                    break
+            else:
+                unmatched.append((q, asker_str))
+        # Misspelled or reordered names last
+        fuzzy_en = RawMember.get_fuzzy_index()
+        fuzzy_cn = RawMember.get_fuzzy_index(False)
+        no_asker_list = []
+        for q, asker_str in unmatched:
+            match = (fuzzy_en if q.uid[-1] == u'e' else fuzzy_cn).match(q.raw_asker) if q.raw_asker else None
+            if match is not None:
+                q.asker = match[1]
+                q.save()
+            else:
+                no_asker_list.append(q.uid)
+                logger.warn(u'Cannot match asker {} for question {} with effort of parser.'.format(asker_str, q.uid))
         return no_asker_list
     @classmethod
     def get_from_parser(cls, parser):
@@ -621,3 +677,7 @@ class RawMeetingCommittee(RawModel):
     def __unicode__(self):
         return u'slot-{}:committee-{}'.format(self.slot_id, self._committee_id)
 
+
+# The name matchers of the members are rebuilt when they change
+post_save.connect(matchers.invalidate, sender=RawMember)
+post_delete.connect(matchers.invalidate, sender=RawMember)
@@ -1,6 +1,41 @@
 #!/usr/bin/python
 # -*- coding: utf-8 -*-
+from collections import namedtuple, OrderedDict
+import heapq
 import re
+import threading
+
+
+# Parts of the English names
+TITLE_RE = ur'(?P<title>Mr|Mrs|Miss|Ms|Hon|Dr)'
+ENAME_RE = ur'(?P<fname>[a-zA-Z]+)'
+LNAME_CAP_RE = ur'(?P<lname>[A-Z]{2,})'
+LNAME_RE = ur'(?P<lname>[a-zA-Z]+)'
+# We assume that the anglicized Chinese names consist of three characters, though there are definitely
+# some members for whom this is not the case.
+CNAME_RE = ur'(?P<cname>[a-zA-Z]+-{1}[a-zA-Z]+)'
+
+# The patterns of the English names, in the order they are tried
+ENGLISH_NAME_PATTERNS = [
+    # fully qualified
+    re.compile(ur'^{}? ?{} {} {}?(, )?(?P<hon>[A-Z, ]+)?'.format(TITLE_RE, ENAME_RE, LNAME_CAP_RE, CNAME_RE)),
+    # English with anglicized
+    re.compile(ur'{} {} {}'.format(ENAME_RE, LNAME_RE, CNAME_RE)),
+    # minimal with capitalized last name
+    re.compile(ur'{} {}'.format(ENAME_RE, LNAME_CAP_RE)),
+    # minimal anglicized
+    re.compile(ur'{} {}'.format(LNAME_RE, CNAME_RE)),
+    # reversed
+    re.compile(ur'{}, {}'.format(LNAME_RE, ENAME_RE)),
+    # minimal
+    re.compile(ur'{} {}'.format(ENAME_RE, LNAME_RE)),
+]
+
+# Assumes that Chinese names are 2-4 characters.
+CHINESE_NAME_PATTERN = re.compile(ur'^(?P<name>\w{2,4})(?P<title>議員)?$', re.UNICODE)
+
+# Number of full names kept by parse_name
+NAME_CACHE_SIZE = 4096
 
 
 def is_ascii(string):
@@ -27,6 +62,93 @@ def proper(string):
     return string
 
 
+# The parts of a full name, honours is a tuple or None
+ParsedName = namedtuple('ParsedName', 'is_english title english_name last_name chinese_name honours')
+
+
+def _parse_english_name(name):
+    """
+    Given an english full name, try to parse it into its constituent parts
+    """
+    for pattern in ENGLISH_NAME_PATTERNS:
+        # The first pattern is anchored with ^, so search() is the same as match() for it
+        match = pattern.search(name)
+        if match is not None:
+            res = match.groupdict()
+            honours = None
+            if res.get('hon') is not None:
+                honours = tuple(xx.strip() for xx in res['hon'].split(',') if xx is not None)
+            return ParsedName(True, proper(res.get('title')), proper(res.get('fname')),
+                              proper(res['lname']), proper(res.get('cname')), honours)
+    return ParsedName(True, None, None, None, None, None)
+
+
+def _parse_chinese_name(name):
+    """
+    Given a chinese name, parse it into its constituent parts
+    """
+    match = CHINESE_NAME_PATTERN.match(name)
+    if match is not None:
+        res = match.groupdict()
+        # actually not strictly correct - think about the case of '梁劉柔芬' and '司徒華'
+        # but sufficient
+        return ParsedName(False, res['title'], None, res['name'][0], res['name'][1:3], None)
+    return ParsedName(False, None, None, None, None, None)
+
+
+class ParseCache(object):
+    """
+    Least recently used cache of the ParsedNames of up to maxsize full names.  The same names are
+    parsed over and over, from the documents and the members, and the records are immutable so they
+    can be shared.  hits and misses count the lookups since the last clear()
+    """
+    def __init__(self, maxsize=NAME_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._names = OrderedDict()
+        self._lock = threading.Lock()
+
+    def parse(self, full_name):
+        with self._lock:
+            parsed = self._names.pop(full_name, None)
+            if parsed is not None:
+                # Moved to the end, as the most recently used
+                self._names[full_name] = parsed
+                self.hits += 1
+                return parsed
+            self.misses += 1
+        if is_ascii(full_name):
+            parsed = _parse_english_name(full_name)
+        else:
+            parsed = _parse_chinese_name(full_name)
+        with self._lock:
+            self._names[full_name] = parsed
+            while len(self._names) > self.maxsize:
+                self._names.popitem(last=False)
+        return parsed
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self._names), 'maxsize': self.maxsize}
+
+    def clear(self):
+        with self._lock:
+            self._names.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+name_cache = ParseCache()
+
+
+def parse_name(full_name):
+    """
+    The ParsedName of a full name, English or Chinese
+    """
+    return name_cache.parse(full_name)
+
+
 class MemberName(object):
     def __init__(self, full_name=None, english_name=None, last_name=None, chinese_name=None):
         """
@@ -47,12 +169,14 @@ class MemberName(object):
             self.last_name = proper(last_name)
             self.chinese_name = proper(chinese_name)
         else:
-            # Check for language, then call the relevant parser
-            if is_ascii(full_name):
-                self._parse_english_name(full_name)
-            else:
-                self._parse_chinese_name(full_name)
-                self.is_english = False
+            parsed = parse_name(full_name)
+            self.is_english = parsed.is_english
+            self.title = parsed.title
+            self.english_name = parsed.english_name
+            self.last_name = parsed.last_name
+            self.chinese_name = parsed.chinese_name
+            if parsed.honours is not None:
+                self.honours = list(parsed.honours)
 
     def __repr__(self):
         return u'<MemberName: {}>'.format(self.full_name).encode('utf-8')
@@ -99,86 +223,6 @@ class MemberName(object):
     def __ne__(self, other):
         return not self.__eq__(other)
 
-    def _parse_english_name(self, name):
-        """
-        Given an english full name, try to parse it into its constituent parts
-        """
-        title_re = ur'(?P<title>Mr|Mrs|Miss|Ms|Hon|Dr)'
-        ename_re = ur'(?P<fname>[a-zA-Z]+)'
-        lname_cap_re = ur'(?P<lname>[A-Z]{2,})'
-        lname_re = ur'(?P<lname>[a-zA-Z]+)'
-        # We assume that the anglicized Chinese names consist of three characters, though there are definitely
-        # some members for whom this is not the case.
-        cname_re = ur'(?P<cname>[a-zA-Z]+-{1}[a-zA-Z]+)'
-        fully_qualified = ur'^{}? ?{} {} {}?(, )?(?P<hon>[A-Z, ]+)?'.format(title_re, ename_re, lname_cap_re, cname_re)
-        match = re.match(fully_qualified, name)
-        if match is not None:
-            res = match.groupdict()
-            self.english_name = proper(res['fname'])
-            self.title = proper(res['title'])
-            if res['hon'] is not None:
-                self.honours = [xx.strip() for xx in res['hon'].split(',') if xx is not None]
-            self.last_name = proper(res['lname'])
-            self.chinese_name = proper(res['cname'])
-            return
-
-        english_with_anglicized = ur'{} {} {}'.format(ename_re, lname_re, cname_re)
-        match = re.search(english_with_anglicized, name)
-        if match is not None:
-            res = match.groupdict()
-            self.english_name = proper(res['fname'])
-            self.last_name = proper(res['lname'])
-            self.chinese_name = proper(res['cname'])
-            return
-
-        minimal_with_cap = ur'{} {}'.format(ename_re, lname_cap_re)
-        match = re.search(minimal_with_cap, name)
-        if match is not None:
-            res = match.groupdict()
-            self.english_name = proper(res['fname'])
-            self.last_name = proper(res['lname'])
-            return
-
-        minimal_anglicized = ur'{} {}'.format(lname_re, cname_re)
-        match = re.search(minimal_anglicized, name)
-        if match is not None:
-            res = match.groupdict()
-            self.last_name = proper(res['lname'])
-            self.chinese_name = proper(res['cname'])
-            return
-
-        reversed_re = ur'{}, {}'.format(lname_re, ename_re)
-        match = re.search(reversed_re, name)
-        if match is not None:
-            res = match.groupdict()
-            self.last_name = proper(res['lname'])
-            self.english_name = proper(res['fname'])
-            return
-
-        minimal = ur'{} {}'.format(ename_re, lname_re)
-        match = re.search(minimal, name)
-        if match is not None:
-            res = match.groupdict()
-            self.last_name = proper(res['lname'])
-            self.english_name = proper(res['fname'])
-            return
-
-    def _parse_chinese_name(self, name):
-        """
-        Given a chinese name, parse it into its constituent parts
-        """
-        # Assumes that Chinese names are 2-4 characters.
-        cname_re = ur'^(?P<name>\w{2,4})(?P<title>議員)?$'
-        match = re.match(cname_re, name, re.UNICODE)
-        if match is not None:
-            res = match.groupdict()
-            # actually not strictly correct - think about the case of '梁劉柔芬' and '司徒華'
-            # but sufficient
-            self.last_name = res['name'][0]
-            self.chinese_name = res['name'][1:3]
-            self.title = res['title']
-            return
-
     def is_valid(self):
         if self.last_name is not None and len(self.last_name) > 0:
             return True
@@ -198,15 +242,30 @@ class MemberName(object):
             return u'{}{}'.format(self.last_name, self.chinese_name)
 
 
+def name_keys(name):
+    """
+    The keys under which a MemberName is indexed by NameMatcher: its full name, its last name with its
+    English name, and its last name with its Chinese name (anglicized for English names).
+    Two names that are equal share at least one of these keys.
+    """
+    keys = [(u'full', name.full_name)]
+    if name.english_name is not None:
+        keys.append((u'english', name.last_name, name.english_name))
+    if name.chinese_name is not None:
+        keys.append((u'chinese', name.last_name, name.chinese_name))
+    return keys
+
+
 class NameMatcher(object):
     """
-    Searcher class which takes a collection of MemberNames and stores them in a last name based index
-    Chinese names are stored by the Chinese character, so the index can grow quite large
+    Searcher class which takes a collection of MemberNames and stores them in a dict index of their name_keys.
+    Only the names that share a key with the name to match are compared to it with MemberName.__eq__
     """
     def __init__(self, names):
         """
         :param names: list of MemberNames or list of tuples where MemberName is the first element in each tuple
         """
+        self._names = []
         self._index = {}
         for n in names:
             if isinstance(n, MemberName):
@@ -216,28 +275,312 @@ class NameMatcher(object):
             if not name_obj.is_valid():
                 # Invalid names are ignored
                 continue
-            first_letter = name_obj.last_name[0].lower()
-            if self._index.get(first_letter, None) is None:
-                self._index[first_letter] = []
-            self._index[first_letter].append(n)
+            position = len(self._names)
+            self._names.append((name_obj, n))
+            for key in name_keys(name_obj):
+                self._index.setdefault(key, []).append(position)
 
     def match(self, name):
         """
-        Given an instance of MemberName, find a name in the index that matches it
+        Given an instance of MemberName, find a name in the index that matches it.
+        When several names match, the first one given to the matcher is returned
 
         :param name: MemberName
         :return: MemberName or None
         """
         if not name.is_valid():
             return None
+        positions = set()
+        for key in name_keys(name):
+            positions.update(self._index.get(key, ()))
+        # Names with equal full names but different last names are equal, they are only matched
+        # when their last names start with the same letter
         first_letter = name.last_name[0].lower()
-        if self._index.get(first_letter, None) is None:
-            return None
-        for n in self._index[first_letter]:
-            if isinstance(n, MemberName):
-                if n == name:
-                    return n
-            else:
-                if n[0] == name:
-                    return n
+        for position in sorted(positions):
+            name_obj, n = self._names[position]
+            if name_obj.last_name[0].lower() == first_letter and name_obj == name:
+                return n
         return None
+
+
+# Words of the names left out of the fuzzy index
+TITLES = frozenset([u'mr', u'mrs', u'miss', u'ms', u'hon', u'dr', u'ir', u'prof', u'professor'])
+HONOURS = frozenset([u'GBM', u'GBS', u'SBS', u'BBS', u'MH', u'JP', u'OBE', u'CBE', u'MBE', u'ISO', u'QC', u'SC'])
+CHINESE_TITLES = [u'議員', u'先生', u'女士', u'博士', u'教授']
+
+# Lowest score of a name found by FuzzyNameIndex.match().  A Chinese name with one of its three
+# characters wrong scores 0.5, but is never matched, see one_character_score(), and neither are
+# the English names of other members scoring above it, see same_english_member()
+FUZZY_THRESHOLD = 0.6
+CHINESE_FUZZY_THRESHOLD = 0.5
+# How much higher than the next name an English name must score to be matched
+FUZZY_MARGIN = 0.1
+
+
+def fuzzy_tokens(text):
+    """
+    The words of a name as lower case letters, without its titles and honours, or for Chinese names
+    the Chinese characters without the title
+    """
+    if not is_ascii(text):
+        for title in CHINESE_TITLES:
+            text = text.replace(title, u'')
+        chinese = u''.join(xx for xx in text if ord(xx) > 127 and xx.isalpha())
+        return [chinese] if chinese else []
+    tokens = []
+    for word in re.findall(ur"[A-Za-z][A-Za-z'.-]*", text):
+        word = word.rstrip(u'.')
+        if word in HONOURS or word.lower() in TITLES:
+            continue
+        token = re.sub(ur"[^a-z]", u'', word.lower())
+        if token:
+            tokens.append(token)
+    return tokens
+
+
+def fuzzy_grams(tokens):
+    """
+    The set of the character n-grams of the tokens, each padded with spaces: trigrams of the
+    English words, bigrams of the Chinese names since they only have 2 to 4 characters
+    """
+    grams = set()
+    for token in tokens:
+        size = 3 if is_ascii(token) else 2
+        padded = u' {} '.format(token)
+        for ii in range(len(padded) - size + 1):
+            grams.add(padded[ii:ii + size])
+    return grams
+
+
+def _name_tokens(name):
+    if name.is_english:
+        return fuzzy_tokens(u' '.join(xx for xx in (name.english_name, name.last_name, name.chinese_name) if xx))
+    return fuzzy_tokens(u'{}{}'.format(name.last_name or u'', name.chinese_name or u''))
+
+
+def _text_tokens(text):
+    if isinstance(text, MemberName):
+        return _name_tokens(text)
+    return fuzzy_tokens(text)
+
+
+def _text_grams(text):
+    return fuzzy_grams(_text_tokens(text))
+
+
+def one_character_score(grams):
+    """
+    The highest score against the grams of a Chinese name of a name with one of its characters wrong:
+    (n - 1) / (n + 1) for n characters, 0.5 for three.  That name is as likely another member, who
+    shares the surname and a given name, as a misspelling, so FuzzyNameIndex.best() only takes
+    the names scoring above it.  0 for English names, which have fuzzy_grams() of three letters
+    """
+    if not grams or all(is_ascii(xx) for xx in grams):
+        return 0.0
+    return (len(grams) - 2.0) / len(grams)
+
+
+def one_edit_apart(a, b):
+    """
+    Whether the words are the same but for at most one letter added, dropped, replaced, or swapped with the next
+    """
+    if a == b:
+        return True
+    if abs(len(a) - len(b)) > 1:
+        return False
+    if len(a) > len(b):
+        a, b = b, a
+    pos = 0
+    while pos < len(a) and a[pos] == b[pos]:
+        pos += 1
+    if len(a) < len(b):
+        return a[pos:] == b[pos + 1:]
+    return a[pos + 1:] == b[pos + 1:] or (a[pos + 1:pos + 2] == b[pos:pos + 1] and
+                                          a[pos:pos + 1] == b[pos + 1:pos + 2] and a[pos + 2:] == b[pos + 2:])
+
+
+def same_english_member(tokens, name_obj):
+    """
+    Whether the fuzzy_tokens() of an English name can be the name of name_obj misspelled: the surname is the
+    same, and each of the other words is at most one letter off a word of name_obj.  The members sharing a
+    surname have close given names as often as not, like WONG Kwok-hing and WONG Kwok-kin, and Dice scores
+    them above FUZZY_THRESHOLD
+    """
+    surname = fuzzy_tokens(name_obj.last_name or u'')
+    if not surname or any(xx not in tokens for xx in surname):
+        return False
+    name_tokens = _name_tokens(name_obj)
+    return all(any(one_edit_apart(token, xx) for xx in name_tokens) for token in tokens)
+
+
+class FuzzyNameIndex(object):
+    """
+    Finds the names closest to a misspelled or reordered name, for the names that NameMatcher cannot match.
+    The names are stored in an inverted index of their character n-grams, and the candidates for a name
+    are scored with the Dice coefficient of their n-grams, from 0 to 1.  The order of the words does not
+    change the score, and neither do the titles and honours.
+    """
+    def __init__(self, names, threshold=FUZZY_THRESHOLD):
+        """
+        :param names: list of MemberNames or list of tuples where MemberName is the first element in each tuple
+        :param threshold: default lowest score of the names found by match()
+        """
+        self.threshold = threshold
+        self._names = []
+        self._sizes = []
+        self._index = {}
+        for n in names:
+            name_obj = n if isinstance(n, MemberName) else n[0]
+            if not name_obj.is_valid():
+                continue
+            grams = fuzzy_grams(_name_tokens(name_obj))
+            if not grams:
+                continue
+            position = len(self._names)
+            self._names.append(n)
+            self._sizes.append(len(grams))
+            for gram in grams:
+                self._index.setdefault(gram, []).append(position)
+
+    def candidates(self, text, k=5, threshold=0.0):
+        """
+        The k names closest to text, a name as written in the documents, as a list of (score, name)
+        with the best first.  Only the names with a score of at least threshold are returned.
+
+        :param text: string, or MemberName
+        :return: list of (float, MemberName or tuple)
+        """
+        grams = _text_grams(text)
+        if not grams:
+            return []
+        shared = {}
+        for gram in grams:
+            for position in self._index.get(gram, ()):
+                shared[position] = shared.get(position, 0) + 1
+        size = len(grams)
+        scored = []
+        for position, count in shared.iteritems():
+            score = 2.0 * count / (size + self._sizes[position])
+            if score >= threshold:
+                # The earlier names first among equal scores
+                scored.append((score, -position))
+        return [(score, self._names[-negated]) for score, negated in heapq.nlargest(k, scored)]
+
+    def best(self, text, threshold=None):
+        """
+        The (score, name) of the name closest to text, if its score is at least threshold, otherwise None.
+        A Chinese name must score above one_character_score(), and no other name may have the same score.
+        An English name must be same_english_member() of text, and score FUZZY_MARGIN above the next
+        name that is
+        """
+        if threshold is None:
+            threshold = self.threshold
+        tokens = _text_tokens(text)
+        grams = fuzzy_grams(tokens)
+        if grams and all(is_ascii(xx) for xx in grams):
+            found = [xx for xx in self.candidates(text, threshold=threshold)
+                     if same_english_member(tokens, xx[1] if isinstance(xx[1], MemberName) else xx[1][0])]
+            if not found or (len(found) > 1 and found[0][0] - found[1][0] < FUZZY_MARGIN):
+                return None
+            return found[0]
+        floor = one_character_score(grams)
+        found = [xx for xx in self.candidates(text, k=2, threshold=threshold) if xx[0] > floor]
+        if not found or (len(found) > 1 and found[0][0] == found[1][0]):
+            return None
+        return found[0]
+
+    def match(self, text, threshold=None):
+        """
+        The name closest to text, see best()
+        """
+        found = self.best(text, threshold)
+        return found[1] if found is not None else None
+
+
+# How resolve_names() found a member
+MATCH_EXACT = 'exact'
+MATCH_FUZZY = 'fuzzy'
+
+
+class NameResolution(namedtuple('NameResolution', 'member method score')):
+    """
+    The member found for a name by resolve_names(), as given to the matchers, with MATCH_EXACT or
+    MATCH_FUZZY and the score of the match.  Unresolved names have no member and no method.
+    """
+    __slots__ = ()
+
+    @property
+    def member_id(self):
+        return getattr(self.member, 'pk', None)
+
+
+UNRESOLVED = NameResolution(None, None, 0.0)
+
+
+def resolve_names(strings, matcher, fuzzy_index=None):
+    """
+    Resolves many names at once, as written in the documents: each distinct string is parsed once and
+    matched with matcher, then with fuzzy_index when given and the matcher fails.
+    Returns a dict of the strings to their NameResolutions
+
+    :param strings: iterable of strings, with repeats
+    :param matcher: NameMatcher of MemberNames or of (MemberName, member) tuples
+    :param fuzzy_index: FuzzyNameIndex of the same names, or None
+    """
+    res = {}
+    for text in strings:
+        if text in res:
+            continue
+        if not text or not text.strip():
+            res[text] = UNRESOLVED
+            continue
+        match = matcher.match(MemberName(text.strip()))
+        if match is not None:
+            res[text] = NameResolution(match if isinstance(match, MemberName) else match[1], MATCH_EXACT, 1.0)
+            continue
+        found = fuzzy_index.best(text) if fuzzy_index is not None else None
+        if found is not None:
+            score, match = found
+            res[text] = NameResolution(match if isinstance(match, MemberName) else match[1], MATCH_FUZZY, score)
+        else:
+            res[text] = UNRESOLVED
+    return res
+
+
+class MatcherRegistry(object):
+    """
+    Keeps the NameMatchers of the members of a model, built once per process with model.build_matcher(english),
+    and their FuzzyNameIndexes, built with model.build_fuzzy_index(english).
+    The matchers are dropped by invalidate(), which the models call when one of their members is saved
+    or deleted, and which increments generation.  Updates that send no signals, like QuerySet.update(),
+    do not drop them, and neither do changes made by other processes.
+    """
+    def __init__(self):
+        self.generation = 0
+        self._matchers = {}
+        self._lock = threading.Lock()
+
+    def get(self, model, english=True, builder='build_matcher'):
+        key = (model, english, builder)
+        with self._lock:
+            if key in self._matchers:
+                return self._matchers[key]
+            generation = self.generation
+        # Built outside of the lock since it queries the database, so it may be built twice
+        matcher = getattr(model, builder)(english)
+        with self._lock:
+            # Do not keep a matcher built from members changed in the meantime
+            if generation == self.generation:
+                self._matchers[key] = matcher
+        return matcher
+
+    def invalidate(self, *args, **kwargs):
+        """
+        Drops all of the matchers, also a receiver of the post_save and post_delete signals
+        """
+        with self._lock:
+            self.generation += 1
+            self._matchers.clear()
+
+
+matchers = MatcherRegistry()
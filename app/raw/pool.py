@@ -0,0 +1,141 @@
+"""
+Running tasks in a pool of processes that survives the death of a worker
+
+A worker that dies (a segfault in lxml or abiword, the OOM killer) breaks a ProcessPoolExecutor.  The futures
+backport of Python 2 does not even notice, and waits for the results of the dead worker forever, so
+run_in_pool() checks that the workers are alive while it waits.  When one died, it replaces the pool, and
+the tasks that were in the pool are run again one at a time, to find the task that kills its worker.
+"""
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, TimeoutError, process, wait
+import logging
+import Queue
+
+logger = logging.getLogger('legcowatch')
+
+# Seconds between the checks that the workers are alive
+POLL_SECONDS = 1
+# Seconds to wait for the thread of a broken pool to stop
+ABANDON_TIMEOUT = 10
+
+try:
+    from concurrent.futures.process import BrokenProcessPool
+except ImportError:
+    class BrokenProcessPool(RuntimeError):
+        pass
+
+
+def dead_worker(executor):
+    """
+    Whether a worker process of the pool died.  The workers only exit when the pool is shut down
+    """
+    return any(pp.exitcode is not None for pp in executor._processes)
+
+
+def _send(queue, obj):
+    """
+    Writes to a multiprocessing queue without its feeder thread.  A worker that dies while writing
+    a result keeps the lock of the queue, and then the feeder thread waits for it forever
+    """
+    # Counted as put() does, get() counts it out
+    queue._sem.acquire()
+    locked = queue._wlock.acquire(True, POLL_SECONDS)
+    try:
+        queue._writer.send(obj)
+    finally:
+        if locked:
+            queue._wlock.release()
+
+
+def abandon(executor):
+    """
+    Stops the workers of a broken pool and its thread.  The thread of the futures backport only stops once
+    the pool has no work left, and the interpreter waits for it on exit
+    """
+    for pp in executor._processes:
+        if pp.is_alive():
+            pp.terminate()
+        pp.join()
+    executor._processes.clear()
+    while True:
+        try:
+            executor._work_ids.get(block=False)
+        except Queue.Empty:
+            break
+    # Their feeder threads may wait for a lock kept by a dead worker, do not wait for them on exit
+    executor._call_queue.cancel_join_thread()
+    executor._result_queue.cancel_join_thread()
+    # The thread takes the results in order, so once it has taken this one, it has taken all of the results
+    # that the workers sent before they stopped
+    marker = Future()
+    work_id = -1
+    executor._pending_work_items[work_id] = process._WorkItem(marker, None, (), {})
+    _send(executor._result_queue, process._ResultItem(work_id, result=None))
+    try:
+        marker.result(timeout=ABANDON_TIMEOUT)
+    except TimeoutError:
+        # The thread is stuck on what a dying worker left in the queue, let the interpreter exit without it
+        process._threads_queues.pop(executor._queue_management_thread, None)
+        return
+    # With no work left, the thread stops when the pool is shut down
+    executor._pending_work_items.clear()
+    executor._shutdown_thread = True
+    _send(executor._result_queue, None)
+    executor._queue_management_thread.join(ABANDON_TIMEOUT)
+
+
+def _run(executor, fn, tasks, suspects, in_flight, window):
+    """
+    Gives the tasks to the pool a window at a time, and the suspects of a crash one at a time.
+    Yields (task, future) as they finish.  Raises BrokenProcessPool when a worker dies, with the tasks
+    it may have been running in in_flight
+    """
+    while tasks or suspects or in_flight:
+        if suspects:
+            if not in_flight:
+                in_flight[executor.submit(fn, *suspects[0])] = suspects[0]
+        else:
+            while tasks and len(in_flight) < window:
+                task = tasks.popleft()
+                in_flight[executor.submit(fn, *task)] = task
+        finished, _ = wait(in_flight, timeout=POLL_SECONDS, return_when=FIRST_COMPLETED)
+        if not finished and dead_worker(executor):
+            raise BrokenProcessPool(u'A worker process died')
+        for future in finished:
+            if isinstance(future.exception(), BrokenProcessPool):
+                raise future.exception()
+            task = in_flight.pop(future)
+            if suspects and suspects[0] == task:
+                suspects.popleft()
+            yield task, future
+
+
+def run_in_pool(fn, tasks, workers, window=None):
+    """
+    Runs fn(*task) for each of the tasks, a tuple of arguments, in a pool of worker processes,
+    giving the pool up to window tasks at a time (twice the number of workers by default).
+    Yields (task, future) as the tasks finish, and (task, None) for a task that killed its worker
+    """
+    tasks = deque(tasks)
+    # The tasks that were in the pool when one of its workers died
+    suspects = deque()
+    window = window or workers * 2
+    while tasks or suspects:
+        executor = ProcessPoolExecutor(max_workers=workers)
+        in_flight = {}
+        try:
+            for res in _run(executor, fn, tasks, suspects, in_flight, window):
+                yield res
+        except BrokenProcessPool:
+            abandon(executor)
+            if len(in_flight) == 1:
+                task = in_flight.values()[0]
+                if suspects and suspects[0] == task:
+                    suspects.popleft()
+                yield task, None
+            else:
+                logger.warn(u'A worker process died, running the {} tasks it may have been running one at a time'.format(
+                    len(in_flight)))
+                suspects.extend(sorted(in_flight.values()))
+        else:
+            executor.shutdown()
@@ -44,6 +44,17 @@ PROCESS_MAP = OrderedDict([
 ])
 
 
+# Spiders whose processors need the output of other processors.  Processors that are not listed
+# here can run at the same time as any other, see raw.processors.runner
+PROCESS_DEPENDENCIES = {
+    'schedule_membership': ('schedule_member', 'schedule_committee'),
+    'schedule_meeting_committee': ('schedule_committee',),
+    'schedule_meeting': ('schedule_meeting_committee',),
+    # Askers are matched against the RawMember names
+    'council_question': ('library_member',),
+}
+
+
 """
 Some scripts for testing
 
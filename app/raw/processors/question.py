@@ -6,7 +6,6 @@ import logging
 from urlparse import urljoin
 import re
 from raw.models import RawCouncilQuestion, LANG_EN, LANG_CN, RawMember
-from raw.names import MemberName
 from raw.processors.base import BaseProcessor, file_wrapper
 from django.utils.timezone import now
 
@@ -27,9 +26,15 @@ class QuestionProcessor(BaseProcessor):
             'source_url': 'crawled_from',
             'subject': 'subject',
         }
-        matcher_en = RawMember.get_matcher()
-        matcher_cn = RawMember.get_matcher(False)
-        for item in file_wrapper(self.items_file_path):
+        items = list(file_wrapper(self.items_file_path))
+        # Resolve the askers of all of the questions at once, by language.  Only the exact matches are kept,
+        # RawCouncilQuestion.fix_asker_by_parser() tries the parser of the question before the fuzzy index
+        askers = {LANG_EN: [], LANG_CN: []}
+        for item in items:
+            askers[self._get_language(item)].append(self._clean_asker(item.get('asker')))
+        resolved = dict((lang, RawMember.resolve_names(names, english=lang == LANG_EN, fuzzy=False))
+                        for lang, names in askers.items())
+        for item in items:
             try:
                 counter += 1
                 # For each question, fill in the raw values, then try to match against a RawMember instance
@@ -64,35 +69,14 @@ class QuestionProcessor(BaseProcessor):
                 # Convert the language from the string to the constants
                 lang = LANG_CN if item['language'] == u'C' else LANG_EN
                 obj.language = lang
-                if lang == LANG_CN:
-                    matcher = matcher_cn
-                else:
-                    matcher = matcher_en
 
-                # Try to find the RawMember object that matches the asker
-                # There will still be some askers not matched - we will use parser to fix them soon
-                raw_name = item['asker']
-                # Some postprocessing
-                # Get rid of 'Hon', '議員' and ''
-                raw_name = raw_name.replace(u'Hon',u'')
-                raw_name = raw_name.replace(u'議員',u'')
-                
-                # Get rid of heading and tailing spaces
-                if raw_name[0]==u' ':
-                    raw_name = raw_name[1:]
-                if raw_name[-1]==u' ':
-                    raw_name = raw_name[:-1]
-                
-                # Try to match the name with RawMember
-                name = MemberName(raw_name)
-                match = matcher.match(name)
-                if match is not None:
-                    member = match[1]
-                    obj.asker = member
-                else:
-                    pass
-                    #logger.warn(u'Cannot match asker "{}" with members in database'.format(raw_name))
-                    
+                # The RawMember object that matches the asker exactly
+                # There will still be some askers not matched - we will use parser to fix them soon,
+                # then the names that are misspelled
+                resolution = resolved[lang][self._clean_asker(item['asker'])]
+                if resolution.member is not None:
+                    obj.asker = resolution.member
+
                 # Get the local path of reply content
                 try:
                     obj.local_filename = item['files'][0]['path']
@@ -118,6 +102,17 @@ class QuestionProcessor(BaseProcessor):
         #for debugging
         print(no_asker_list)
         
+    def _get_language(self, item):
+        return LANG_CN if item.get('language') == u'C' else LANG_EN
+
+    def _clean_asker(self, raw_name):
+        """
+        The name of the asker without 'Hon', '議員' and the spaces around it
+        """
+        if raw_name is None:
+            return u''
+        return raw_name.replace(u'Hon', u'').replace(u'議員', u'').strip()
+
     def _generate_uid(self, item):
         """
         UIDs for questions are of the form 'question-09.10.2013-1-e' (question-<date>-<number>-<lang>)
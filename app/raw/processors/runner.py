@@ -0,0 +1,270 @@
+"""
+Runs the processors in PROCESS_MAP in parallel, respecting PROCESS_DEPENDENCIES
+
+Processors that do not depend on each other are run at the same time in a pool of processes,
+so the time taken to process all of the scrapes is that of the slowest chain of processors
+rather than the sum of all of them.  With one worker, they are run one after another in this process.
+"""
+from concurrent.futures import Future, ProcessPoolExecutor, FIRST_COMPLETED, wait
+from datetime import datetime
+import logging
+import time
+import traceback
+from django.conf import settings
+from django.db import connections
+from django.db.backends import BaseDatabaseWrapper
+from django.db.backends.util import CursorWrapper
+from raw.models import ScrapeJob
+from raw.processors import PROCESS_MAP, PROCESS_DEPENDENCIES, get_processor_for_spider
+
+
+logger = logging.getLogger('legcowatch')
+
+
+def run_processor(spider_name):
+    """
+    Process the results of the latest complete scrape for a spider.
+    Returns the ScrapeJob that was processed, or None if there was no job
+    """
+    try:
+        job = ScrapeJob.objects.latest_complete_job(spider_name)
+    except ScrapeJob.DoesNotExist:
+        logger.warn("No jobs found for spider {}".format(spider_name))
+        return None
+
+    items_file = job.raw_response  # a jsonl file in ./scrapes
+
+    # Disable SQL logging
+    if settings.DEBUG:
+        original = BaseDatabaseWrapper.make_debug_cursor
+        BaseDatabaseWrapper.make_debug_cursor = lambda self, cursor: CursorWrapper(cursor, self)
+
+    # Get the processor and run it
+    processor = get_processor_for_spider(spider_name)
+    logger.info('Processing file {} from ScrapeJob {}'.format(items_file, job.id))
+    try:
+        processor(items_file, job).process()
+    finally:
+        if settings.DEBUG:
+            BaseDatabaseWrapper.make_debug_cursor = original
+
+    # Log that the job was processed just now
+    job.last_fetched = datetime.now()
+    job.save()
+    return job
+
+
+def _close_connections():
+    # Connections must not be shared between forked processes, each process opens its own
+    for conn in connections.all():
+        conn.close()
+
+
+def _run_timed(spider_name):
+    """
+    Returns the time taken and the formatted exception, if any, formatted here where the traceback
+    is still available
+    """
+    start = time.time()
+    try:
+        run_processor(spider_name)
+    except Exception:
+        return time.time() - start, traceback.format_exc()
+    return time.time() - start, None
+
+
+def _run_in_worker(spider_name):
+    # Entry point in the worker processes
+    _close_connections()
+    try:
+        return _run_timed(spider_name)
+    finally:
+        _close_connections()
+
+
+class InlineExecutor(object):
+    """
+    Runs the submitted calls right away in this process, for when there is one worker
+    """
+    def submit(self, fn, *args):
+        future = Future()
+        try:
+            future.set_result(fn(*args))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def shutdown(self, wait=True):
+        pass
+
+
+def check_dependencies(spiders, dependencies=None):
+    """
+    Checks that every dependency is a known spider and that there are no cycles
+    """
+    dependencies = PROCESS_DEPENDENCIES if dependencies is None else dependencies
+    for spider in spiders:
+        for dep in dependencies.get(spider, ()):
+            if dep not in PROCESS_MAP:
+                raise RuntimeError("Invalid dependency {} of spider {}".format(dep, spider))
+    visiting, done = set(), set()
+
+    def visit(spider, path):
+        if spider in done:
+            return
+        if spider in visiting:
+            raise RuntimeError("Dependency cycle: {}".format(' -> '.join(path + [spider])))
+        visiting.add(spider)
+        for dep in dependencies.get(spider, ()):
+            visit(dep, path + [spider])
+        visiting.discard(spider)
+        done.add(spider)
+
+    for spider in spiders:
+        visit(spider, [])
+
+
+def processor_stages(spiders=None, dependencies=None):
+    """
+    Splits the spiders into stages whose processors can run at the same time, each processor coming in
+    a stage after those of the processors it depends on.
+    Returns a list of lists of spider names, in PROCESS_MAP order
+    """
+    spiders = list(spiders) if spiders is not None else list(PROCESS_MAP.keys())
+    dependencies = PROCESS_DEPENDENCIES if dependencies is None else dependencies
+    check_dependencies(spiders, dependencies)
+    levels = {}
+
+    def level(spider):
+        if spider not in levels:
+            # Dependencies that are not part of this run are assumed to be up to date
+            deps = [dd for dd in dependencies.get(spider, ()) if dd in spiders]
+            levels[spider] = 1 + max(level(dd) for dd in deps) if deps else 0
+        return levels[spider]
+
+    stages = [[] for _ in range(max(level(ss) for ss in spiders) + 1)] if spiders else []
+    for spider in spiders:
+        stages[level(spider)].append(spider)
+    return stages
+
+
+def critical_path(timings, dependencies=None):
+    """
+    Given a dict of spider name to seconds taken, returns the chain of processors with the largest
+    total time as a tuple of (list of spider names, total seconds)
+    """
+    dependencies = PROCESS_DEPENDENCIES if dependencies is None else dependencies
+    finish = {}
+    previous = {}
+
+    def finish_time(spider):
+        if spider not in finish:
+            deps = [dd for dd in dependencies.get(spider, ()) if dd in timings]
+            before = max(deps, key=finish_time) if deps else None
+            previous[spider] = before
+            finish[spider] = timings[spider] + (finish_time(before) if before is not None else 0.0)
+        return finish[spider]
+
+    if not timings:
+        return [], 0.0
+    last = max(timings, key=finish_time)
+    path = []
+    spider = last
+    while spider is not None:
+        path.append(spider)
+        spider = previous[spider]
+    path.reverse()
+    return path, finish[last]
+
+
+class RunReport(object):
+    """
+    Outcome of a ProcessRunner run
+    """
+    def __init__(self, dependencies=None):
+        self.dependencies = dependencies
+        self.timings = {}
+        self.errors = {}
+        self.skipped = []
+        self.wall_time = 0.0
+
+    @property
+    def critical_path(self):
+        return critical_path(self.timings, self.dependencies)
+
+    def summary(self):
+        lines = []
+        for spider, seconds in sorted(self.timings.items(), key=lambda xx: -xx[1]):
+            status = 'FAILED' if spider in self.errors else 'ok'
+            lines.append(u'{:<30} {:>9.1f}s  {}'.format(spider, seconds, status))
+        for spider in self.skipped:
+            lines.append(u'{:<30} {:>10}  skipped, a dependency failed'.format(spider, '-'))
+        path, path_time = self.critical_path
+        serial_time = sum(self.timings.values())
+        lines.append(u'Critical path: {} ({:.1f}s)'.format(u' -> '.join(path), path_time))
+        lines.append(u'Wall time {:.1f}s, {:.1f}s if run one after another'.format(self.wall_time, serial_time))
+        return u'\n'.join(lines)
+
+
+class ProcessRunner(object):
+    """
+    Runs the processors for a list of spiders, starting each one as soon as the processors it
+    depends on have finished.  If a processor fails, the processors that depend on it are skipped.
+    """
+    def __init__(self, spiders=None, workers=4, dependencies=None):
+        self.spiders = list(spiders) if spiders is not None else list(PROCESS_MAP.keys())
+        for spider in self.spiders:
+            # Raises for invalid spiders
+            get_processor_for_spider(spider)
+        self.workers = workers
+        self.dependencies = PROCESS_DEPENDENCIES if dependencies is None else dependencies
+        check_dependencies(self.spiders, self.dependencies)
+
+    def _pending_dependencies(self, spider):
+        # Dependencies that are not part of this run are assumed to be up to date
+        return set(dd for dd in self.dependencies.get(spider, ()) if dd in self.spiders)
+
+    def run(self):
+        report = RunReport(self.dependencies)
+        waiting = dict((spider, self._pending_dependencies(spider)) for spider in self.spiders)
+        running = {}
+        start = time.time()
+        if self.workers > 1:
+            _close_connections()
+            executor = ProcessPoolExecutor(max_workers=self.workers)
+            run_one = _run_in_worker
+        else:
+            executor = InlineExecutor()
+            run_one = _run_timed
+        try:
+            while waiting or running:
+                # Keep the PROCESS_MAP order when starting processors that are ready
+                for spider in [ss for ss in self.spiders if ss in waiting and not waiting[ss]]:
+                    del waiting[spider]
+                    logger.info('Starting processor for {}'.format(spider))
+                    running[executor.submit(run_one, spider)] = spider
+                if not running:
+                    # Everything left depends on a processor that failed
+                    report.skipped.extend(ss for ss in self.spiders if ss in waiting)
+                    break
+                done, _ = wait(running.keys(), return_when=FIRST_COMPLETED)
+                for future in done:
+                    spider = running.pop(future)
+                    try:
+                        seconds, error = future.result()
+                    except Exception:
+                        # The worker process itself died
+                        seconds, error = 0.0, traceback.format_exc()
+                    report.timings[spider] = seconds
+                    if error is not None:
+                        logger.error(u'Processor for {} failed:\n{}'.format(spider, error))
+                        report.errors[spider] = error
+                        continue
+                    logger.info('Processor for {} finished in {:.1f}s'.format(spider, seconds))
+                    for deps in waiting.values():
+                        deps.discard(spider)
+        finally:
+            executor.shutdown(wait=True)
+        report.wall_time = time.time() - start
+        logger.info(report.summary())
+        return report
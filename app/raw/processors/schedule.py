@@ -1,8 +1,11 @@
+from collections import OrderedDict
 from datetime import datetime
+from django.db import transaction
 from django.utils import timezone
 import logging
 import warnings
 
+from raw.bulk import LAST_OF_DUPLICATES, NONE_FOR_DUPLICATES, bulk_update, chunked, concrete_fields, index_by_uid, snapshot
 from raw.models import RawScheduleMember, RawCommittee, RawCommitteeMembership, RawMeetingCommittee, RawMeeting
 from raw.processors.base import BaseProcessor, file_wrapper
 
@@ -13,42 +16,105 @@ logger = logging.getLogger('legcowatch')
 class BaseScheduleProcessor(BaseProcessor):
     # Doing some refactoring, but don't want to affect other processors
     model = None
+    # Number of items that are read, looked up and written in one transaction
+    batch_size = 500
 
     def process(self, *args, **kwargs):
         logger.info("Processing file {}".format(self.items_file_path))
         counter = 0
-        for item in file_wrapper(self.items_file_path):
-            counter += 1
-            self._process_item_wrapper(item)
+        for items in chunked(file_wrapper(self.items_file_path), self.batch_size):
+            counter += len(items)
+            self._process_chunk(items)
         logger.info("{} items processed, {} created, {} updated, {} errors".format(counter, self._count_created, self._count_updated, self._count_error))
 
     def _process_item(self, item, obj):
+        """
+        Sets the fields of obj from item.  Saving is done by _process_chunk
+        """
         raise NotImplementedError()
 
-    def _process_item_wrapper(self, item):
-        uid = self._generate_uid(item)
-        obj = self._get_object(uid)
-        if obj is None:
-            logger.warn(u'Could not process member item: {}'.format(item))
-            self._count_error += 1
-            return
-        obj.last_parsed = datetime.now()
-        if self.job is not None:
-            obj.last_crawled = self.job.completed
-        self._process_item(item, obj)
-
-    def _get_object(self, uid):
-        try:
-            obj = self.model.objects.get(uid=uid)
-            self._count_updated += 1
-        except self.model.DoesNotExist:
+    def _prefetch(self, items):
+        """
+        Hook for subclasses to load the related objects needed by a chunk of items
+        """
+        pass
+
+    def _process_chunk(self, items):
+        uids = [self._generate_uid(item) for item in items]
+        # A uid that matches more than one object maps to None
+        existing = index_by_uid(self.model, uids, NONE_FOR_DUPLICATES)
+        self._prefetch(items)
+        now = datetime.now()
+
+        objs = OrderedDict()
+        snapshots = {}
+        with transaction.atomic():
+            for uid, item in zip(uids, items):
+                if uid in objs:
+                    # The same uid can appear more than once in a feed, eg. meeting slots.
+                    # The first one would already have been saved when processing item by item
+                    obj = objs[uid]
+                    self._count_updated += 1
+                else:
+                    obj = self._get_object(uid, existing)
+                    if obj is None:
+                        logger.warn(u'Could not process member item: {}'.format(item))
+                        self._count_error += 1
+                        continue
+                    if obj.pk is not None:
+                        snapshots[uid] = snapshot(obj, self._tracked_fields())
+                    objs[uid] = obj
+                obj.last_parsed = now
+                if self.job is not None:
+                    obj.last_crawled = self.job.completed
+                self._process_item(item, obj)
+            self._save_objects(objs, snapshots, now)
+            self._after_save(objs)
+
+    def _after_save(self, objs):
+        """
+        Hook for subclasses that need to write relations once the objects of a chunk are saved
+        """
+        pass
+
+    def _get_object(self, uid, existing):
+        if uid not in existing:
             obj = self.model(uid=uid)
             self._count_created += 1
-        except self.model.MultipleObjectsReturned:
+        elif existing[uid] is None:
             warnings.warn("Found more than one item with raw id {}".format(uid), RuntimeWarning)
             obj = None
+        else:
+            obj = existing[uid]
+            self._count_updated += 1
         return obj
 
+    def _tracked_fields(self):
+        # Fields that count as a change to the object, the timestamps are always touched
+        return concrete_fields(self.model, exclude=('last_parsed', 'last_crawled'))
+
+    def _save_objects(self, objs, snapshots, now):
+        new_objs = []
+        changed = []
+        unchanged = []
+        for uid, obj in objs.items():
+            if obj.pk is None:
+                new_objs.append(obj)
+            elif snapshot(obj, self._tracked_fields()) != snapshots[uid]:
+                changed.append(obj)
+            else:
+                unchanged.append(obj.pk)
+        if new_objs:
+            self.model.objects.bulk_create(new_objs)
+        if changed:
+            bulk_update(changed, concrete_fields(self.model))
+        if unchanged:
+            timestamps = {'last_parsed': now}
+            if self.job is not None:
+                timestamps['last_crawled'] = self.job.completed
+            for pks in chunked(unchanged, 500):
+                self.model.objects.filter(pk__in=pks).update(**timestamps)
+
     def _generate_uid(self, item):
         raise NotImplementedError()
 
@@ -63,7 +129,6 @@ class ScheduleMemberProcessor(BaseScheduleProcessor):
         fields = ['last_name_c', 'first_name_c', 'last_name_e', 'first_name_e', 'english_name']
         for f in fields:
             setattr(obj, f, item.get(f, None))
-        obj.save()
 
     def _generate_uid(self, item):
         return 'smember-{}'.format(item['id'])
@@ -76,7 +141,6 @@ class ScheduleCommitteeProcessor(BaseScheduleProcessor):
         fields = ['code', 'name_e', 'name_c', 'url_e', 'url_c']
         for f in fields:
             setattr(obj, f, item.get(f, None))
-        obj.save()
 
     def _generate_uid(self, item):
         return '{}-{}'.format(RawCommittee.UID_PREFIX, item['id'])
@@ -85,18 +149,19 @@ class ScheduleCommitteeProcessor(BaseScheduleProcessor):
 class ScheduleMeetingCommitteeProcessor(BaseScheduleProcessor):
     model = RawMeetingCommittee
 
+    def _prefetch(self, items):
+        cuids = ['committee-{}'.format(int(item['committee_id'])) for item in items]
+        self._committees = index_by_uid(RawCommittee, cuids, LAST_OF_DUPLICATES)
+
     def _process_item(self, item, obj):
         obj.slot_id = int(item['slot_id'])
         cid = int(item['committee_id'])
         obj._committee_id = cid
-        try:
-            cuid = 'committee-{}'.format(cid)
-            committee = RawCommittee.objects.get(uid=cuid)
-        except RawCommittee.DoesNotExist:
+        cuid = 'committee-{}'.format(cid)
+        committee = self._committees.get(cuid)
+        if committee is None:
             logger.warn('Could not find committee {}'.format(cuid))
-            committee = None
         obj.committee = committee
-        obj.save()
 
     def _generate_uid(self, item):
         return 'meeting_committee-{}'.format(item['id'])
@@ -105,6 +170,12 @@ class ScheduleMeetingCommitteeProcessor(BaseScheduleProcessor):
 class ScheduleMembershipProcessor(BaseScheduleProcessor):
     model = RawCommitteeMembership
 
+    def _prefetch(self, items):
+        muids = ['{}-{}'.format(RawScheduleMember.UID_PREFIX, int(item['member_id'])) for item in items]
+        self._members = index_by_uid(RawScheduleMember, muids, LAST_OF_DUPLICATES)
+        cuids = ['{}-{}'.format(RawCommittee.UID_PREFIX, int(item['committee_id'])) for item in items]
+        self._committees = index_by_uid(RawCommittee, cuids, LAST_OF_DUPLICATES)
+
     def _process_item(self, item, obj):
         fields = ['post_e', 'post_c']
         for f in fields:
@@ -126,27 +197,22 @@ class ScheduleMembershipProcessor(BaseScheduleProcessor):
         # Try to find the member and committee objects
         mid = int(item['member_id'])
         obj._member_id = mid
-        try:
-            muid = '{}-{}'.format(RawScheduleMember.UID_PREFIX, mid)
-            member = RawScheduleMember.objects.get(uid=muid)
-        except RawScheduleMember.DoesNotExist:
+        muid = '{}-{}'.format(RawScheduleMember.UID_PREFIX, mid)
+        member = self._members.get(muid)
+        if member is None:
             logger.warn('Could not find member {}'.format(muid))
-            member = None
         obj.member = member
 
         cid = int(item['committee_id'])
         obj._committee_id = cid
-        try:
-            cuid = '{}-{}'.format(RawCommittee.UID_PREFIX, cid)
-            committee = RawCommittee.objects.get(uid=cuid)
-        except RawCommittee.DoesNotExist:
+        cuid = '{}-{}'.format(RawCommittee.UID_PREFIX, cid)
+        committee = self._committees.get(cuid)
+        if committee is None:
             # Seems like there are actually a large number
             # of committees that are referenced in the Membership table
             # but are not in the Committee table
             logger.warn('Could not find committee {}'.format(cuid))
-            committee = None
         obj.committee = committee
-        obj.save()
 
     def _generate_uid(self, item):
         return '{}-{}'.format(RawCommitteeMembership.UID_PREFIX, item['id'])
@@ -155,6 +221,15 @@ class ScheduleMembershipProcessor(BaseScheduleProcessor):
 class ScheduleMeetingProcessor(BaseScheduleProcessor):
     model = RawMeeting
 
+    def _prefetch(self, items):
+        # Lookup the committees from the RawMeetingCommittee table
+        slots = set(int(item['slot_id']) for item in items)
+        self._slot_committees = {}
+        for batch in chunked(slots, 500):
+            rows = RawMeetingCommittee.objects.filter(slot_id__in=batch).values_list('slot_id', 'committee_id')
+            for slot, committee_id in rows:
+                self._slot_committees.setdefault(slot, []).append(committee_id)
+
     def _process_item(self, item, obj):
         fields = [
             'subject_e', 'subject_c', 'agenda_url_e', 'agenda_url_c', 'venue_code',
@@ -174,24 +249,34 @@ class ScheduleMeetingProcessor(BaseScheduleProcessor):
         obj.meeting_id = item['id']
         slot = int(item['slot_id'])
         obj.slot_id = slot
-        # Lookup the committee from the RawMeetingCommittee table
-        mtg_cmt = RawMeetingCommittee.objects.filter(slot_id=slot)
-        logger.info('mtg_cmt = {}'.format(mtg_cmt))
-        if len(mtg_cmt) == 0:
+        committee_ids = self._slot_committees.get(slot)
+        if not committee_ids:
             logger.warn('No committees for slot {}'.format(slot))
-            mtg_cmt = None
-            obj.save()
-        if mtg_cmt is not None:
-            #obj.committees.add([xx.committee for xx in mtg_cmt])
-        #obj.save()
-            """Modified - lpounng"""
-            # need to create an object first before filling in a Many-to-Many Relation.
-            obj.save()
-            for xx in mtg_cmt:
-                obj = RawMeeting.objects.get_by_uid(obj.uid)
-                obj.committees.add(xx.committee)
-            """End modified"""
-        
+            return
+        # The committees can only be added once the meeting is saved, see _after_save
+        if not hasattr(obj, '_committee_ids'):
+            obj._committee_ids = set()
+        obj._committee_ids.update(cid for cid in committee_ids if cid is not None)
+
+    def _after_save(self, objs):
+        # bulk_create does not set the primary keys of new objects
+        new_uids = [uid for uid, obj in objs.items() if obj.pk is None]
+        for batch in chunked(new_uids, 500):
+            for uid, pk in RawMeeting.objects.filter(uid__in=batch).values_list('uid', 'pk'):
+                objs[uid].pk = pk
+
+        through = RawMeeting.committees.through
+        wanted = set()
+        for obj in objs.values():
+            for cid in getattr(obj, '_committee_ids', ()):
+                wanted.add((obj.pk, cid))
+        if not wanted:
+            return
+        meeting_ids = set(mid for mid, cid in wanted)
+        for batch in chunked(meeting_ids, 500):
+            existing = through.objects.filter(rawmeeting_id__in=batch).values_list('rawmeeting_id', 'rawcommittee_id')
+            wanted.difference_update(existing)
+        through.objects.bulk_create([through(rawmeeting_id=mid, rawcommittee_id=cid) for mid, cid in sorted(wanted)])
 
     def _generate_uid(self, item):
         return '{}-{}'.format(RawMeeting.UID_PREFIX,item['id'])
@@ -1,17 +1,15 @@
 from __future__ import absolute_import
 from datetime import datetime, timedelta
 import logging
-from celery import shared_task
+import multiprocessing
+from celery import chord, group, shared_task
 from twisted.internet import reactor
 from scrapy.crawler import Crawler
 from scrapy import log, signals
 from scrapy.utils.project import get_project_settings
 import os
-from raw import processors
+from raw.processors import runner
 from raw.models import ScrapeJob
-from django.conf import settings
-from django.db.backends import BaseDatabaseWrapper
-from django.db.backends.util import CursorWrapper
 
 logger = logging.getLogger('legcowatch')
 
@@ -115,28 +113,40 @@ def process_scrape(spider_name):
     :param spider_name: str name of the spider that produced the results
     :return:
     """
-    try:
-        job = ScrapeJob.objects.latest_complete_job(spider_name)
-    except ScrapeJob.DoesNotExist:
-        logger.warn("No jobs found for spider {}".format(spider_name))
-        return
-
-    items_file = job.raw_response # a jsonl file in ./scrapes
+    runner.run_processor(spider_name)
 
-    # Disable SQL logging
-    if settings.DEBUG:
-        original = BaseDatabaseWrapper.make_debug_cursor
-        BaseDatabaseWrapper.make_debug_cursor = lambda self, cursor: CursorWrapper(cursor, self)
 
-    # Get the processor and run it
-    processor = processors.get_processor_for_spider(spider_name)
-    logger.info('Processing file {} from ScrapeJob {}'.format(items_file, job.id))
-    processor(items_file, job).process()
+@shared_task
+def process_stages(stages):
+    """
+    Dispatches the processors of the first stage as separate tasks, and the next stages once they have finished.
+    If a processor fails, the next stages are not run
+    :param stages: list of lists of spider names, from runner.processor_stages
+    :return:
+    """
+    if not stages:
+        return
+    header = [process_scrape.si(spider) for spider in stages[0]]
+    if len(stages) > 1:
+        chord(header)(process_stages.si(stages[1:]))
+    else:
+        group(header).apply_async()
 
-    if settings.DEBUG:
-        BaseDatabaseWrapper.make_debug_cursor = original
 
-    # Log that the job was processed just now
-    job.last_fetched = datetime.now()
-    job.save()
-    return
+@shared_task
+def process_all_scrapes(workers=4):
+    """
+    Process the results of the latest scrapes of all spiders, running the processors that do not
+    depend on each other in parallel
+    :param workers: int number of processes to use
+    :return: dict of spider name to seconds taken, or None when the processors were dispatched as tasks
+    """
+    if multiprocessing.current_process().daemon:
+        # The workers of celery's prefork pool are daemonic, and cannot start processes of their own.
+        # Give the processors to the celery workers instead, a stage of independent processors at a time
+        stages = runner.processor_stages()
+        logger.info('Dispatching the processors as tasks in {} stages'.format(len(stages)))
+        process_stages(stages)
+        return None
+    report = runner.ProcessRunner(workers=workers).run()
+    return report.timings
@@ -5,6 +5,7 @@
 
 from django.test import TestCase
 import logging
+from lxml import etree
 from raw.docs import agenda
 
 # We use fixtures which are raw HTML versions of the agendas to test the parser
@@ -129,6 +130,23 @@ class Agenda20130508TestCase(TestCase):
         self.assertEqual(foo.attendees, [u'Secretary for Transport and Housing'])
         self.assertEqual(foo.amendments, [])
 
+    def test_detach(self):
+        questions = [(xx.number, xx.asker, xx.replier, xx.type, xx.body) for xx in self.parser.questions]
+        bills = [(xx.title, xx.reading, xx.pretty_reading) for xx in self.parser.bills]
+        motions = [etree.tounicode(xx, method='html', with_tail=False) for xx in self.parser.motions]
+        self.assertIs(self.parser.detach(), self.parser)
+        self.assertIsNone(self.parser.tree)
+        self.assertIsNone(self.parser.source)
+        self.assertIsInstance(self.parser.tabled_papers[2], agenda.TabledLegislationRecord)
+        self.assertEqual(self.parser.tabled_papers[2].number, u'64/2013')
+        self.assertEqual(self.parser.tabled_papers[8].presenter, u'Secretary for Education')
+        self.assertEqual([tuple(xx) for xx in self.parser.questions], questions)
+        self.assertIn(type(self.parser.questions[0].asker), (str, unicode))
+        self.assertIs(self.parser.question_map['1'], self.parser.questions[0])
+        self.assertEqual([(xx.title, xx.reading, xx.pretty_reading) for xx in self.parser.bills], bills)
+        # The sections that are not parsed are kept as html
+        self.assertEqual(self.parser.motions, motions)
+
 
 class Agenda20140430TestCase(TestCase):
     def setUp(self):
@@ -0,0 +1,37 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Tests for looking up objects by uid in batches
+
+import logging
+from django.test import TestCase
+from raw import bulk
+from raw.models import RawCouncilQuestion
+
+
+logging.disable(logging.CRITICAL)
+
+
+class IndexByUidTestCase(TestCase):
+    def setUp(self):
+        self.first = RawCouncilQuestion.objects.create(uid=u'question-1', raw_date=u'30.4.2014')
+        self.shared = [RawCouncilQuestion.objects.create(uid=u'question-2', raw_date=u'30.4.2014') for i in range(2)]
+        self.last = RawCouncilQuestion.objects.create(uid=u'question-3', raw_date=u'7.5.2014')
+
+    def test_duplicates(self):
+        found = set()
+        self.assertEqual(bulk.index_by_uid(RawCouncilQuestion, found=found),
+                         {u'question-1': self.first, u'question-3': self.last})
+        self.assertEqual(found, set([u'question-2']))
+        self.assertEqual(bulk.index_by_uid(RawCouncilQuestion, [u'question-1', u'question-2'], bulk.NONE_FOR_DUPLICATES),
+                         {u'question-1': self.first, u'question-2': None})
+        index = bulk.index_by_uid(RawCouncilQuestion.objects.order_by('pk'), [u'question-2'], bulk.LAST_OF_DUPLICATES)
+        self.assertEqual(index[u'question-2'].pk, self.shared[1].pk)
+
+    def test_batches(self):
+        # The duplicates are found across batches, and the uids can be looked up by another field
+        uids = [u'question-{}'.format(i) for i in range(1000)]
+        self.assertEqual(sorted(bulk.index_by_uid(RawCouncilQuestion, uids)), [u'question-1', u'question-3'])
+        index = bulk.index_by_uid(RawCouncilQuestion, [u'7.5.2014', u'30.4.2014'], lookup='raw_date')
+        self.assertEqual(sorted(index), [u'question-1', u'question-3'])
+        self.assertEqual(bulk.index_by_uid(RawCouncilQuestion, []), {})
@@ -0,0 +1,173 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Tests for the cache of converted documents
+
+import logging
+import os
+import shutil
+import signal
+import tempfile
+import time
+from django.test import SimpleTestCase
+from raw import conversion
+
+
+logging.disable(logging.CRITICAL)
+
+
+class FakeConverter(conversion.Converter):
+    name = 'fake'
+
+    def __init__(self, version='1'):
+        super(FakeConverter, self).__init__()
+        self._version = version
+        self.calls = 0
+
+    def convert(self, filepath, timeout=None):
+        self.calls += 1
+        with open(filepath, 'rb') as f:
+            return u'<p>{}</p>'.format(f.read().decode('utf-8'))
+
+
+class CommandConverter(conversion.AbiwordConverter):
+    """
+    Runs another command than abiword
+    """
+    def __init__(self, cmd):
+        super(CommandConverter, self).__init__()
+        self.cmd = cmd
+
+    def command(self, filepath):
+        return self.cmd
+
+
+class SlowPyDocX(object):
+    @staticmethod
+    def to_html(filepath):
+        time.sleep(5)
+        return u'<p>Agenda</p>'
+
+
+class TimeoutTestCase(SimpleTestCase):
+    def test_abiword_killed(self):
+        start = time.time()
+        with self.assertRaises(conversion.ConversionTimeout):
+            CommandConverter(['sleep', '5']).convert('agenda.doc', timeout=0.2)
+        self.assertLess(time.time() - start, 4)
+
+    def test_abiword_in_time(self):
+        self.assertEqual(CommandConverter(['echo', 'Agenda']).convert('agenda.doc', timeout=5), u'Agenda\n')
+        # A failed command is not a timeout
+        self.assertIsNone(CommandConverter(['false']).convert('agenda.doc', timeout=5))
+        self.assertIsNone(CommandConverter(['no-such-abiword']).convert('agenda.doc', timeout=5))
+
+    def test_pydocx_interrupted(self):
+        previous = conversion.pydocx
+        conversion.pydocx = type('FakePyDocX', (object,), {'PyDocX': SlowPyDocX})
+        try:
+            start = time.time()
+            with self.assertRaises(conversion.ConversionTimeout):
+                conversion.PYDOCX.convert('agenda.docx', timeout=1)
+            self.assertLess(time.time() - start, 4)
+            # The alarm was cleared
+            self.assertEqual(signal.alarm(0), 0)
+        finally:
+            conversion.pydocx = previous
+
+
+class ConversionCacheTestCase(SimpleTestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.cache = conversion.ConversionCache(os.path.join(self.path, 'cache'), max_size=None)
+        self.converter = FakeConverter()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def _document(self, name, text):
+        filepath = os.path.join(self.path, name)
+        with open(filepath, 'wb') as f:
+            f.write(text.encode('utf-8'))
+        return filepath
+
+    def _put(self, digest, mtime, size=100):
+        # Random bytes do not compress, so the entries take about size bytes
+        self.cache.put(self.converter, digest, os.urandom(size).encode('hex'))
+        path = self.cache.entry_path(self.converter, digest)
+        os.utime(path, (mtime, mtime))
+        return path
+
+    def test_hit_and_miss(self):
+        filepath = self._document('a.doc', u'議程')
+        self.assertEqual(self.cache.convert(self.converter, filepath), u'<p>議程</p>')
+        self.assertEqual(self.cache.convert(self.converter, filepath), u'<p>議程</p>')
+        self.assertEqual((self.cache.hits, self.cache.misses, self.converter.calls), (1, 1, 1))
+        # Files with the same contents share their entry
+        self.assertEqual(self.cache.convert(self.converter, self._document('b.doc', u'議程')), u'<p>議程</p>')
+        self.assertEqual(self.converter.calls, 1)
+        self.assertIsNone(self.cache.get(self.converter, conversion.file_digest(self._document('c.doc', u'Agenda'))))
+
+    def test_converter_version(self):
+        filepath = self._document('a.doc', u'Agenda')
+        digest = conversion.file_digest(filepath)
+        self.cache.convert(self.converter, filepath)
+        upgraded = FakeConverter('2')
+        self.assertNotEqual(self.cache.entry_path(upgraded, digest), self.cache.entry_path(self.converter, digest))
+        self.assertFalse(self.cache.contains(upgraded, digest))
+        self.cache.convert(upgraded, filepath)
+        self.assertEqual(upgraded.calls, 1)
+        self.assertTrue(self.cache.contains(self.converter, digest))
+
+    def test_overwrite_size(self):
+        self.cache.size()
+        for i in range(3):
+            self._put('a' * 40, 1000)
+        self.assertEqual(self.cache.size(), os.path.getsize(self.cache.entry_path(self.converter, 'a' * 40)))
+
+    def test_lru_eviction(self):
+        paths = [self._put(digest * 40, mtime) for digest, mtime in (('a', 1000), ('b', 2000), ('c', 3000))]
+        # Reading an entry makes it the most recently used
+        self.cache.get(self.converter, 'a' * 40)
+        # Room for a and d, once brought down to the low water mark
+        self.cache.max_size = int((2 * os.path.getsize(paths[0]) + 50) / conversion.EVICTION_LOW_WATER)
+        self.cache._size = None
+        self._put('d' * 40, 4000)
+        self.assertEqual([os.path.exists(xx) for xx in paths], [True, False, False])
+        self.assertTrue(self.cache.contains(self.converter, 'd' * 40))
+        self.assertLessEqual(self.cache.size(), self.cache.max_size * conversion.EVICTION_LOW_WATER)
+
+    def test_eviction_low_water(self):
+        paths = [self._put(digest * 40, 1000 * (i + 1)) for i, digest in enumerate('abcdefghijklmnopqrst')]
+        self.cache.max_size = sum(os.path.getsize(xx) for xx in paths)
+        self.cache._size = None
+        evictions = []
+        evict = self.cache.evict
+        self.cache.evict = lambda max_size=None: evictions.append(max_size) or evict(max_size)
+        self._put('u' * 40, 21000)
+        self.assertEqual(evictions, [int(self.cache.max_size * conversion.EVICTION_LOW_WATER)])
+        # The next entry fits in the room made by the eviction
+        self._put('v' * 40, 22000)
+        self.assertEqual(len(evictions), 1)
+        self.assertFalse(os.path.exists(paths[0]))
+
+    def test_prune_clear_stats(self):
+        self._put('a' * 40, 1000)
+        self._put('b' * 40, 2000)
+        self.cache.put(conversion.PYDOCX, 'c' * 40, u'<p>Agenda</p>')
+        stats = self.cache.stats()
+        self.assertEqual(stats['entries'], 3)
+        self.assertEqual(stats['oldest'], 1000)
+        self.assertEqual(stats['converters'][self.converter.identity]['entries'], 2)
+        self.assertTrue(stats['converters'][self.converter.identity]['stale'])
+        self.assertFalse(stats['converters'][conversion.PYDOCX.identity]['stale'])
+        self.assertEqual(stats['size'], self.cache.size())
+
+        # The converters that are not installed are pruned
+        self.assertEqual(self.cache.prune(), [self.converter.identity])
+        self.assertEqual(self.cache.stats()['entries'], 1)
+        self.assertTrue(self.cache.contains(conversion.PYDOCX, 'c' * 40))
+
+        self.cache.clear()
+        self.assertEqual(self.cache.stats()['entries'], 0)
+        self.assertEqual(self.cache.size(), 0)
@@ -0,0 +1,170 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Tests for converting the documents ahead of time, and for the quarantine of the files that fail to convert
+
+import json
+import logging
+import os
+import shutil
+import tempfile
+import zipfile
+from StringIO import StringIO
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase
+from django.test.utils import override_settings
+from raw import conversion, utils
+from raw.management.commands import convert_documents
+from raw.models import RawCouncilAgenda
+
+
+logging.disable(logging.CRITICAL)
+
+
+class QuarantineTestCase(SimpleTestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.quarantine_path = os.path.join(self.path, 'cache', 'quarantine.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_add_and_remove(self):
+        quarantine = convert_documents.Quarantine(self.quarantine_path, 2)
+        quarantine.add('a' * 40, u'council_agenda-1', u'/files/a.doc', convert_documents.FAILED, u'Error')
+        quarantine.add('b' * 40, u'council_agenda-2', u'/files/b.doc', convert_documents.TIMEOUT, u'Timeout')
+        self.assertEqual(quarantine.quarantined(), set())
+        # A file is quarantined after max_failures failures
+        quarantine.add('a' * 40, u'council_agenda-1', u'/files/a.doc', convert_documents.TIMEOUT, u'Timeout')
+        self.assertEqual(quarantine.quarantined(), set(['a' * 40]))
+        self.assertEqual(quarantine.entries['a' * 40]['failures'], 2)
+        self.assertEqual(quarantine.entries['a' * 40]['status'], convert_documents.TIMEOUT)
+
+        self.assertTrue(quarantine.remove('a' * 40))
+        self.assertFalse(quarantine.remove('a' * 40))
+        self.assertEqual(quarantine.quarantined(), set())
+        self.assertEqual(list(quarantine.entries), ['b' * 40])
+
+    def test_save(self):
+        quarantine = convert_documents.Quarantine(self.quarantine_path, 1)
+        quarantine.add('a' * 40, u'council_agenda-1', u'/files/a.doc', convert_documents.FAILED, u'Error')
+        # The folder is created on the first save
+        quarantine.save()
+        self.assertEqual(os.listdir(os.path.dirname(self.quarantine_path)), ['quarantine.json'])
+        loaded = convert_documents.Quarantine(self.quarantine_path, 1)
+        self.assertEqual(loaded.entries, quarantine.entries)
+        self.assertEqual(loaded.quarantined(), set(['a' * 40]))
+        # The files need more failures with a higher maximum
+        self.assertEqual(convert_documents.Quarantine(self.quarantine_path, 2).quarantined(), set())
+
+
+class ConvertTestCase(SimpleTestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.previous_cache = conversion._cache
+        conversion._cache = conversion.ConversionCache(os.path.join(self.path, 'cache'), max_size=None)
+        # A zip file is taken for a DOCX file, but pydocx cannot convert it
+        self.filepath = os.path.join(self.path, 'agenda.docx')
+        with zipfile.ZipFile(self.filepath, 'w') as f:
+            f.writestr('agenda.txt', 'Agenda')
+        self.digest = conversion.file_digest(self.filepath)
+
+    def tearDown(self):
+        conversion._cache = self.previous_cache
+        shutil.rmtree(self.path)
+
+    def test_failed(self):
+        res = convert_documents._convert(u'council_agenda-1', self.filepath, None, set())
+        self.assertEqual(res[:4], (u'council_agenda-1', self.filepath, self.digest, convert_documents.FAILED))
+        self.assertIn(u'MalformedDocxException', res[6])
+
+    def test_skip_quarantined(self):
+        res = convert_documents._convert(u'council_agenda-1', self.filepath, None, set([self.digest]))
+        self.assertEqual(res[2:4], (self.digest, convert_documents.QUARANTINED))
+        # The files already converted are still reported as such
+        conversion.get_cache().put(conversion.PYDOCX, self.digest, u'<p>Agenda</p>')
+        res = convert_documents._convert(u'council_agenda-1', self.filepath, None, set([self.digest]))
+        self.assertEqual(res[2:4], (self.digest, convert_documents.CACHED))
+
+    def test_unsupported(self):
+        filepath = os.path.join(self.path, 'agenda.txt')
+        with open(filepath, 'wb') as f:
+            f.write('The agenda of the meeting of the council\n' * 10)
+        res = convert_documents._convert(u'council_agenda-1', filepath, None, set())
+        self.assertEqual(res[2:4], (None, convert_documents.UNSUPPORTED))
+
+
+def _crash_on_crash_files(path):
+    # Stands for abiword dying on a file, in the worker process
+    if os.path.basename(path).startswith('crash'):
+        os._exit(1)
+    return _check_file_type(path)
+
+
+_check_file_type = utils.check_file_type
+
+
+class CommandTestCase(TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.previous_cache = conversion._cache
+        conversion._cache = conversion.ConversionCache(os.path.join(self.path, 'cache'), max_size=None)
+        with zipfile.ZipFile(os.path.join(self.path, 'agenda.docx'), 'w') as f:
+            f.writestr('agenda.txt', 'Agenda')
+        RawCouncilAgenda.objects.create(uid=u'council_agenda-20140430-e', local_filename=u'agenda.docx')
+        self.quarantine_path = os.path.join(self.path, 'cache', 'quarantine.json')
+
+    def tearDown(self):
+        conversion._cache = self.previous_cache
+        utils.check_file_type = _check_file_type
+        shutil.rmtree(self.path)
+
+    def _run(self, **options):
+        options.setdefault('workers', 1)
+        with override_settings(SCRAPY_FILES_PATH=self.path):
+            call_command('convert_documents', timeout=60, max_failures=1, stdout=StringIO(), stderr=StringIO(),
+                         **options)
+        with open(self.quarantine_path, 'rb') as f:
+            return json.load(f)
+
+    def test_quarantine(self):
+        entries = self._run()
+        self.assertEqual(len(entries), 1)
+        entry = entries.values()[0]
+        self.assertEqual((entry['uid'], entry['status'], entry['failures']),
+                         (u'council_agenda-20140430-e', convert_documents.FAILED, 1))
+        # The quarantined file is skipped on the next run, unless asked otherwise
+        self.assertEqual(entries.values()[0]['failures'], self._run().values()[0]['failures'])
+        self.assertEqual(self._run(retry_quarantined=True).values()[0]['failures'], 2)
+
+    def _add_crashing_files(self):
+        # The workers are forked, so they take the replaced function
+        utils.check_file_type = _crash_on_crash_files
+        for name in ['crash', 'agenda-2', 'agenda-3']:
+            with zipfile.ZipFile(os.path.join(self.path, name + '.docx'), 'w') as f:
+                f.writestr('agenda.txt', name)
+            RawCouncilAgenda.objects.create(uid=u'council_agenda-{}'.format(name), local_filename=name + '.docx')
+
+    def _statuses(self, entries):
+        return dict((entry['uid'], entry['status']) for entry in entries.values())
+
+    def test_crashed_worker(self):
+        # The file that killed the worker is found among the files in the pool, and the others are converted
+        self._add_crashing_files()
+        expected = {
+            u'council_agenda-crash': convert_documents.CRASHED,
+            u'council_agenda-agenda-2': convert_documents.FAILED,
+            u'council_agenda-agenda-3': convert_documents.FAILED,
+            u'council_agenda-20140430-e': convert_documents.FAILED,
+        }
+        self.assertEqual(self._statuses(self._run(workers=2)), expected)
+
+    def test_crashed_worker_alone(self):
+        self._add_crashing_files()
+        convert_documents.WINDOW_PER_WORKER, previous = 1, convert_documents.WINDOW_PER_WORKER
+        try:
+            entries = self._run()
+        finally:
+            convert_documents.WINDOW_PER_WORKER = previous
+        self.assertEqual(self._statuses(entries)[u'council_agenda-crash'], convert_documents.CRASHED)
+        self.assertEqual(len(entries), 4)
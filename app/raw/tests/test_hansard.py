@@ -0,0 +1,253 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Tests for the Council Hansard parser
+
+import copy
+import logging
+import lxml.html
+import os
+import re
+import shutil
+import tempfile
+from django.test import SimpleTestCase, TestCase
+from lxml import etree
+# raw.models has to be imported before raw.docs.hansard, which it imports
+from raw.models import RawCouncilQuestion
+from raw.models.constants import LANG_EN
+from raw.docs import config, hansard
+from raw.docs.hansard import CouncilHansard
+
+
+logging.disable(logging.CRITICAL)
+
+
+def _previous_clean(tree, language):
+    # CouncilHansard._clean() as it was before the single walk, one pass per step
+    for elem in tree.xpath('//*'):
+        if 'font-weight:bold' in elem.get('style', ''):
+            elem.tag = 'strong'
+    etree.strip_tags(tree, 'div')
+    try:
+        tree.xpath('//div')[0].tag = 'body'
+    except IndexError:
+        pass
+    for xx in tree.find_class('pydocx-caps'):
+        desc = xx.xpath('./descendant::*')
+        if desc == [] and xx.text is not None:
+            xx.text = xx.text.upper()
+        elif len(desc) == 1 and desc[0].text is not None:
+            desc[0].text = desc[0].text.upper()
+        else:
+            for yy in desc:
+                if yy.text is not None:
+                    yy.text = yy.text.upper()
+        xx.drop_tag()
+    for xx in tree.find_class('pydocx-tab'):
+        xx.drop_tag()
+    for tag in ('p', 'em'):
+        for xx in tree.xpath('//' + tag):
+            if xx.text_content().strip() == '':
+                xx.drop_tree()
+    for xx in tree.xpath('//strong'):
+        if xx.text_content().strip() == '' and xx.getchildren() == []:
+            xx.drop_tree()
+    if len(tree.xpath('//hr')) > 2:
+        pattern_clerk = 'CLERK' if language == LANG_EN else u'列席秘書'
+        for block in tree.xpath('//body/*'):
+            if re.match(pattern_clerk, block.text_content()) is None:
+                if block.tag == 'hr':
+                    block.drop_tree()
+                for hr in block.xpath('.//hr'):
+                    hr.drop_tree()
+            else:
+                break
+    for p in tree.xpath('//body/p'):
+        if p.tail is None:
+            children = p.getchildren()
+            if len(children) > 1:
+                for child in children:
+                    if child.tag != 'strong' or (child.tail is not None and child.tail != u"'"):
+                        break
+                else:
+                    etree.strip_tags(p, 'strong')
+                    text = p.text_content()
+                    p.clear()
+                    etree.SubElement(p, 'strong').text = text
+    return tree
+
+
+class CouncilHansardTestCase(SimpleTestCase):
+    def setUp(self):
+        with open('raw/tests/fixtures/council_hansard-20150429-e.html', 'rb') as f:
+            self.src = f.read().decode('utf-8')
+        self.hansard = CouncilHansard('council_hansard-20150429-e', LANG_EN, self.src, '20150429')
+
+    def test_clean(self):
+        tree = self.hansard.tree
+        self.assertEqual(tree.tag, 'body')
+        self.assertEqual(tree.xpath('//div'), [])
+        self.assertEqual(tree.xpath('//span'), [])
+        self.assertEqual(tree.xpath('//p[not(node())]'), [])
+        self.assertEqual(tree.xpath('//em[not(node())]'), [])
+        # pydocx-caps are upper-cased, bold text is in <strong>
+        self.assertEqual(tree.xpath('//body/p')[4].text, u'THE PRESIDENT')
+        self.assertEqual(tree.xpath('//body/p')[2][0].tag, 'strong')
+
+    def test_clean_nested(self):
+        # Emptiness is decided once the empty children are dropped. Only the descendants of a
+        # pydocx-caps with children are upper-cased.
+        self.hansard.tree = lxml.html.fromstring(
+            u'<div><p><span class="pydocx-caps">a<em>b</em></span>c</p><p><strong><em></em></strong></p>'
+            u'<p><span class="pydocx-tab"> </span></p><p><strong>x</strong><span style="font-weight:bold">y</span></p></div>')
+        self.hansard._clean()
+        self.assertEqual(etree.tostring(self.hansard.tree),
+                         '<body><p>a<em>B</em>c</p><p><strong>xy</strong></p></body>')
+
+    def _assert_cleaned_as_before(self, tree):
+        previous = _previous_clean(copy.deepcopy(tree), LANG_EN)
+        self.hansard.tree = tree
+        self.hansard._clean()
+        self.assertEqual(etree.tostring(self.hansard.tree, encoding='unicode'),
+                         etree.tostring(previous, encoding='unicode'))
+        return self.hansard.tree
+
+    def test_clean_as_before(self):
+        self.hansard._load()
+        self._assert_cleaned_as_before(self.hansard.tree)
+        # The extra <hr> tags before the clerks are dropped, and the broken titles are joined
+        src = self.src.replace(u'<p><strong>MEMBERS ABSENT:</strong></p>',
+                               u'<hr><p><strong>MEMBERS ABSENT:</strong></p><table><tr><td>a<hr>b</td></tr></table>'
+                               u'<p><em> </em><hr></p>')
+        src = src.replace(u'<p><strong>TABLING OF PAPERS</strong></p>',
+                          u'<p><strong>TABLING OF</strong><strong> PAPERS</strong></p><hr>')
+        tree = self._assert_cleaned_as_before(lxml.html.fromstring(src))
+        self.assertEqual(len(tree.xpath('//hr')), 2)
+        self.assertEqual(tree.xpath('//body/p/strong/text()').count(u'TABLING OF PAPERS'), 1)
+
+        # Loaded with the lxml cleaner, the <body> is inside of another, which _previous_clean()
+        # took for a block before the clerks, dropping all of the <hr> tags and then failing
+        self.hansard.source = src
+        self.hansard._load()
+        self.hansard._clean()
+        self.assertEqual([xx.tag for xx in self.hansard.tree], ['body'])
+        hrs = self.hansard.tree.xpath('//hr')
+        self.assertEqual(len(hrs), 2)
+        self.assertEqual(hrs[0].getprevious().text_content(), u'MISS ODELIA LEUNG HING-YEE, DEPUTY SECRETARY GENERAL')
+
+    def test_main_heading(self):
+        self.assertEqual(self.hansard.president[0], u'JASPER TSANG YOK-SING')
+        self.assertEqual([xx[0] for xx in self.hansard.members_present],
+                         [u'ALBERT HO CHUN-YAN', u'JAMES TO KUN-SUN', u'EMILY LAU WAI-HING'])
+        self.assertEqual(self.hansard.members_absent, [(u'LEE CHEUK-YAN', u'THE HONOURABLE LEE CHEUK-YAN')])
+        self.assertEqual(len(self.hansard.public_officers), 2)
+        self.assertEqual(len(self.hansard.clerks), 2)
+
+    def test_sections(self):
+        self.assertEqual(self.hansard.sections,
+                         [u'BEFORE MEETING', u'TABLING OF PAPERS', u'ORAL ANSWERS TO QUESTIONS',
+                          u'WRITTEN ANSWERS TO QUESTIONS', u'BILLS', u'MOTIONS', u'NEXT MEETING'])
+        self.assertEqual(self.hansard._count_errors, 0)
+
+    def test_tabled_papers(self):
+        self.assertEqual(self.hansard.tabled_legislation[1], (u'Fire Services (Amendment) Regulation 2015', u'55/2015'))
+        self.assertEqual(self.hansard.tabled_other_papers[0],
+                         (u'No. 93', u'Hong Kong Arts Development Council', u'Annual Report 2013-2014'))
+
+    def test_questions(self):
+        self.assertEqual([(xx[0], xx[1]) for xx in self.hansard.oral_questions],
+                         [(u'1', u'Public Housing Production'), (u'2', u'Funding for the Arts')])
+        speaker, speech = self.hansard.oral_questions[0][2][0]
+        self.assertEqual(speaker, u'MR ALBERT HO')
+        self.assertTrue(speech.startswith(u'<p> (in Cantonese): President, will the Government'))
+        self.assertEqual([xx[0] for xx in self.hansard.oral_questions[1][2]],
+                         [u'MR JAMES TO', u'SECRETARY FOR HOME AFFAIRS', u'PRESIDENT',
+                          u'MS EMILY LAU', u'SECRETARY FOR HOME AFFAIRS'])
+        self.assertEqual([xx[0] for xx in self.hansard.written_questions], [u'3', u'4'])
+
+    def test_dialogs(self):
+        self.assertEqual(self.hansard.before_meeting[1],
+                         (None, u'(While the summoning bell was ringing, THE PRESIDENT took the Chair)'))
+        self.assertEqual([(xx[0], xx[1]) for xx in self.hansard.bills],
+                         [(u'First Reading of Bills', None),
+                          (u'First Reading of Bills', u'INLAND REVENUE (AMENDMENT) BILL 2015'),
+                          (u'Second Reading of Bills', u'INLAND REVENUE (AMENDMENT) BILL 2015')])
+        self.assertEqual(self.hansard.motions[1][0],
+                         u'PROPOSED RESOLUTION UNDER THE INTERPRETATION AND GENERAL CLAUSES ORDINANCE')
+        self.assertEqual(self.hansard.suspension[0][0], u'PRESIDENT')
+
+    def test_register_section_parser(self):
+        def parse_statements(hansard, elem_list):
+            hansard.statements = hansard.parse_dialogs(elem_list)
+        self.addCleanup(hansard.SECTION_PARSERS[LANG_EN].pop, hansard.STATEMENTS_e)
+        hansard.register_section_parser(LANG_EN, hansard.STATEMENTS_e, parse_statements)
+        src = self.src.replace(u'<strong>MOTIONS</strong>', u'<strong>STATEMENTS</strong>')
+        parser = CouncilHansard('council_hansard-20150429-e', LANG_EN, src, '20150429')
+        self.assertIsNone(parser.motions)
+        self.assertEqual(parser.statements[-1], (u'PRESIDENT', u'<p> I declare the motion passed.</p>'))
+
+    def test_iter_dialogs(self):
+        elems = list(lxml.html.fromstring(
+            u'<div><p><strong>MR A</strong>: First</p><table><tr><td>a<hr>b</td></tr></table><hr>'
+            u'<p>(Members raised their hands)</p><p><strong>MR</strong><strong> B</strong>: Second</p></div>'))
+        dialogs = self.hansard.iter_dialogs(elems)
+        self.assertEqual(next(dialogs), (u'MR A', u'<p> First</p><table><tr><td>ab</td></tr></table>'))
+        self.assertEqual(list(dialogs), [(None, u'(Members raised their hands)'), (u'MR B', u'<p> Second</p>')])
+
+    def test_config(self):
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        self.assertEqual(self.hansard.config, config.PRODUCTION)
+        CouncilHansard('council_hansard-20150429-e', LANG_EN, self.src, '20150429',
+                       config=config.PRODUCTION._replace(fixtures_path=path))
+        self.assertEqual(os.listdir(path), [])
+        CouncilHansard('council_hansard-20150429-e', LANG_EN, self.src, '20150429',
+                       config=config.DEBUG._replace(fixtures_path=path))
+        self.assertEqual(sorted(os.listdir(path)),
+                         ['council_hansard-20150429-e_cleaned.html', 'council_hansard-20150429-e_end.html'])
+
+    def test_detach(self):
+        parser = CouncilHansard('council_hansard-20150429-e', LANG_EN, self.src, '20150429')
+        self.assertIs(parser.detach(), parser)
+        self.assertIsNone(parser.tree)
+        self.assertIsNone(parser.source)
+        self.assertEqual(parser.oral_questions, self.hansard.oral_questions)
+        self.assertEqual(parser.bills, self.hansard.bills)
+        self.assertEqual(parser.motions, self.hansard.motions)
+        self.assertEqual(parser.tabled_other_papers, self.hansard.tabled_other_papers)
+        question = parser.oral_questions[0]
+        self.assertIsInstance(question, hansard.HansardQuestion)
+        self.assertEqual(question.dialogs[0].speaker, u'MR ALBERT HO')
+        self.assertEqual(parser.bills[2].title, u'INLAND REVENUE (AMENDMENT) BILL 2015')
+        # The strings are plain strings, not references into the tree
+        self.assertIn(type(parser.oral_questions[1].dialogs[0].speaker), (str, unicode))
+        self.assertIn(type(parser.president[0]), (str, unicode))
+
+
+class QuestionMapTestCase(TestCase):
+    def setUp(self):
+        with open('raw/tests/fixtures/council_hansard-20150429-e.html', 'rb') as f:
+            self.src = f.read().decode('utf-8')
+        self.hansard = CouncilHansard('council_hansard-20150429-e', LANG_EN, self.src, '20150429')
+        self.first = RawCouncilQuestion.objects.create(uid=u'question-20150429-1-e')
+        self.urgent = RawCouncilQuestion.objects.create(uid=u'question-20150429-u2-e')
+        # Questions sharing a uid are not matched
+        RawCouncilQuestion.objects.create(uid=u'question-20150429-3-e')
+        RawCouncilQuestion.objects.create(uid=u'question-20150429-3-e')
+        RawCouncilQuestion.objects.create(uid=u'question-20150429-4-c')
+
+    def test_one_query(self):
+        with self.assertNumQueries(1):
+            question_map = self.hansard._build_question_map(self.hansard.oral_questions)
+        self.assertEqual(question_map, [self.first, self.urgent])
+        self.assertEqual(self.hansard._build_question_map(self.hansard.written_questions), [None, None])
+        self.assertIsNone(self.hansard._build_question_map([]))
+
+    def test_question_index(self):
+        question_index = RawCouncilQuestion.objects.index_by_uid()
+        self.assertEqual(sorted(question_index),
+                         [u'question-20150429-1-e', u'question-20150429-4-c', u'question-20150429-u2-e'])
+        with self.assertNumQueries(0):
+            hansard = CouncilHansard('council_hansard-20150429-e', LANG_EN, self.src, '20150429',
+                                     question_index=question_index)
+        self.assertEqual(hansard.oral_questions_map, [self.first, self.urgent])
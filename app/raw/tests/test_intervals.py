@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+from datetime import date, datetime
+import logging
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils.timezone import utc
+from raw.intervals import IntervalIndex, intervals
+from raw.models import ParsedCommittee, ParsedCommitteeMembership, ParsedMembership, ParsedPerson
+
+
+logging.disable(logging.CRITICAL)
+
+
+class IntervalIndexTestCase(TestCase):
+    def setUp(self):
+        self.index = IntervalIndex([
+            (date(2004, 10, 1), date(2008, 9, 30), 'third'),
+            (date(1998, 7, 1), date(2000, 6, 30), 'first'),
+            (date(2000, 10, 1), date(2004, 9, 30), 'second'),
+            (date(2012, 10, 1), None, 'fifth'),
+            (date(2000, 10, 1), date(2012, 9, 30), 'long'),
+        ])
+
+    def test_stab(self):
+        points = [date(1999, 1, 1), date(2004, 10, 1), date(2005, 1, 1), date(2013, 1, 1), date(2030, 1, 1),
+                  date(1990, 1, 1)]
+        res = self.index.stab(points)
+        self.assertEqual(res[date(1999, 1, 1)], ['first'])
+        # Neither the start nor the end dates are included
+        self.assertEqual(res[date(2004, 10, 1)], ['long'])
+        self.assertEqual(res[date(2005, 1, 1)], ['long', 'third'])
+        self.assertEqual(res[date(2013, 1, 1)], ['fifth'])
+        self.assertEqual(res[date(2030, 1, 1)], ['fifth'])
+        self.assertEqual(res[date(1990, 1, 1)], [])
+        self.assertEqual(self.index.active_on(date(2002, 1, 1)), ['second', 'long'])
+
+    def test_overlapping(self):
+        self.assertEqual(self.index.overlapping(date(2000, 1, 1), date(2001, 1, 1)), ['first', 'second', 'long'])
+        self.assertEqual(self.index.overlapping(date(2040, 1, 1), date(2041, 1, 1)), ['fifth'])
+        self.assertEqual(self.index.overlapping(date(1980, 1, 1), date(1990, 1, 1)), [])
+
+
+class ActiveOnDatesTestCase(TestCase):
+    def setUp(self):
+        self.persons = []
+        for i in range(3):
+            self.persons.append(ParsedPerson.objects.create(uid=u'member-{}'.format(i), name_e=u'Member {}'.format(i),
+                                                            name_c=u'', title_e=u'', title_c=u'', gender=1))
+        for i, person in enumerate(self.persons):
+            ParsedMembership.objects.create(uid=u'membership-{}'.format(i), person=person, start_date=date(2008, 10, 1),
+                                            end_date=date(2012, 9, 30) if i else None, position=u'', method_obtained=u'')
+        committee = ParsedCommittee.objects.create(uid=u'committee-1', name_e=u'Panel', name_c=u'')
+        ParsedCommitteeMembership.objects.create(uid=u'cmembership-1', committee=committee, person=self.persons[0],
+                                                 start_date=datetime(2010, 1, 1, tzinfo=utc))
+
+    def test_memberships(self):
+        dates = [date(2009, 1, 1), date(2013, 1, 1), date(2000, 1, 1)]
+        with CaptureQueriesContext(connection) as queries:
+            res = ParsedMembership.objects.active_on_dates(dates)
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(len(res[date(2009, 1, 1)]), 3)
+        self.assertEqual([xx.person for xx in res[date(2013, 1, 1)]], [self.persons[0]])
+        self.assertEqual(res[date(2000, 1, 1)], [])
+        # The datetimes are compared by their date
+        res = ParsedMembership.objects.active_on_dates([datetime(2013, 1, 1, 11, tzinfo=utc)])
+        self.assertEqual(len(res[datetime(2013, 1, 1, 11, tzinfo=utc)]), 1)
+        self.assertEqual(len(ParsedMembership.objects.active_in_range(date(2012, 1, 1), date(2014, 1, 1))), 3)
+
+    def test_committee_memberships(self):
+        res = ParsedCommitteeMembership.objects.active_on_dates([date(2009, 1, 1), date(2011, 1, 1)])
+        self.assertEqual(res[date(2009, 1, 1)], [])
+        self.assertEqual([xx.uid for xx in res[date(2011, 1, 1)]], [u'cmembership-1'])
+
+    def test_invalidation(self):
+        ParsedMembership.objects.active_on_dates([date(2009, 1, 1)])
+        generation = intervals.generation
+        ParsedMembership.objects.filter(uid=u'membership-0').delete()
+        self.assertGreater(intervals.generation, generation)
+        res = ParsedMembership.objects.active_on_dates([date(2013, 1, 1)])
+        self.assertEqual(res[date(2013, 1, 1)], [])
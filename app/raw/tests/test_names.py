@@ -2,9 +2,16 @@
 # -*- coding: utf-8 -*-
 
 # Tests for MemberName object
-from django.test import SimpleTestCase
+from django.test import SimpleTestCase, TestCase
+import json
 import logging
-from raw.names import MemberName, NameMatcher
+import os
+import tempfile
+from raw.models import RawCouncilQuestion, RawMember
+from raw.names import (CHINESE_FUZZY_THRESHOLD, FUZZY_THRESHOLD, MATCH_EXACT, MATCH_FUZZY, UNRESOLVED, FuzzyNameIndex,
+                       MemberName, NameMatcher, ParseCache, matchers, name_cache, one_edit_apart, parse_name,
+                       resolve_names)
+from raw.processors.question import QuestionProcessor
 
 
 logging.disable(logging.CRITICAL)
@@ -125,6 +132,42 @@ class MemberNameTestCase(SimpleTestCase):
         ]
 
 
+class ParseCacheTestCase(SimpleTestCase):
+    def setUp(self):
+        name_cache.clear()
+        self.addCleanup(name_cache.clear)
+
+    def test_hits_and_misses(self):
+        MemberName(u'Hon Jasper TSANG Yok-sing, GBS, JP')
+        MemberName(u'Hon Jasper TSANG Yok-sing, GBS, JP')
+        MemberName(u'曾鈺成')
+        stats = name_cache.stats()
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['misses'], 2)
+        self.assertEqual(stats['size'], 2)
+        name_cache.clear()
+        self.assertEqual(name_cache.stats(), {'hits': 0, 'misses': 0, 'size': 0, 'maxsize': name_cache.maxsize})
+
+    def test_shared_record(self):
+        # Names built from the same record do not share their honours
+        n1 = MemberName(u'Hon Jasper TSANG Yok-sing, GBS, JP')
+        n1.honours.append(u'SBS')
+        n2 = MemberName(u'Hon Jasper TSANG Yok-sing, GBS, JP')
+        self.assertEqual(n2.honours, [u'GBS', u'JP'])
+        self.assertEqual(parse_name(u'Hon Jasper TSANG Yok-sing, GBS, JP').honours, (u'GBS', u'JP'))
+
+    def test_least_recently_used(self):
+        cache = ParseCache(maxsize=2)
+        cache.parse(u'Jasper Tsang')
+        cache.parse(u'Emily Lau')
+        cache.parse(u'Jasper Tsang')
+        cache.parse(u'Alan Leong')
+        # Emily Lau was the least recently used
+        cache.parse(u'Jasper Tsang')
+        cache.parse(u'Emily Lau')
+        self.assertEqual(cache.stats(), {'hits': 2, 'misses': 4, 'size': 2, 'maxsize': 2})
+
+
 class NameMatcherTestCase(SimpleTestCase):
     def test_simple_match(self):
         n1 = MemberName(last_name=u'Wu', chinese_name=u'Chi-wai')
@@ -143,3 +186,192 @@ class NameMatcherTestCase(SimpleTestCase):
         matcher = NameMatcher([(n1, 'foo'), (n2, 'bar'), (n3, 'baz')])
         res = matcher.match(n)
         self.assertEqual(res, (n1, 'foo'))
+
+    def test_partial_names(self):
+        n1 = MemberName(u'Jasper TSANG Yok-sing')
+        n2 = MemberName(u'Emily LAU Wai-hing')
+        n3 = MemberName(u'曾鈺成')
+        matcher = NameMatcher([n1, n2, n3])
+        self.assertIs(matcher.match(MemberName(u'Tsang Yok-sing')), n1)
+        self.assertIs(matcher.match(MemberName(u'Jasper Tsang')), n1)
+        self.assertIs(matcher.match(MemberName(u'曾鈺成議員')), n3)
+        self.assertIsNone(matcher.match(MemberName(u'Jasper Lau')))
+        self.assertIsNone(matcher.match(MemberName(u'Jasper TSANG Ka-ki')))
+
+    def test_first_match(self):
+        n1 = MemberName(last_name=u'Wong', english_name=u'Christopher')
+        n2 = MemberName(last_name=u'Wong', english_name=u'Christopher', chinese_name=u'Kim-kam')
+        matcher = NameMatcher([(n1, 'foo'), (n2, 'bar')])
+        self.assertEqual(matcher.match(MemberName(u'Christopher WONG Kim-kam')), (n1, 'foo'))
+        self.assertEqual(matcher.match(MemberName(u'Wong Kim-kam')), (n2, 'bar'))
+
+
+class FuzzyNameIndexTestCase(SimpleTestCase):
+    def setUp(self):
+        self.names = [(MemberName(xx), xx) for xx in [
+            u'Hon Jasper TSANG Yok-sing, GBS, JP', u'Hon Emily LAU Wai-hing, JP', u'Hon LEUNG Yiu-chung',
+            u'Hon LEUNG Kwok-hung', u'Dr Hon KWOK Ka-ki']]
+        self.index = FuzzyNameIndex(self.names)
+
+    def test_misspelled_and_reordered(self):
+        self.assertEqual(self.index.match(u'Jasper TSANG Yok-sin')[1], u'Hon Jasper TSANG Yok-sing, GBS, JP')
+        self.assertEqual(self.index.match(u'TSANG Yok-sing, Jasper')[1], u'Hon Jasper TSANG Yok-sing, GBS, JP')
+        self.assertEqual(self.index.match(u'Mr LEUNG Kwok-hong')[1], u'Hon LEUNG Kwok-hung')
+        self.assertEqual(self.index.match(MemberName(u'Kwok Ka-ki'))[1], u'Dr Hon KWOK Ka-ki')
+
+    def test_candidates(self):
+        found = self.index.candidates(u'LEUNG Kwok-hong', k=2)
+        self.assertEqual([xx[1][1] for xx in found], [u'Hon LEUNG Kwok-hung', u'Hon LEUNG Yiu-chung'])
+        self.assertGreater(found[0][0], found[1][0])
+        self.assertEqual(len(self.index.candidates(u'LEUNG Kwok-hong', threshold=0.6)), 1)
+        self.assertEqual(self.index.candidates(u'Hon, GBS'), [])
+
+    def test_no_match(self):
+        # Below the threshold, or the same score for two names
+        self.assertIsNone(self.index.match(u'Emly LAU'))
+        self.assertIsNone(self.index.match(u'Hon LEUNG'))
+        self.assertIsNone(self.index.match(u'Alan Leong'))
+
+    def test_english_names_of_other_members(self):
+        index = FuzzyNameIndex([(MemberName(xx), xx) for xx in [
+            u'Hon WONG Kwok-kin, BBS', u'Hon WONG Yuk-man', u'Hon CHAN Kam-lam, SBS, JP', u'Hon CHAN Kin-por, BBS, JP',
+            u'Hon LEUNG Kwok-hung']])
+        # Same surname, a given name two letters off, and a score above the threshold
+        score, name = index.candidates(u'Hon WONG Kwok-hing')[0]
+        self.assertEqual(name[1], u'Hon WONG Kwok-kin, BBS')
+        self.assertGreater(score, FUZZY_THRESHOLD)
+        self.assertIsNone(index.match(u'Hon WONG Kwok-hing'))
+        self.assertIsNone(index.match(u'Hon CHAN Kam-por'))
+        # Another surname
+        self.assertIsNone(index.match(u'Hon LEONG Kwok-hung'))
+        self.assertEqual(index.match(u'Hon CHAN Kin-pro')[1], u'Hon CHAN Kin-por, BBS, JP')
+
+    def test_english_margin(self):
+        index = FuzzyNameIndex([(MemberName(xx), xx) for xx in [
+            u'Hon WONG Kwok-hing, MH', u'Hon WONG Kwok-kin, BBS', u'Hon LEUNG Kwok-hung', u'Mr LEUNG Kwok-hong']])
+        # One letter off either of them, with close scores
+        self.assertIsNone(index.match(u'LEUNG Kwok-hng'))
+        # One letter off both, but much closer to one of them
+        self.assertEqual(index.match(u'WONG Kwok-hin')[1], u'Hon WONG Kwok-hing, MH')
+
+    def test_one_edit_apart(self):
+        for a, b in [(u'kwokhung', u'kwokhung'), (u'kwokhung', u'kwokhong'), (u'yoksing', u'yoksin'),
+                     (u'kahkit', u'kahkitt'), (u'kinpor', u'kinpro'), (u'kwok', u'wok')]:
+            self.assertTrue(one_edit_apart(a, b))
+            self.assertTrue(one_edit_apart(b, a))
+        for a, b in [(u'kwokhing', u'kwokkin'), (u'kampor', u'kinpor'), (u'kinpor', u'kinrop'), (u'wong', u'wongkw')]:
+            self.assertFalse(one_edit_apart(a, b))
+            self.assertFalse(one_edit_apart(b, a))
+
+    def test_chinese_names(self):
+        index = FuzzyNameIndex([(MemberName(xx), xx) for xx in [u'曾鈺成', u'梁耀忠', u'梁國雄']], CHINESE_FUZZY_THRESHOLD)
+        self.assertEqual(index.match(u'曾鈺成議員')[1], u'曾鈺成')
+        self.assertIsNone(index.match(u'梁家傑'))
+
+    def test_chinese_names_one_character_apart(self):
+        index = FuzzyNameIndex([(MemberName(xx), xx) for xx in [u'梁家傑', u'曾鈺成', u'梁劉柔芬']], CHINESE_FUZZY_THRESHOLD)
+        # Another member may share the surname and the first given name
+        self.assertIsNone(index.match(u'梁家騮'))
+        self.assertIsNone(index.match(u'梁國熊'))
+        score, name = index.candidates(u'梁家騮')[0]
+        self.assertEqual((score, name[1]), (0.5, u'梁家傑'))
+        # But a name missing a character is found
+        self.assertEqual(index.match(u'梁劉柔')[1], u'梁劉柔芬')
+
+
+class ResolveNamesTestCase(SimpleTestCase):
+    def setUp(self):
+        names = [(MemberName(xx), xx) for xx in [u'Hon Jasper TSANG Yok-sing, GBS, JP', u'Hon LEUNG Kwok-hung']]
+        self.matcher = NameMatcher(names)
+        self.index = FuzzyNameIndex(names)
+
+    def test_resolve(self):
+        strings = [u'Jasper Tsang', u'LEUNG Kwok-hong', u'Jasper Tsang', u'Emily Lau', u'', None]
+        res = resolve_names(strings, self.matcher, self.index)
+        self.assertEqual(sorted(res.keys()), sorted(set(strings)))
+        self.assertEqual(res[u'Jasper Tsang'].member, u'Hon Jasper TSANG Yok-sing, GBS, JP')
+        self.assertEqual(res[u'Jasper Tsang'].method, MATCH_EXACT)
+        self.assertEqual(res[u'LEUNG Kwok-hong'].member, u'Hon LEUNG Kwok-hung')
+        self.assertEqual(res[u'LEUNG Kwok-hong'].method, MATCH_FUZZY)
+        self.assertLess(res[u'LEUNG Kwok-hong'].score, 1.0)
+        for xx in [u'Emily Lau', u'', None]:
+            self.assertEqual(res[xx], UNRESOLVED)
+            self.assertIsNone(res[xx].member_id)
+
+    def test_without_fuzzy_index(self):
+        res = resolve_names([u'LEUNG Kwok-hong'], self.matcher)
+        self.assertEqual(res[u'LEUNG Kwok-hong'], UNRESOLVED)
+
+
+class MatcherRegistryTestCase(TestCase):
+    def setUp(self):
+        # The matchers are kept by the process, not by the test database
+        matchers.invalidate()
+        self.addCleanup(matchers.invalidate)
+        self.member = RawMember.objects.create(name_e=u'Emily LAU Wai-hing', name_c=u'劉慧卿')
+
+    def test_cached(self):
+        matcher = RawMember.get_matcher()
+        with self.assertNumQueries(0):
+            self.assertIs(RawMember.get_matcher(), matcher)
+        self.assertEqual(matcher.match(MemberName(u'Lau Wai-hing'))[1], self.member)
+        self.assertIsNot(RawMember.get_matcher(english=False), matcher)
+
+    def test_invalidation(self):
+        matcher = RawMember.get_matcher()
+        generation = matchers.generation
+        member = RawMember.objects.create(name_e=u'James TO Kun-sun', name_c=u'涂謹申')
+        self.assertEqual(matchers.generation, generation + 1)
+        self.assertIsNot(RawMember.get_matcher(), matcher)
+        self.assertEqual(RawMember.get_matcher().match(MemberName(u'James To'))[1], member)
+        member.delete()
+        self.assertIsNone(RawMember.get_matcher().match(MemberName(u'James To')))
+        self.assertEqual(matchers.generation, generation + 2)
+
+    def test_fuzzy_index(self):
+        index = RawMember.get_fuzzy_index()
+        self.assertIs(RawMember.get_fuzzy_index(), index)
+        self.assertIsNot(RawMember.get_matcher(), index)
+        self.assertEqual(index.match(u'LAU Wai-hin, Emily')[1], self.member)
+        self.assertEqual(RawMember.get_fuzzy_index(False).match(u'劉慧卿議員')[1], self.member)
+        self.assertIsNone(RawMember.get_fuzzy_index(False).match(u'劉惠卿議員'))
+
+    def test_resolve_names(self):
+        res = RawMember.resolve_names([u'Emily Lau', u'LAU Wai-hin, Emily', u'Emily Lau'])
+        self.assertEqual(len(res), 2)
+        self.assertEqual(res[u'Emily Lau'].member_id, self.member.pk)
+        self.assertEqual(res[u'LAU Wai-hin, Emily'].member_id, self.member.pk)
+        self.assertEqual(RawMember.resolve_names([u'劉慧卿議員'], english=False)[u'劉慧卿議員'].member, self.member)
+
+
+class FixAskerTestCase(TestCase):
+    def setUp(self):
+        matchers.invalidate()
+        self.addCleanup(matchers.invalidate)
+        self.member = RawMember.objects.create(name_e=u'Alan LEONG Kah-kit', name_c=u'梁家傑')
+        RawMember.objects.create(name_e=u'Jasper TSANG Yok-sing', name_c=u'曾鈺成')
+
+    def test_fuzzy_last(self):
+        RawCouncilQuestion.objects.create(uid=u'question-20140430-1-c', raw_asker=u'梁家騮議員')
+        RawCouncilQuestion.objects.create(uid=u'question-20140430-2-e', raw_asker=u'Hon Alan LEONG Kah-kitt')
+        no_asker = RawCouncilQuestion.fix_asker_by_parser()
+        # A different member who shares the surname and the first given name is not taken
+        self.assertEqual(no_asker, [u'question-20140430-1-c'])
+        self.assertIsNone(RawCouncilQuestion.objects.get(uid=u'question-20140430-1-c').asker)
+        self.assertEqual(RawCouncilQuestion.objects.get(uid=u'question-20140430-2-e').asker, self.member)
+
+    def test_processor_exact_only(self):
+        # The processor only takes the exact matches, the askers of other members are left alone
+        RawMember.objects.create(name_e=u'WONG Kwok-kin', name_c=u'黃國健')
+        items = [{'asker': asker, 'reply_link': u'', 'number_and_type': u'Q. {} (Oral)'.format(i + 1),
+                  'date': u'30.4.2014', 'source_url': u'http://www.legco.gov.hk/', 'subject': u'Question',
+                  'language': u'E', 'files': [{'path': u''}]}
+                 for i, asker in enumerate([u'Hon Alan LEONG Kah-kit', u'Hon WONG Kwok-hing'])]
+        fd, path = tempfile.mkstemp(suffix='.jl')
+        self.addCleanup(os.remove, path)
+        with os.fdopen(fd, 'wb') as f:
+            for item in items:
+                f.write(json.dumps(item) + '\n')
+        QuestionProcessor(path).process()
+        askers = dict(RawCouncilQuestion.objects.values_list('raw_asker', 'asker'))
+        self.assertEqual(askers, {u'Hon Alan LEONG Kah-kit': self.member.pk, u'Hon WONG Kwok-hing': None})
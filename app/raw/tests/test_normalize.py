@@ -0,0 +1,29 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Tests for the normalization of document sources
+
+from django.test import SimpleTestCase
+from raw.docs.normalize import Normalizer, normalize_colons, normalize_source
+from raw.docs.question import fix_header_typos, remove_undesired
+
+
+class NormalizeTestCase(SimpleTestCase):
+    def test_normalize_source(self):
+        src = u'<p>“Hon’s”\t question：\n a︰b﹕c‍</p>'
+        self.assertEqual(normalize_source(src), u'<p>"Hon\'s" question: a:b:c</p>')
+
+    def test_colons_only(self):
+        self.assertEqual(normalize_colons(u'問題：\n答覆︰'), u'問題:\n答覆:')
+
+    def test_longest_key_first(self):
+        normalizer = Normalizer({u'ab': u'1', u'abc': u'2', u'b': u'3'})
+        self.assertEqual(normalizer(u'abcabb'), u'213')
+
+    def test_byte_strings(self):
+        self.assertEqual(remove_undesired('a\x83\xdcb\x84Pc\x84h'), 'abc')
+
+    def test_header_typos(self):
+        self.assertEqual(fix_header_typos(u'a rely by the Secretary in the Legisative Counil'),
+                         u'a reply by the Secretary in the Legislative Council')
+        self.assertEqual(fix_header_typos(u'在立法會議上'), u'在立法會會議上')
@@ -0,0 +1,91 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Tests for the cache of parsed documents
+
+import logging
+import shutil
+import tempfile
+import time
+from django.test import SimpleTestCase
+from lxml import etree
+from raw.docs import agenda, cache
+
+
+logging.disable(logging.CRITICAL)
+
+
+class ParseCacheTestCase(SimpleTestCase):
+    def setUp(self):
+        with open('raw/tests/fixtures/council_agenda-20130508-e.html', 'rb') as f:
+            self.src = f.read().decode('utf-8')
+        self.uid = 'council_agenda-20130508-e'
+        self.path = tempfile.mkdtemp()
+        self.cache = cache.ParseCache(cache.FileSystemBackend(self.path))
+        self.version = agenda.PARSER_VERSION
+
+    def tearDown(self):
+        agenda.PARSER_VERSION = self.version
+        shutil.rmtree(self.path)
+
+    def assertSameResults(self, parser, cached):
+        self.assertEqual(cached.uid, parser.uid)
+        self.assertIsNone(cached.tree)
+        self.assertIsNone(cached.source)
+        self.assertEqual([(type(xx), vars(xx)) for xx in cached.tabled_papers],
+                         [(type(xx), vars(xx)) for xx in parser.tabled_papers])
+        self.assertEqual([(xx.number, xx.asker, xx.replier, xx.type, xx.body) for xx in cached.questions],
+                         [(xx.number, xx.asker, xx.replier, xx.type, xx.body) for xx in parser.questions])
+        self.assertEqual([(xx.title, xx.reading, xx.attendees, xx.amendments) for xx in cached.bills],
+                         [(xx.title, xx.reading, xx.attendees, xx.amendments) for xx in parser.bills])
+        self.assertIs(cached.question_map['1'], cached.questions[0])
+        # Unparsed sections are kept as elements
+        self.assertEqual([etree.tostring(xx) for xx in cached.motions],
+                         [etree.tostring(xx) for xx in parser.motions])
+        self.assertEqual(cached.motions[0].text_content(), parser.motions[0].text_content())
+
+    def test_hit(self):
+        parser = self.cache.parse(agenda.CouncilAgenda, self.uid, self.src)
+        self.assertEqual(self.cache.misses, 1)
+        start = time.time()
+        cached = self.cache.parse(agenda.CouncilAgenda, self.uid, self.src)
+        self.assertLess(time.time() - start, 0.5)
+        self.assertEqual(self.cache.hits, 1)
+        self.assertSameResults(parser, cached)
+        # The strings are plain strings, not references into a tree
+        self.assertIn(type(cached.questions[0].asker), (str, unicode))
+
+    def test_source_changes(self):
+        self.cache.parse(agenda.CouncilAgenda, self.uid, self.src)
+        self.cache.parse(agenda.CouncilAgenda, self.uid, self.src.replace(u'Legislative', u'Legislative '))
+        self.assertEqual(self.cache.misses, 2)
+
+    def test_version_changes(self):
+        self.cache.parse(agenda.CouncilAgenda, self.uid, self.src)
+        agenda.PARSER_VERSION += 1
+        self.cache.parse(agenda.CouncilAgenda, self.uid, self.src)
+        self.assertEqual(self.cache.misses, 2)
+        self.assertEqual(self.cache.prune([agenda.CouncilAgenda]), ['CouncilAgenda-{}'.format(self.version)])
+
+    def test_django_backend(self):
+        django_cache = cache.ParseCache(cache.DjangoCacheBackend())
+        parser = django_cache.parse(agenda.CouncilAgenda, self.uid, self.src)
+        cached = django_cache.parse(agenda.CouncilAgenda, self.uid, self.src)
+        self.assertEqual(django_cache.hits, 1)
+        self.assertSameResults(parser, cached)
+
+    def test_django_backend_clear(self):
+        from django.core.cache import get_cache
+        backend = cache.DjangoCacheBackend()
+        django_cache = cache.ParseCache(backend)
+        django_cache.parse(agenda.CouncilAgenda, self.uid, self.src)
+        # Other keys, like the sessions, share the cache
+        get_cache(backend.alias).set('session:1', 'logged in')
+        django_cache.clear()
+        self.assertEqual(get_cache(backend.alias).get('session:1'), 'logged in')
+        self.assertIsNone(django_cache.get(agenda.CouncilAgenda, self.uid, self.src))
+        django_cache.parse(agenda.CouncilAgenda, self.uid, self.src)
+        self.assertIsNotNone(django_cache.get(agenda.CouncilAgenda, self.uid, self.src))
+        # Even when the namespace is evicted, the results from before clear() stay out of reach
+        get_cache(backend.alias).delete(backend.NAMESPACE_KEY)
+        self.assertIsNone(django_cache.get(agenda.CouncilAgenda, self.uid, self.src))
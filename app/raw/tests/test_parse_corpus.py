@@ -0,0 +1,128 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Tests for the parse_corpus command
+
+import logging
+import os
+import shutil
+import tempfile
+from django.test import SimpleTestCase, TestCase
+from django.test.utils import override_settings
+from raw.docs.cache import get_parse_cache
+from raw.management.commands import parse_corpus
+from raw.models import RawCouncilQuestion
+
+
+logging.disable(logging.CRITICAL)
+
+
+def _outcome(model, pk, status):
+    return {'model': model, 'pk': pk, 'uid': u'{}-{}'.format(model, pk), 'status': status, 'seconds': 0.1,
+            'warnings': 0, 'message': None, 'cached': False, 'stages': []}
+
+
+class PkRangesTestCase(SimpleTestCase):
+    def test_pk_ranges(self):
+        self.assertEqual(parse_corpus.pk_ranges([1, 2, 3, 5, 8], 2), [(1, 2), (3, 5), (8, 8)])
+        self.assertEqual(parse_corpus.pk_ranges([1, 2, 3, 5, 8], 10), [(1, 8)])
+        self.assertEqual(parse_corpus.pk_ranges([], 2), [])
+
+
+class ReportTestCase(SimpleTestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.report_path = os.path.join(self.path, 'report.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_save_and_load(self):
+        report = parse_corpus.Report(self.report_path)
+        # There is nothing to resume from yet
+        report.load()
+        self.assertEqual(report.documents, [])
+        report.documents = [_outcome('RawCouncilQuestion', 1, parse_corpus.OK),
+                            _outcome('RawCouncilQuestion', 2, parse_corpus.EXCEPTION),
+                            _outcome('RawCouncilAgenda', 1, parse_corpus.FAILED)]
+        report.save()
+        self.assertEqual(os.listdir(self.path), ['report.json'])
+
+        loaded = parse_corpus.Report(self.report_path)
+        loaded.load()
+        self.assertEqual(loaded.started, report.started)
+        self.assertEqual(loaded.documents, report.documents)
+        self.assertEqual(loaded.done('RawCouncilQuestion'), set([1, 2]))
+        self.assertEqual(loaded.done('RawCouncilHansard'), set())
+        self.assertEqual(loaded.counts(), {parse_corpus.OK: 1, parse_corpus.FAILED: 1, parse_corpus.EXCEPTION: 1})
+
+
+class ParseRangeTestCase(TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        # Without --use-cache, the workers drop the backend of the process wide cache
+        self.backend = get_parse_cache().backend
+        self.questions = []
+        for i in range(1, 6):
+            self.questions.append(RawCouncilQuestion.objects.create(
+                uid=u'question-20140430-{}-e'.format(i), number_and_type=u'Q. {} (Oral)'.format(i),
+                raw_date=u'30.4.2014', local_filename=u'question-{}.htm'.format(i)))
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+        get_parse_cache().backend = self.backend
+        # The workers only disable the debug messages
+        logging.disable(logging.CRITICAL)
+
+    def test_plan_ranges(self):
+        pks = [xx.pk for xx in self.questions]
+        report = parse_corpus.Report(os.path.join(self.path, 'report.json'))
+        ranges, total = parse_corpus.plan_ranges(report, ['RawCouncilQuestion'], {}, 2)
+        self.assertEqual(total, 5)
+        self.assertEqual(ranges, [('RawCouncilQuestion', pks[0], pks[1], []),
+                                  ('RawCouncilQuestion', pks[2], pks[3], []),
+                                  ('RawCouncilQuestion', pks[4], pks[4], [])])
+
+        # Resuming skips the documents already in the report, even inside of a range
+        report.documents = [_outcome('RawCouncilQuestion', pks[1], parse_corpus.OK),
+                            _outcome('RawCouncilQuestion', pks[3], parse_corpus.FAILED),
+                            _outcome('RawCouncilAgenda', pks[0], parse_corpus.OK)]
+        ranges, total = parse_corpus.plan_ranges(report, ['RawCouncilQuestion'], {}, 2)
+        self.assertEqual(total, 3)
+        self.assertEqual(ranges, [('RawCouncilQuestion', pks[0], pks[2], [pks[1]]),
+                                  ('RawCouncilQuestion', pks[4], pks[4], [])])
+
+        ranges, total = parse_corpus.plan_ranges(report, ['RawCouncilQuestion'],
+                                                 {'uid__startswith': u'question-20140430-5'}, 2)
+        self.assertEqual((ranges, total), ([('RawCouncilQuestion', pks[4], pks[4], [])], 1))
+
+    def test_range_outcomes(self):
+        # A range whose worker died is reported as an exception for each of its documents
+        pks = [xx.pk for xx in self.questions]
+        task = ('RawCouncilQuestion', pks[0], pks[3], {}, [pks[1]], False, 0, None)
+        res = parse_corpus.range_outcomes(task, u'The worker process died')
+        self.assertEqual([(xx['pk'], xx['status'], xx['message']) for xx in res],
+                         [(pk, parse_corpus.EXCEPTION, u'The worker process died') for pk in [pks[0], pks[2], pks[3]]])
+        self.assertEqual(res[0]['uid'], u'question-20140430-1-e')
+
+    def test_parser_exception(self):
+        # get_parser() logs the exception of the parser and returns None, the report keeps its traceback
+        with open(os.path.join(self.path, 'question-1.htm'), 'wb') as f:
+            f.write('<html><body><p>Not a question</p></body></html>')
+        pk = self.questions[0].pk
+        with override_settings(SCRAPY_FILES_PATH=self.path):
+            res = parse_corpus._parse_range('RawCouncilQuestion', pk, self.questions[1].pk, {}, [self.questions[1].pk],
+                                            False, 0, None)
+        self.assertEqual(len(res), 1)
+        self.assertEqual((res[0]['pk'], res[0]['status']), (pk, parse_corpus.EXCEPTION))
+        self.assertTrue(res[0]['message'].startswith(u'Traceback'))
+        self.assertIn(u'raw/docs/question.py', res[0]['message'])
+        self.assertGreater(res[0]['warnings'], 0)
+
+    def test_cache_off_by_default(self):
+        # A run after changing a parser must not replay the outcomes of the cached results
+        parser = parse_corpus.Command().create_parser('manage.py', 'parse_corpus')
+        options, args = parser.parse_args([])
+        self.assertFalse(options.use_cache)
+        options, args = parser.parse_args(['--use-cache'])
+        self.assertTrue(options.use_cache)
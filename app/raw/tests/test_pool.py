@@ -0,0 +1,44 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Tests for running tasks in a pool of processes that survives the death of a worker
+
+import logging
+import os
+from django.test import SimpleTestCase
+from raw.pool import run_in_pool
+
+
+logging.disable(logging.CRITICAL)
+
+
+def _task(number):
+    # Stands for a segfault in the worker
+    if number == 3:
+        os._exit(1)
+    if number == 5:
+        raise ValueError(u'Five')
+    return number * 2
+
+
+class RunInPoolTestCase(SimpleTestCase):
+    def _run(self, tasks, workers, window=None):
+        res = {}
+        for task, future in run_in_pool(_task, tasks, workers, window):
+            if future is None:
+                res[task] = None
+            elif future.exception() is not None:
+                res[task] = type(future.exception())
+            else:
+                res[task] = future.result()
+        return res
+
+    def test_results(self):
+        self.assertEqual(self._run([(1,), (2,), (4,), (5,)], 2), {(1,): 2, (2,): 4, (4,): 8, (5,): ValueError})
+
+    def test_dead_worker(self):
+        # The tasks that were in the pool with the one that killed its worker are run again, and only it is reported
+        expected = dict(((ii,), ii * 2) for ii in range(10))
+        expected.update({(3,): None, (5,): ValueError})
+        self.assertEqual(self._run([(ii,) for ii in range(10)], 2), expected)
+        self.assertEqual(self._run([(ii,) for ii in range(10)], 1, window=1), expected)
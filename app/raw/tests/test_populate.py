@@ -0,0 +1,273 @@
+# -*- coding: utf-8 -*-
+from datetime import date, datetime
+import cPickle
+import json
+import logging
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils.timezone import now, utc
+from raw.models import (RawCommittee, RawCouncilAgenda, RawCouncilQuestion, RawMember, Override, ParsedCommittee,
+                        ParsedCouncilMeeting, ParsedMembership, ParsedPerson, ParsedQuestion, SyncMark)
+from raw.models.parsed import (QUESTION_PARSER_FIELDS, MembershipParser, QuestionLookups, _parse_question_pair,
+                               parse_question)
+from raw.models.constants import LANG_CN, LANG_EN
+from raw.names import matchers
+
+
+logging.disable(logging.CRITICAL)
+
+
+class PopulateTestCase(TestCase):
+    def test_create_then_update(self):
+        for i in range(50):
+            RawCommittee.objects.create(uid=u'committee-{}'.format(i), code=u'C{}'.format(i), name_e=u'Panel {}'.format(i))
+        counts = ParsedCommittee.objects.populate(chunk_size=20)
+        self.assertEqual(counts, {'created': 50, 'updated': 0, 'skipped': 0, 'failed': 0})
+        self.assertEqual(ParsedCommittee.objects.get(uid=u'committee-3').name_e, u'Panel 3')
+
+        RawCommittee.objects.filter(uid=u'committee-3').update(name_e=u'Panel on Housing')
+        RawCommittee.objects.create(uid=u'committee-50', name_e=u'Panel 50')
+        with CaptureQueriesContext(connection) as queries:
+            counts = ParsedCommittee.objects.populate(chunk_size=20)
+        # A few queries per chunk, rather than a few per object
+        self.assertLess(len(queries), 25)
+        self.assertEqual(counts, {'created': 1, 'updated': 1, 'skipped': 49, 'failed': 0})
+        self.assertEqual(ParsedCommittee.objects.get(uid=u'committee-3').name_e, u'Panel on Housing')
+        self.assertEqual(ParsedCommittee.objects.count(), 51)
+
+    def test_duplicate_uids_are_skipped(self):
+        RawCommittee.objects.create(uid=u'committee-1', name_e=u'Panel')
+        ParsedCommittee.objects.create(uid=u'committee-1', name_e=u'Panel', name_c=u'')
+        ParsedCommittee.objects.create(uid=u'committee-1', name_e=u'Panel', name_c=u'')
+        counts = ParsedCommittee.objects.populate()
+        self.assertEqual(counts, {'created': 0, 'updated': 0, 'skipped': 1, 'failed': 0})
+
+    def test_meetings_of_both_languages(self):
+        for lang, suffix in ((LANG_EN, u'e'), (LANG_CN, u'c')):
+            RawCouncilAgenda.objects.create(uid=u'council_agenda-20140430-{}'.format(suffix), language=lang,
+                                            start_date=date(2014, 4, 30))
+        counts = ParsedCouncilMeeting.objects.populate()
+        self.assertEqual(counts['created'], 1)
+        self.assertEqual(ParsedCouncilMeeting.objects.get().uid, u'cmeeting-20140430')
+        counts = ParsedCouncilMeeting.objects.populate()
+        self.assertEqual(counts, {'created': 0, 'updated': 0, 'skipped': 1, 'failed': 0})
+
+    def test_persons(self):
+        RawMember.objects.create(uid=u'member-1', name_e=u'Emily LAU Wai-hing', name_c=u'劉慧卿', gender=1,
+                                 education_e=u'["University of Hong Kong"]')
+        generation = matchers.generation
+        counts = ParsedPerson.objects.populate()
+        self.assertEqual(counts['created'], 1)
+        person = ParsedPerson.objects.get(uid=u'member-1')
+        self.assertEqual(person.education_e, u'University of Hong Kong')
+        # The matchers of the persons are rebuilt
+        self.assertGreater(matchers.generation, generation)
+
+
+class SyncTestCase(TestCase):
+    def setUp(self):
+        for i in range(10):
+            RawCommittee.objects.create(uid=u'committee-{}'.format(i), name_e=u'Panel {}'.format(i))
+
+    def test_only_changed_objects(self):
+        counts = ParsedCommittee.objects.sync()
+        self.assertEqual(counts['created'], 10)
+        self.assertIsNotNone(SyncMark.objects.get(model=u'parsedcommittee').mark)
+        RawCommittee.objects.filter(uid=u'committee-3').update(name_e=u'Panel on Housing', last_parsed=now())
+        counts = ParsedCommittee.objects.sync()
+        self.assertEqual(counts, {'created': 0, 'updated': 1, 'skipped': 0, 'failed': 0, 'deactivated': 0})
+        self.assertEqual(ParsedCommittee.objects.get(uid=u'committee-3').name_e, u'Panel on Housing')
+        # Unless all of them are asked for
+        counts = ParsedCommittee.objects.sync(full=True)
+        self.assertEqual(counts['skipped'], 10)
+
+    def test_deleted_raw_objects(self):
+        ParsedCommittee.objects.sync()
+        RawCommittee.objects.filter(uid=u'committee-3').delete()
+        counts = ParsedCommittee.objects.sync()
+        self.assertEqual(counts['deactivated'], 1)
+        self.assertTrue(ParsedCommittee.objects.get(uid=u'committee-3').deactivate)
+        self.assertTrue(Override.objects.get(ref_uid=u'committee-3').is_deactivated())
+        # The override is lifted when the raw object is back
+        RawCommittee.objects.create(uid=u'committee-3', name_e=u'Panel 3', last_parsed=now())
+        ParsedCommittee.objects.sync()
+        self.assertFalse(ParsedCommittee.objects.get(uid=u'committee-3').deactivate)
+
+    def test_overrides(self):
+        ParsedCommittee.objects.sync()
+        override = Override.objects.create_from(ParsedCommittee.objects.get(uid=u'committee-5'))
+        override.merge_payload({'deactivate': True})
+        override.save()
+        counts = ParsedCommittee.objects.sync()
+        self.assertEqual(counts['deactivated'], 1)
+        # Populating again does not activate it
+        ParsedCommittee.objects.populate()
+        self.assertTrue(ParsedCommittee.objects.get(uid=u'committee-5').deactivate)
+        self.assertEqual(ParsedCommittee.objects.filter(deactivate=True).count(), 1)
+
+
+class MembershipPopulateTestCase(TestCase):
+    def setUp(self):
+        for i in range(30):
+            services = [
+                [u'1 October 1991 - 30 June 1997', u'Elected (Geographical Constituency - Hong Kong Island)'],
+                [u'1 July 1998 - ', u'Elected (Functional Constituency - Education)', u'(Resigned)'],
+            ]
+            RawMember.objects.create(uid=u'member-{}'.format(i), name_e=u'Member {}'.format(i),
+                                     service_e=json.dumps(services))
+            ParsedPerson.objects.create(uid=u'member-{}'.format(i), name_e=u'Member {}'.format(i), name_c=u'',
+                                        title_e=u'', title_c=u'', gender=1)
+        # A member without a ParsedPerson, and one without services
+        RawMember.objects.create(uid=u'member-30', service_e=u'[["1 July 1998 - ", "Appointed (Ex Officio)"]]')
+        RawMember.objects.create(uid=u'member-31')
+
+    def test_populate(self):
+        with CaptureQueriesContext(connection) as queries:
+            counts = ParsedMembership.objects.populate()
+        self.assertLess(len(queries), 15)
+        self.assertEqual(counts, {'created': 60, 'updated': 0, 'skipped': 0, 'failed': 1})
+        membership = ParsedMembership.objects.get(uid=u'member-3.19980701.functional-constituency-education')
+        self.assertEqual(membership.person, ParsedPerson.objects.get(uid=u'member-3'))
+        self.assertIsNone(membership.end_date)
+        self.assertEqual(membership.method_obtained, u'Elected')
+        self.assertEqual(membership.note, u'Resigned')
+        self.assertEqual(ParsedMembership.objects.filter(end_date=date(1997, 6, 30)).count(), 30)
+
+        ParsedMembership.objects.filter(uid=u'member-3.19980701.functional-constituency-education').update(note=u'')
+        counts = ParsedMembership.objects.populate()
+        self.assertEqual(counts, {'created': 0, 'updated': 1, 'skipped': 59, 'failed': 1})
+
+    def test_sync_deleted_member(self):
+        ParsedMembership.objects.sync()
+        RawMember.objects.filter(uid=u'member-3').delete()
+        counts = ParsedMembership.objects.sync()
+        self.assertEqual(counts['deactivated'], 2)
+        self.assertEqual(ParsedMembership.objects.filter(person__uid=u'member-3', deactivate=False).count(), 0)
+
+    def test_sync_member_before_its_person(self):
+        counts = ParsedMembership.objects.sync()
+        self.assertEqual(counts['failed'], 1)
+        ParsedPerson.objects.create(uid=u'member-30', name_e=u'Member 30', name_c=u'', title_e=u'', title_c=u'', gender=1)
+        # member-30 has not changed, but is read again
+        counts = ParsedMembership.objects.sync()
+        self.assertEqual(counts, {'created': 1, 'updated': 0, 'skipped': 0, 'failed': 0, 'deactivated': 0})
+        self.assertEqual(SyncMark.objects.get(model=u'parsedmembership').get_pending(), [])
+
+    def test_parse_dates(self):
+        parser = MembershipParser([u'29 February 2000 - 31 February 2001', u'Elected (Election Committee)'])
+        self.assertEqual(parser.start_date, date(2000, 2, 29))
+        self.assertIsNone(parser.end_date)
+        self.assertEqual(parser.parse_date(u'1 Julember 1998'), None)
+        self.assertEqual(parser.parse_date(u'1 JULY 1998'), date(1998, 7, 1))
+
+
+class QuestionPopulateTestCase(TestCase):
+    def setUp(self):
+        member = RawMember.objects.create(uid=u'member-1', name_e=u'Emily LAU Wai-hing', name_c=u'劉慧卿')
+        self.person = ParsedPerson.objects.create(uid=u'member-1', name_e=u'Emily LAU Wai-hing', name_c=u'劉慧卿',
+                                                  title_e=u'', title_c=u'', gender=1)
+        ParsedCouncilMeeting.objects.create(uid=u'cmeeting-20140430', start_date=datetime(2014, 4, 30, 11, tzinfo=utc))
+        for i in range(1, 11):
+            # The askers are only matched on the Chinese questions
+            RawCouncilQuestion.objects.create(uid=u'question-20140430-{}-e'.format(i), number_and_type=u'Q. {} (Oral)'.format(i),
+                                              language=LANG_EN, raw_date=u'30.4.2014')
+            RawCouncilQuestion.objects.create(uid=u'question-20140430-{}-c'.format(i), number_and_type=u'Q. {} (Oral)'.format(i),
+                                              language=LANG_CN, raw_date=u'30.4.2014', asker=member)
+        # A question of a cancelled meeting
+        RawCouncilQuestion.objects.create(uid=u'question-20130515-1-e', number_and_type=u'Q. 1 (Oral)', raw_date=u'15.5.2013')
+
+    def test_populate(self):
+        with CaptureQueriesContext(connection) as queries:
+            counts = ParsedQuestion.objects.populate(chunk_size=4)
+        # The lookups are loaded up front, so only the writes of each chunk are left
+        self.assertLess(len(queries), 25)
+        self.assertEqual(counts, {'created': 10, 'updated': 0, 'skipped': 1, 'failed': 0})
+        question = ParsedQuestion.objects.get(uid=u'cmeeting-20140430-q3')
+        self.assertEqual(question.asker, self.person)
+        self.assertEqual(question.question_type, ParsedQuestion.ORAL)
+
+        ParsedQuestion.objects.filter(uid=u'cmeeting-20140430-q3').update(number=30)
+        counts = ParsedQuestion.objects.populate(chunk_size=4)
+        self.assertEqual(counts, {'created': 0, 'updated': 1, 'skipped': 10, 'failed': 0})
+        self.assertEqual(ParsedQuestion.objects.get(uid=u'cmeeting-20140430-q3').number, 3)
+
+    def test_populate_workers(self):
+        # The pairs of raw questions are pickled to the workers, with the askers loaded with them
+        lookups = QuestionLookups().load()
+        pair = (lookups.raw_questions[u'question-20140430-3-e'], lookups.raw_questions[u'question-20140430-3-c'])
+        copied = cPickle.loads(cPickle.dumps(pair, cPickle.HIGHEST_PROTOCOL))
+        self.assertEqual([xx.uid for xx in copied], [xx.uid for xx in pair])
+        self.assertEqual(copied[1].asker.uid, u'member-1')
+        self.assertEqual(_parse_question_pair(copied), (None, None))
+
+        counts = ParsedQuestion.objects.populate(workers=2, chunk_size=4)
+        self.assertEqual(counts, {'created': 10, 'updated': 0, 'skipped': 1, 'failed': 0})
+        self.assertEqual(ParsedQuestion.objects.get(uid=u'cmeeting-20140430-q3').asker, self.person)
+
+    def test_sync_changed_questions(self):
+        ParsedQuestion.objects.sync()
+        ParsedQuestion.objects.all().update(number=30)
+        # The Chinese question is changed, the pair is populated again
+        RawCouncilQuestion.objects.filter(uid=u'question-20140430-3-c').update(last_parsed=now())
+        counts = ParsedQuestion.objects.sync()
+        # The question of the cancelled meeting is read again as well, in case the meeting turns up
+        self.assertEqual(counts, {'created': 0, 'updated': 1, 'skipped': 1, 'failed': 0, 'deactivated': 0})
+        self.assertEqual(ParsedQuestion.objects.get(uid=u'cmeeting-20140430-q3').number, 3)
+
+    def test_sync_question_before_its_meeting(self):
+        member = RawMember.objects.get(uid=u'member-1')
+        for lang, suffix in ((LANG_EN, u'e'), (LANG_CN, u'c')):
+            RawCouncilQuestion.objects.create(uid=u'question-20140515-1-{}'.format(suffix), number_and_type=u'Q. 1 (Oral)',
+                                              language=lang, raw_date=u'15.5.2014', asker=member)
+        ParsedQuestion.objects.sync()
+        self.assertFalse(ParsedQuestion.objects.filter(uid=u'cmeeting-20140515-q1').exists())
+        RawCouncilAgenda.objects.create(uid=u'council_agenda-20140515-e', language=LANG_EN, last_parsed=now())
+        counts = ParsedCouncilMeeting.objects.sync()
+        self.assertEqual(counts['created'], 1)
+        # The question has not changed, but is read again now that its meeting exists
+        counts = ParsedQuestion.objects.sync()
+        self.assertEqual(counts['created'], 1)
+        self.assertEqual(ParsedQuestion.objects.get(uid=u'cmeeting-20140515-q1').asker, self.person)
+        # Unlike the question of the cancelled meeting
+        self.assertEqual(SyncMark.objects.get(model=u'parsedquestion').get_pending(), [u'question-20130515-1-e'])
+
+    def test_sync_loads_changed_meetings(self):
+        other = RawMember.objects.create(uid=u'member-2', name_e=u'James TO Kun-sun', name_c=u'涂謹申')
+        ParsedPerson.objects.create(uid=u'member-2', name_e=u'James TO Kun-sun', name_c=u'涂謹申', title_e=u'', title_c=u'',
+                                    gender=1)
+        ParsedCouncilMeeting.objects.create(uid=u'cmeeting-20140507', start_date=datetime(2014, 5, 7, 11, tzinfo=utc))
+        for lang, suffix in ((LANG_EN, u'e'), (LANG_CN, u'c')):
+            RawCouncilQuestion.objects.create(uid=u'question-20140507-1-{}'.format(suffix), number_and_type=u'Q. 1 (Oral)',
+                                              language=lang, raw_date=u'7.5.2014', asker=other)
+        ParsedQuestion.objects.populate()
+        self.assertEqual(ParsedQuestion.objects.count(), 11)
+
+        # Only the meeting of the changed questions, its questions and their askers
+        lookups = QuestionLookups().load([u'question-20140430-3-e', u'question-20140430-3-c'])
+        self.assertEqual(sorted(lookups.raw_questions), [u'question-20140430-3-c', u'question-20140430-3-e'])
+        self.assertEqual(lookups.meetings.keys(), [u'cmeeting-20140430'])
+        self.assertEqual(lookups.persons.keys(), [u'member-1'])
+        self.assertEqual(sorted(lookups.questions), sorted(u'cmeeting-20140430-q{}'.format(i) for i in range(1, 11)))
+        self.assertIsNone(lookups.meeting(u'cmeeting-20140507'))
+
+        # And an incremental populate updates the changed question of the other meeting, with its asker
+        since = now()
+        ParsedQuestion.objects.all().update(number=30)
+        RawCouncilQuestion.objects.filter(uid=u'question-20140507-1-c').update(last_parsed=now())
+        counts = ParsedQuestion.objects.populate(since=since)
+        self.assertEqual(counts, {'created': 0, 'updated': 1, 'skipped': 0, 'failed': 0})
+        question = ParsedQuestion.objects.get(uid=u'cmeeting-20140507-q1')
+        self.assertEqual((question.number, question.asker.uid), (1, u'member-2'))
+        self.assertEqual(ParsedQuestion.objects.get(uid=u'cmeeting-20140430-q3').number, 30)
+
+    def test_parsed_fields(self):
+        raw_question = RawCouncilQuestion.objects.get(uid=u'question-20140430-1-e')
+        parsed = dict((field, u'{} e'.format(field)) for field, attr in QUESTION_PARSER_FIELDS)
+        parsed_cn = dict((field, u'{} c'.format(field)) for field, attr in QUESTION_PARSER_FIELDS)
+        question = ParsedQuestion.objects.create_from_raw(raw_question, parsed=(parsed, parsed_cn))
+        self.assertEqual(question.body_e, u'body e')
+        self.assertEqual(question.reply_c, u'reply c')
+        self.assertEqual(question.asker, self.person)
+        # Without a source, there is nothing to parse
+        self.assertIsNone(parse_question(raw_question))
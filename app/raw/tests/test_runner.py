@@ -0,0 +1,91 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Tests for running the processors in order of their dependencies
+
+import logging
+from django.test import SimpleTestCase, TestCase
+from legcowatch import celery_app
+from raw import tasks
+from raw.processors import runner
+from raw.processors.runner import ProcessRunner, check_dependencies, critical_path, processor_stages
+
+
+logging.disable(logging.CRITICAL)
+
+
+class DependenciesTestCase(SimpleTestCase):
+    def test_valid(self):
+        check_dependencies(['schedule_member', 'schedule_committee', 'schedule_membership'])
+        check_dependencies(['library_agenda'], {})
+
+    def test_unknown_dependency(self):
+        with self.assertRaisesRegexp(RuntimeError, 'Invalid dependency schedule_hansard of spider library_agenda'):
+            check_dependencies(['library_agenda'], {'library_agenda': ('schedule_hansard',)})
+
+    def test_cycle(self):
+        dependencies = {
+            'schedule_meeting': ('schedule_committee',),
+            'schedule_committee': ('schedule_member',),
+            'schedule_member': ('schedule_meeting',),
+        }
+        with self.assertRaisesRegexp(RuntimeError, 'Dependency cycle: schedule_meeting -> schedule_committee -> '
+                                                   'schedule_member -> schedule_meeting'):
+            check_dependencies(['schedule_meeting'], dependencies)
+
+
+class CriticalPathTestCase(SimpleTestCase):
+    def test_critical_path(self):
+        # a -> c -> d takes 1 + 5 + 1, b -> c -> d 3 + 5 + 1, and e runs on its own
+        dependencies = {'c': ('a', 'b'), 'd': ('c',)}
+        timings = {'a': 1.0, 'b': 3.0, 'c': 5.0, 'd': 1.0, 'e': 8.0}
+        self.assertEqual(critical_path(timings, dependencies), (['b', 'c', 'd'], 9.0))
+        timings['e'] = 10.0
+        self.assertEqual(critical_path(timings, dependencies), (['e'], 10.0))
+
+    def test_missing_timings(self):
+        # The dependencies that were not run do not count
+        self.assertEqual(critical_path({'c': 2.0, 'd': 1.0}, {'c': ('a', 'b'), 'd': ('c',)}), (['c', 'd'], 3.0))
+        self.assertEqual(critical_path({}, {}), ([], 0.0))
+
+
+class ProcessRunnerTestCase(TestCase):
+    def test_one_worker(self):
+        # The processors run in this process, and there is no scrape to process
+        report = ProcessRunner(['council_question', 'library_member'], workers=1).run()
+        self.assertEqual(sorted(report.timings), ['council_question', 'library_member'])
+        self.assertEqual(report.errors, {})
+        self.assertEqual(report.skipped, [])
+
+
+class ProcessorStagesTestCase(SimpleTestCase):
+    def test_stages(self):
+        spiders = ['schedule_membership', 'schedule_member', 'schedule_committee', 'library_agenda', 'schedule_meeting',
+                   'schedule_meeting_committee']
+        self.assertEqual(processor_stages(spiders), [
+            ['schedule_member', 'schedule_committee', 'library_agenda'],
+            ['schedule_membership', 'schedule_meeting_committee'],
+            ['schedule_meeting'],
+        ])
+        # Dependencies that are not part of the run do not hold back the processors
+        self.assertEqual(processor_stages(['schedule_meeting', 'schedule_committee']),
+                         [['schedule_meeting', 'schedule_committee']])
+        self.assertEqual(processor_stages([]), [])
+
+
+class ProcessStagesTestCase(SimpleTestCase):
+    def setUp(self):
+        self.eager = celery_app.conf.CELERY_ALWAYS_EAGER
+        celery_app.conf.CELERY_ALWAYS_EAGER = True
+        self.run_processor = runner.run_processor
+        self.processed = []
+        runner.run_processor = self.processed.append
+
+    def tearDown(self):
+        celery_app.conf.CELERY_ALWAYS_EAGER = self.eager
+        runner.run_processor = self.run_processor
+
+    def test_stages_in_order(self):
+        tasks.process_stages([['schedule_member', 'schedule_committee'], ['schedule_membership'], ['schedule_meeting']])
+        self.assertEqual(self.processed, ['schedule_member', 'schedule_committee', 'schedule_membership',
+                                          'schedule_meeting'])
@@ -0,0 +1,106 @@
+import json
+import logging
+import os
+import tempfile
+from django.test import TestCase
+from raw.models import RawCommittee, RawCommitteeMembership, RawMeeting, RawMeetingCommittee, RawScheduleMember
+from raw.processors.schedule import (ScheduleCommitteeProcessor, ScheduleMeetingCommitteeProcessor,
+                                     ScheduleMeetingProcessor, ScheduleMembershipProcessor)
+
+
+logging.disable(logging.CRITICAL)
+
+
+class ScheduleProcessorTestCase(TestCase):
+    def setUp(self):
+        self.files = []
+
+    def tearDown(self):
+        for path in self.files:
+            os.remove(path)
+
+    def _write_items(self, items):
+        fd, path = tempfile.mkstemp(suffix='.jl')
+        with os.fdopen(fd, 'wb') as f:
+            for item in items:
+                f.write(json.dumps(item) + '\n')
+        self.files.append(path)
+        return path
+
+    def _process(self, processor_class, items, batch_size=2):
+        processor = processor_class(self._write_items(items))
+        processor.batch_size = batch_size
+        processor.process()
+        return processor
+
+    def test_create_then_update(self):
+        items = [
+            {'id': i, 'code': 'C{}'.format(i), 'name_e': 'Committee {}'.format(i), 'name_c': '', 'url_e': '', 'url_c': ''}
+            for i in range(5)
+        ]
+        processor = self._process(ScheduleCommitteeProcessor, items)
+        self.assertEqual(processor._count_created, 5)
+        self.assertEqual(processor._count_updated, 0)
+        self.assertEqual(RawCommittee.objects.count(), 5)
+
+        items[3]['name_e'] = 'Renamed'
+        processor = self._process(ScheduleCommitteeProcessor, items)
+        self.assertEqual(processor._count_created, 0)
+        self.assertEqual(processor._count_updated, 5)
+        self.assertEqual(RawCommittee.objects.count(), 5)
+        self.assertEqual(RawCommittee.objects.get(uid='committee-3').name_e, 'Renamed')
+        self.assertEqual(RawCommittee.objects.get(uid='committee-4').name_e, 'Committee 4')
+
+    def test_duplicate_rows_are_errors(self):
+        RawCommittee.objects.create(uid='committee-1')
+        RawCommittee.objects.create(uid='committee-1')
+        items = [
+            {'id': i, 'code': 'C{}'.format(i), 'name_e': '', 'name_c': '', 'url_e': '', 'url_c': ''}
+            for i in (1, 2)
+        ]
+        processor = self._process(ScheduleCommitteeProcessor, items)
+        self.assertEqual(processor._count_error, 1)
+        self.assertEqual(processor._count_created, 1)
+
+    def test_related_objects(self):
+        RawScheduleMember.objects.create(uid='smember-1')
+        RawCommittee.objects.create(uid='committee-1')
+        items = [
+            {'id': 1, 'membership_id': 1, 'member_id': 1, 'committee_id': 1, 'post_e': '', 'post_c': '',
+             'start_date': '2012-10-01T00:00:00'},
+            {'id': 2, 'membership_id': 2, 'member_id': 2, 'committee_id': 1, 'post_e': '', 'post_c': ''},
+        ]
+        processor = self._process(ScheduleMembershipProcessor, items)
+        self.assertEqual(processor._count_created, 2)
+        first = RawCommitteeMembership.objects.get(uid='cmembership-1')
+        self.assertEqual(first.member.uid, 'smember-1')
+        self.assertEqual(first.committee.uid, 'committee-1')
+        self.assertIsNone(RawCommitteeMembership.objects.get(uid='cmembership-2').member)
+
+    def test_meeting_slots(self):
+        RawCommittee.objects.create(uid='committee-1')
+        RawCommittee.objects.create(uid='committee-2')
+        self._process(ScheduleMeetingCommitteeProcessor, [
+            {'id': 1, 'slot_id': 10, 'committee_id': 1},
+            {'id': 2, 'slot_id': 11, 'committee_id': 2},
+        ])
+        self.assertEqual(RawMeetingCommittee.objects.count(), 2)
+
+        # Two slots of the same meeting, the earliest start date is kept
+        meeting = {'subject_e': '', 'subject_c': '', 'agenda_url_e': '', 'agenda_url_c': '',
+                   'venue_code': '', 'meeting_type': ''}
+        items = [
+            dict(meeting, id=5, slot_id=11, start_date='2014-01-02T09:00:00'),
+            dict(meeting, id=5, slot_id=10, start_date='2014-01-01T09:00:00'),
+        ]
+        processor = self._process(ScheduleMeetingProcessor, items, batch_size=10)
+        self.assertEqual(processor._count_created, 1)
+        self.assertEqual(processor._count_updated, 1)
+        meeting = RawMeeting.objects.get(uid='meeting-5')
+        self.assertEqual(meeting.start_date.day, 1)
+        self.assertEqual(sorted(c.uid for c in meeting.committees.all()), ['committee-1', 'committee-2'])
+
+        processor = self._process(ScheduleMeetingProcessor, items)
+        self.assertEqual(processor._count_updated, 2)
+        self.assertEqual(RawMeeting.objects.count(), 1)
+        self.assertEqual(meeting.committees.count(), 2)
@@ -0,0 +1,92 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Tests for the timing of the stages of the parsers
+
+import json
+import logging
+import os
+import shutil
+import tempfile
+from django.test import SimpleTestCase
+# raw.models has to be imported before raw.docs.hansard, which it imports
+from raw.models.constants import LANG_EN
+from raw.docs import timing
+from raw.docs.agenda import CouncilAgenda
+from raw.docs.hansard import CouncilHansard
+
+
+logging.disable(logging.CRITICAL)
+
+
+class TimingTestCase(SimpleTestCase):
+    def setUp(self):
+        with open('raw/tests/fixtures/council_hansard-20150429-e.html', 'rb') as f:
+            self.src = f.read().decode('utf-8')
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def parse(self, **kwargs):
+        return CouncilHansard('council_hansard-20150429-e', LANG_EN, self.src, '20150429', question_index={}, **kwargs)
+
+    def test_stages(self):
+        records = timing.RecordList()
+        aggregator = timing.Aggregator()
+        with timing.sinks(records, aggregator):
+            self.parse()
+        self.assertEqual(len(records.records), 1)
+        record = records.records[0]
+        self.assertEqual(record['parser'], 'CouncilHansard')
+        self.assertEqual(record['uid'], 'council_hansard-20150429-e')
+        self.assertIsNone(record['exception'])
+        stages = [xx['stage'] for xx in record['stages']]
+        self.assertEqual(stages[:5], ['_load', '_clean', '_parse', '_parse_main_heading', '_parse_before_meeting'])
+        self.assertIn('_parse_oral_answers_to_questions', stages)
+        self.assertIn('_parse_bills', stages)
+        stage = record['stages'][stages.index('_parse_bills')]
+        self.assertGreater(stage['elements'], 0)
+        self.assertLessEqual(stage['seconds'], record['seconds'])
+        self.assertEqual(aggregator.documents, 1)
+        self.assertEqual(aggregator.stages['_parse_bills']['slowest_uid'], 'council_hansard-20150429-e')
+        self.assertEqual(len(aggregator.report()), len(stages) + 2)
+
+    def test_no_sinks(self):
+        records = timing.RecordList()
+        self.parse()
+        with timing.sinks(records):
+            pass
+        self.assertEqual(records.records, [])
+        self.assertEqual(timing._sinks, [])
+
+    def test_exception(self):
+        records = timing.RecordList()
+        with timing.sinks(records):
+            with self.assertRaises(Exception):
+                CouncilAgenda('council_agenda-20150429-e', None)
+        self.assertEqual(records.records[0]['stages'][0]['stage'], '_load')
+        self.assertIsNotNone(records.records[0]['stages'][0]['exception'])
+        self.assertIsNotNone(records.records[0]['exception'])
+
+    def test_json_lines(self):
+        path = '{}/timing.jsonl'.format(self.path)
+        with timing.sinks(timing.JSONLinesSink(path)):
+            self.parse()
+            self.parse()
+        with open(path, 'rb') as f:
+            lines = [json.loads(xx) for xx in f]
+        self.assertEqual([xx['uid'] for xx in lines], [u'council_hansard-20150429-e'] * 2)
+
+    def test_slowest_profiles(self):
+        profiles = timing.SlowestProfiles(2)
+        with timing.sinks(profiles):
+            for i in range(3):
+                self.parse()
+        slowest = profiles.slowest()
+        self.assertEqual(len(slowest), 2)
+        self.assertGreaterEqual(slowest[0][0], slowest[1][0])
+        self.assertGreater(slowest[0][2].total_calls, 0)
+        # The folder may exist already, made by another worker
+        self.assertEqual(len(profiles.dump(self.path)), 2)
+        self.assertEqual(len(profiles.dump(os.path.join(self.path, 'profiles'))), 2)
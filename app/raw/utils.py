@@ -7,7 +7,6 @@ from itertools import izip_longest
 from scrapy.crawler import Crawler
 from scrapy.utils.project import get_project_settings
 import magic
-import subprocess
 import pydocx
 import os
 import lxml.etree
@@ -15,6 +14,7 @@ import lxml.html
 from lxml.html import HTMLParser
 from lxml.html.clean import clean_html,Cleaner
 from logging import raiseExceptions
+from raw import conversion
 
 
 HTML = 1
@@ -59,42 +59,25 @@ def check_file_type(filepath, as_string=False):
 def doc_to_html(filepath, overwrite=False):
     """
     Converts a doc file to in-memory html string.
+    Conversions are cached by file content, see raw.conversion
 
     :param filepath: full filepath to the file to convert
+    :param overwrite: convert again even if the file is in the cache
     :return: unicode string
     """
-    html_file = '{}.html'.format(filepath)
-    if not os.path.exists(html_file) or overwrite:
-        cmd = ['abiword', '--to=html', '--to-name=fd://1', filepath]
-        try:
-            res = subprocess.check_output(cmd)
-        except:
-            return None
-        with open(html_file, 'wb') as tmp:
-            tmp.write(res)
-    else:
-        with open(html_file, 'rb') as tmp:
-            res = tmp.read()
-    return res.decode('utf-8')
+    return conversion.get_cache().convert(conversion.ABIWORD, filepath, overwrite=overwrite)
 
 
 def docx_to_html(filepath, overwrite=False):
     """
     Converts docx file to in-memory html string
+    Conversions are cached by file content, see raw.conversion
 
     :param filepath: full path to the file to convert
+    :param overwrite: convert again even if the file is in the cache
     :return: unicode string
     """
-    html_file = '{}.html'.format(filepath)
-    if not os.path.exists(html_file) or overwrite:
-        #res = pydocx.docx2html(filepath)
-        res = pydocx.PyDocX.to_html(filepath)
-        with open(html_file, 'wb') as tmp:
-            tmp.write(res.encode('utf-8'))
-    else:
-        with open(html_file, 'rb') as tmp:
-            res = tmp.read().decode('utf-8')
-    return res
+    return conversion.get_cache().convert(conversion.PYDOCX, filepath, overwrite=overwrite)
 
 
 def get_file_path(rel_path):
@@ -163,11 +146,8 @@ def merge_docx(docx_list=None, out_htmlpath=None):
         except:
             #'MalformedDocxException'
             try:
-                # Pretend it is a html
-                html_file = '{}.html'.format(path)
-                with open(html_file, 'rb') as tmp:
-                    tmp_html = tmp.read()
-                tmp_html = tmp_html.decode('utf-8')
+                # Probably a DOC instead
+                tmp_html = doc_to_html(path)
                 html_list.append(cleaner.clean_html(lxml.html.fromstring(tmp_html, parser=parser)))
             except:
                 # Cannot convert
@@ -29,18 +29,16 @@ class RawCouncilAgendaDetailView(DetailView):
         parser = self.object.get_parser()
         context['parser'] = parser
         
-        matcher = RawMember.get_matcher()
         questions = []
         if parser.questions is not None:
+            askers = [q.asker for q in parser.questions]
+            resolved = RawMember.resolve_names(askers, fuzzy=False)
+            #try Chinese for the others.
+            #This will be better handled when we have different language display
+            resolved.update(RawMember.resolve_names([xx for xx in askers if resolved[xx].member is None], english=False,
+                                                     fuzzy=False))
             for q in parser.questions:
-                name = MemberName(q.asker)
-                match = matcher.match(name)
-                if match==None:
-                #try Chinese. 
-                #This will be better handled when we have different language display
-                    matcher = RawMember.get_matcher(english=False)
-                    match = matcher.match(name)
-                obj = (q, match)
+                obj = (q, resolved[q.asker])
                 questions.append(obj)
         context['questions'] = questions
         return context
@@ -69,16 +67,19 @@ class RawCouncilHansardDetailView(DetailView):
         parser = self.object.get_parser()
         context['parser'] = parser
         if parser is not None:
-            if parser.language == LANG_EN:
-                matcher = RawMember.get_matcher()
-            elif parser.language == LANG_CN:
-                matcher = RawMember.get_matcher(english=False)
+            # Resolve all of the members attending at once
+            present = parser.members_present or []
+            absent = parser.members_absent or []
+            attendance = present + absent + ([parser.president] if parser.president is not None else [])
+            resolved = RawMember.resolve_names([xx[0] for xx in attendance], english=parser.language == LANG_EN,
+                                               fuzzy=False)
             if parser.president is not None:
-                name = MemberName(parser.president[0])
-                match = matcher.match(name)
-                if match is not None:
-                    obj = (parser.president, match)
+                resolution = resolved[parser.president[0]]
+                if resolution.member is not None:
+                    obj = (parser.president, resolution)
                     context['president']=obj
+            context['members_present'] = [(xx, resolved[xx[0]]) for xx in present]
+            context['members_absent'] = [(xx, resolved[xx[0]]) for xx in absent]
         return context
     
 class RawCouncilHansardSourceView(BaseDetailView):